@@ -0,0 +1,195 @@
+"""Content-addressed cache for bias analysis results.
+
+Entries are keyed on a hash of everything that determines the model output and
+live in a bounded in-memory LRU tier with a TTL, optionally backed by a SQLite
+file so hits survive restarts and are shared between workers on one host.
+Concurrent lookups of the same key are coalesced into a single upstream call.
+"""
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# (reply, report dict) as produced by the analysis
+CachedAnalysis = Tuple[str, Dict[str, Any]]
+
+
+def normalize_message(message: str) -> str:
+    """Collapse whitespace so trivially different submissions share a key"""
+    return re.sub(r"\s+", " ", message).strip()
+
+
+def analysis_cache_key(message: str, file_content: Optional[str], system_prompt: str,
+                       model: str, temperature: float, context: str = "") -> str:
+    """Hash the inputs that determine an analysis result; context is the conversation history, if any"""
+    digest = hashlib.sha256()
+    parts = [normalize_message(message), file_content or "", system_prompt, model, repr(temperature)]
+    if context:
+        # Only appended when present, so keys of history-free analyses are unchanged
+        parts.append(context)
+    for part in parts:
+        encoded = part.encode("utf-8")
+        # Length-prefix each part so boundaries can't be shifted between fields
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class SQLiteTier:
+    """On-disk cache tier shared by every worker pointing at the same file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " cost_seconds REAL NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+
+    def get(self, key: str) -> Optional[Tuple[CachedAnalysis, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, cost_seconds, expires_at FROM analysis_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[2] < time.time():
+                self._conn.execute("DELETE FROM analysis_cache WHERE key = ?", (key,))
+                return None
+        reply, report = json.loads(row[0])
+        return (reply, report), row[1]
+
+    def put(self, key: str, value: CachedAnalysis, cost_seconds: float, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_cache (key, value, cost_seconds, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), cost_seconds, expires_at),
+            )
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis_cache WHERE expires_at < ?", (time.time(),))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AnalysisCache:
+    """Two-tier LRU/TTL cache with single-flight coalescing of identical requests"""
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400, db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, Tuple[CachedAnalysis, float, float]]" = OrderedDict()
+        self._disk = SQLiteTier(db_path) if db_path else None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.upstream_seconds = 0.0
+
+    def _remember(self, key: str, value: CachedAnalysis, cost_seconds: float, expires_at: float):
+        self._memory[key] = (value, cost_seconds, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[CachedAnalysis]:
+        """Return a cached analysis, checking memory before disk"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, cost_seconds, expires_at = entry
+            if expires_at >= time.time():
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                self.saved_seconds += cost_seconds
+                return value
+            del self._memory[key]
+        if self._disk is not None:
+            found = await asyncio.to_thread(self._disk.get, key)
+            if found is not None:
+                value, cost_seconds = found
+                self._remember(key, value, cost_seconds, time.time() + self.ttl_seconds)
+                self.disk_hits += 1
+                self.saved_seconds += cost_seconds
+                return value
+        return None
+
+    async def put(self, key: str, value: CachedAnalysis, cost_seconds: float = 0.0):
+        """Store an analysis in both tiers"""
+        expires_at = time.time() + self.ttl_seconds
+        self._remember(key, value, cost_seconds, expires_at)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.put, key, value, cost_seconds, expires_at)
+
+    async def get_or_compute(self, key: str,
+                             compute: Callable[[], Awaitable[Tuple[CachedAnalysis, bool]]]) -> CachedAnalysis:
+        """Return the cached analysis for key, computing it at most once across concurrent callers.
+
+        compute returns (value, cacheable); an uncacheable value (e.g. a fallback answer) still
+        goes to every waiter but isn't stored. The computation runs in its own task, so a caller
+        that is cancelled (e.g. its client disconnected) stops waiting without failing the others.
+        Exceptions from compute are propagated to every waiter and nothing is cached.
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            return cached
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._compute(key, compute))
+            # Waiters re-raise a failure; don't log it as unhandled if they all left
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return await asyncio.shield(task)
+
+    async def _compute(self, key: str,
+                       compute: Callable[[], Awaitable[Tuple[CachedAnalysis, bool]]]) -> CachedAnalysis:
+        started = time.perf_counter()
+        try:
+            value, cacheable = await compute()
+            cost_seconds = time.perf_counter() - started
+            self.upstream_seconds += cost_seconds
+            if cacheable:
+                await self.put(key, value, cost_seconds)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for monitoring how much work the cache saves"""
+        hits = self.memory_hits + self.disk_hits + self.coalesced
+        lookups = hits + self.misses
+        return {
+            "memoryHits": self.memory_hits,
+            "diskHits": self.disk_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hitRate": hits / lookups if lookups else 0.0,
+            "entries": len(self._memory),
+            "inflight": len(self._inflight),
+            "savedSeconds": round(self.saved_seconds, 3),
+            "upstreamSeconds": round(self.upstream_seconds, 3),
+            "persistent": self._disk is not None,
+        }
+
+    async def close(self):
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.purge_expired)
+            self._disk.close()
@@ -0,0 +1,181 @@
+"""Extract-once derived artifacts for uploaded files.
+
+When a file is uploaded (or first used in a chat) it is processed once into:
+- text.txt: the decoded, newline-normalized text (for Parquet, a CSV rendering
+  of the sampled rows)
+- summary.json: format, size, and for tabular files the columns, row count,
+  fairness metrics and a stratified sample with column statistics (see
+  tabular_sample), all from one pass over the file
+
+Artifacts are stored on local disk under the file's SHA-256 and evicted least
+recently used first once the cache exceeds its byte budget. Writes go through a
+temporary directory and an atomic rename, so several workers can share one
+cache directory.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from fairness_metrics import FairnessMetricsError, compute_fairness_metrics, detect_tabular_format
+from tabular_sample import TabularSampler
+
+logger = logging.getLogger(__name__)
+
+TEXT_FILE = "text.txt"
+SUMMARY_FILE = "summary.json"
+COPY_CHUNK_CHARS = 1024 * 1024
+
+
+def _copy_normalized_text(source_path: str, text_path: str):
+    """Decode as UTF-8 (dropping invalid bytes) with universal newlines and no NULs"""
+    with open(source_path, encoding="utf-8", errors="ignore", newline=None) as src, \
+            open(text_path, "w", encoding="utf-8", newline="\n") as dst:
+        while chunk := src.read(COPY_CHUNK_CHARS):
+            dst.write(chunk.replace("\x00", ""))
+
+
+def _rows_as_csv(header: List[str], rows: List[List[str]]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue()
+
+
+def extract_artifacts(source_path: str, file_name: Optional[str], target_dir: str) -> Dict[str, Any]:
+    """Write text.txt and summary.json for a file into target_dir and return the summary"""
+    file_format = detect_tabular_format(file_name) or "text"
+    summary: Dict[str, Any] = {
+        "format": file_format,
+        "sizeBytes": os.path.getsize(source_path),
+        "extractedAt": time.time(),
+    }
+    text_path = os.path.join(target_dir, TEXT_FILE)
+
+    if file_format != "text":
+        sampler = TabularSampler()
+        try:
+            metrics = compute_fairness_metrics(source_path, file_format, on_batch=sampler.add_batch)
+            summary.update({
+                "columns": metrics["columns"],
+                "rowCount": metrics["rows"],
+                "sample": sampler.result(),
+                "fairnessMetrics": metrics,
+            })
+        except FairnessMetricsError as e:
+            logger.warning(f"Could not read {file_name} as a table: {str(e)}")
+        if file_format == "parquet":
+            sample = summary.get("sample", {})
+            rows = [row for stratum in sample.get("strata", []) for row in stratum["rows"]]
+            with open(text_path, "w", encoding="utf-8") as f:
+                f.write(_rows_as_csv(summary.get("columns", []), rows))
+    if not os.path.exists(text_path):
+        _copy_normalized_text(source_path, text_path)
+
+    summary["textBytes"] = os.path.getsize(text_path)
+    with open(os.path.join(target_dir, SUMMARY_FILE), "w", encoding="utf-8") as f:
+        json.dump(summary, f)
+    return summary
+
+
+class ArtifactCache:
+    """Size-bounded on-disk store of extracted artifacts keyed by file hash"""
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, file_hash: str) -> str:
+        return os.path.join(self.root, file_hash[:2], file_hash)
+
+    def get_summary(self, file_hash: str) -> Optional[Dict[str, Any]]:
+        """Return the stored summary, or None if the file hasn't been extracted"""
+        path = os.path.join(self._dir(file_hash), SUMMARY_FILE)
+        try:
+            with open(path, encoding="utf-8") as f:
+                summary = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        # Directory mtime doubles as the LRU timestamp
+        os.utime(self._dir(file_hash))
+        self.hits += 1
+        return summary
+
+    def read_text(self, file_hash: str, limit: Optional[int] = None) -> str:
+        """Read up to limit characters (or everything) of the extracted text"""
+        with open(os.path.join(self._dir(file_hash), TEXT_FILE), encoding="utf-8") as f:
+            return f.read(-1 if limit is None else limit)
+
+    def put(self, file_hash: str, source_path: str, file_name: Optional[str]) -> Dict[str, Any]:
+        """Extract artifacts for a file and store them under its hash"""
+        final_dir = self._dir(file_hash)
+        os.makedirs(os.path.dirname(final_dir), exist_ok=True)
+        work_dir = tempfile.mkdtemp(prefix=".extract-", dir=self.root)
+        try:
+            summary = extract_artifacts(source_path, file_name, work_dir)
+            try:
+                os.rename(work_dir, final_dir)
+            except OSError:
+                # Another worker stored the same file first
+                shutil.rmtree(work_dir, ignore_errors=True)
+                return summary
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        self._account(self._dir_size(final_dir))
+        return summary
+
+    @staticmethod
+    def _dir_size(path: str) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def _entries(self) -> List[tuple[float, int, str]]:
+        entries = []
+        for shard in os.scandir(self.root):
+            if not shard.is_dir() or shard.name.startswith("."):
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.is_dir():
+                    entries.append((entry.stat().st_mtime, self._dir_size(entry.path), entry.path))
+        return entries
+
+    def _account(self, added: int):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._total_bytes += added
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Remove least recently used artifacts until the cache is back under budget"""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+        self._total_bytes = total
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "bytes": self._total_bytes,
+            "maxBytes": self.max_bytes,
+        }
@@ -0,0 +1,392 @@
+"""Batch analysis jobs backed by a local SQLite queue.
+
+A job is a list of items (texts or uploaded file URLs) analysed by a bounded
+pool of asyncio workers. Every item's state lives in SQLite, so:
+- results are persisted as each item completes
+- items are claimed with a lease that running workers renew; if a process dies,
+  its items are picked up again once their lease expires, so jobs resume after
+  a restart
+- several app workers on one host can share the same queue file
+
+Workers pick the job with the fewest running items first, so one large job
+doesn't hold every worker while a newer job waits.
+"""
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_JOB_STATUSES = ("completed", "cancelled")
+ITEM_STATUSES = ("pending", "running", "done", "failed", "cancelled")
+
+# Runs one claimed item (with its job's user_id and options): -> (result, stored report id)
+ItemRunner = Callable[[Dict[str, Any]], Awaitable[Tuple[Dict[str, Any], Optional[str]]]]
+
+
+class JobStore:
+    """SQLite tables for jobs and their items"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        """Connect and create the tables (called at startup)"""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY,"
+            " user_id TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " options TEXT NOT NULL,"
+            " total INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_jobs_user_created ON jobs(user_id, created_at DESC);"
+            "CREATE TABLE IF NOT EXISTS job_items ("
+            " job_id TEXT NOT NULL REFERENCES jobs(id) ON DELETE CASCADE,"
+            " idx INTEGER NOT NULL,"
+            " kind TEXT NOT NULL,"
+            " input TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " lease_until REAL,"
+            " result TEXT,"
+            " error TEXT,"
+            " report_id TEXT,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (job_id, idx));"
+            "CREATE INDEX IF NOT EXISTS idx_job_items_status ON job_items(job_id, status);"
+        )
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        # IMMEDIATE takes the write lock up front, so claims from other processes serialize
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def create_job(self, user_id: str, options: Dict[str, Any], items: List[Tuple[str, str]]) -> str:
+        job_id = str(uuid.uuid4())
+        now = time.time()
+
+        def insert(conn: sqlite3.Connection):
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, status, options, total, created_at, updated_at)"
+                " VALUES (?, ?, 'queued', ?, ?, ?, ?)",
+                (job_id, user_id, json.dumps(options), len(items), now, now),
+            )
+            conn.executemany(
+                "INSERT INTO job_items (job_id, idx, kind, input, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, index, kind, value, now) for index, (kind, value) in enumerate(items)],
+            )
+
+        self._transaction(insert)
+        return job_id
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Job row with per-status item counts"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            counts = dict(self._conn.execute(
+                "SELECT status, COUNT(*) FROM job_items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+        return self._job_dict(row, counts)
+
+    def list_jobs(self, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (user_id, limit)
+            ).fetchall()
+        return [self._job_dict(row) for row in rows]
+
+    @staticmethod
+    def _job_dict(row: sqlite3.Row, counts: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+        job = {
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "status": row["status"],
+            "options": json.loads(row["options"]),
+            "total": row["total"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+        if counts is not None:
+            job["counts"] = {status: counts.get(status, 0) for status in ITEM_STATUSES}
+        return job
+
+    def claim(self, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Lease the next runnable item, favouring the active job with the fewest running items"""
+        now = time.time()
+
+        def claim_next(conn: sqlite3.Connection):
+            claimable = "(i.status = 'pending' OR (i.status = 'running' AND i.lease_until < :now))"
+            job = conn.execute(
+                "SELECT j.id, j.user_id, j.options FROM jobs j"
+                " WHERE j.status IN ('queued', 'running')"
+                f" AND EXISTS (SELECT 1 FROM job_items i WHERE i.job_id = j.id AND {claimable})"
+                " ORDER BY (SELECT COUNT(*) FROM job_items r WHERE r.job_id = j.id AND r.status = 'running'),"
+                " j.created_at LIMIT 1",
+                {"now": now},
+            ).fetchone()
+            if job is None:
+                return None
+            item = conn.execute(
+                "UPDATE job_items SET status = 'running', attempts = attempts + 1,"
+                " lease_until = :lease_until, updated_at = :now"
+                " WHERE rowid = (SELECT i.rowid FROM job_items i"
+                f"  WHERE i.job_id = :job_id AND {claimable} ORDER BY i.idx LIMIT 1)"
+                " RETURNING job_id, idx, kind, input, attempts",
+                {"now": now, "lease_until": now + lease_seconds, "job_id": job["id"]},
+            ).fetchone()
+            conn.execute(
+                "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                (now, job["id"]),
+            )
+            return {
+                "job_id": item["job_id"],
+                "index": item["idx"],
+                "kind": item["kind"],
+                "input": item["input"],
+                "attempts": item["attempts"],
+                "user_id": job["user_id"],
+                "options": json.loads(job["options"]),
+            }
+
+        return self._transaction(claim_next)
+
+    def renew(self, job_id: str, index: int, lease_seconds: float):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_items SET lease_until = ? WHERE job_id = ? AND idx = ? AND status = 'running'",
+                (time.time() + lease_seconds, job_id, index),
+            )
+
+    def finish(self, job_id: str, index: int, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None, report_id: Optional[str] = None):
+        """Record an item's outcome and complete the job once nothing is left to run"""
+        now = time.time()
+
+        def record(conn: sqlite3.Connection):
+            # Only a still-running item is updated: a cancelled one keeps its status
+            conn.execute(
+                "UPDATE job_items SET status = ?, result = ?, error = ?, report_id = ?, lease_until = NULL,"
+                " updated_at = ? WHERE job_id = ? AND idx = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, report_id, now, job_id, index),
+            )
+            self._complete_if_drained(conn, job_id, now)
+
+        self._transaction(record)
+
+    def release(self, job_id: str, index: int):
+        """Put a running item back in the queue (on shutdown)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_items SET status = 'pending', lease_until = NULL, updated_at = ?"
+                " WHERE job_id = ? AND idx = ? AND status = 'running'",
+                (time.time(), job_id, index),
+            )
+
+    @staticmethod
+    def _complete_if_drained(conn: sqlite3.Connection, job_id: str, now: float):
+        conn.execute(
+            "UPDATE jobs SET status = 'completed', updated_at = ? WHERE id = ? AND status = 'running'"
+            " AND NOT EXISTS (SELECT 1 FROM job_items WHERE job_id = ? AND status IN ('pending', 'running'))",
+            (now, job_id, job_id),
+        )
+
+    def cancel(self, job_id: str):
+        """Stop a job: items not yet finished are marked cancelled"""
+        now = time.time()
+
+        def cancel_job(conn: sqlite3.Connection):
+            conn.execute(
+                "UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status IN ('queued', 'running')",
+                (now, job_id),
+            )
+            conn.execute(
+                "UPDATE job_items SET status = 'cancelled', lease_until = NULL, updated_at = ?"
+                " WHERE job_id = ? AND status IN ('pending', 'running')",
+                (now, job_id),
+            )
+
+        self._transaction(cancel_job)
+
+    def resume(self, job_id: str, retry_failed: bool):
+        """Re-queue a job's cancelled (and optionally failed) items"""
+        now = time.time()
+        statuses = ("cancelled", "failed") if retry_failed else ("cancelled",)
+
+        def resume_job(conn: sqlite3.Connection):
+            conn.execute(
+                f"UPDATE job_items SET status = 'pending', error = NULL, updated_at = ?"
+                f" WHERE job_id = ? AND status IN ({', '.join('?' for _ in statuses)})",
+                (now, job_id, *statuses),
+            )
+            conn.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (now, job_id))
+            self._complete_if_drained(conn, job_id, now)
+
+        self._transaction(resume_job)
+
+    def unfinished_inputs(self, kind: str) -> List[str]:
+        """Inputs of a kind (e.g. file URLs) of items that may still run, resumed ones included"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT input FROM job_items WHERE kind = ? AND status != 'done'", (kind,)
+            ).fetchall()
+        return [row["input"] for row in rows]
+
+    def results(self, job_id: str, after: int, limit: int) -> List[Dict[str, Any]]:
+        """Items after index `after`, in order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT idx, kind, input, status, attempts, result, error, report_id FROM job_items"
+                " WHERE job_id = ? AND idx > ? ORDER BY idx LIMIT ?",
+                (job_id, after, limit),
+            ).fetchall()
+        return [{
+            "index": row["idx"],
+            "kind": row["kind"],
+            "input": row["input"] if row["kind"] == "file" else None,
+            "status": row["status"],
+            "attempts": row["attempts"],
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "report_id": row["report_id"],
+        } for row in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class JobWorkerPool:
+    """Bounded set of asyncio workers draining the job queue"""
+
+    def __init__(self, store: JobStore, run_item: ItemRunner, workers: int = 4,
+                 lease_seconds: float = 60.0, poll_seconds: float = 2.0):
+        self.store = store
+        self.run_item = run_item
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[Tuple[str, int], asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self._changed = asyncio.Condition()
+        self.completed = 0
+        self.failed = 0
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Tell idle workers new items are queued"""
+        self._wakeup.set()
+
+    async def _notify(self):
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def wait_for_change(self, timeout: float):
+        """Return when an item changes state in this process, or after timeout (for other processes)"""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def cancel_job(self, job_id: str):
+        await asyncio.to_thread(self.store.cancel, job_id)
+        for (running_job, _), task in list(self._running.items()):
+            if running_job == job_id:
+                task.cancel()
+        await self._notify()
+
+    async def _heartbeat(self, item: Dict[str, Any]):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            await asyncio.to_thread(self.store.renew, item["job_id"], item["index"], self.lease_seconds)
+
+    async def _worker(self):
+        while True:
+            try:
+                item = await asyncio.to_thread(self.store.claim, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Job claim error: {str(e)}")
+                item = None
+            if item is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._notify()
+            await self._process(item)
+
+    async def _process(self, item: Dict[str, Any]):
+        key = (item["job_id"], item["index"])
+        task = asyncio.create_task(self.run_item(item))
+        heartbeat = asyncio.create_task(self._heartbeat(item))
+        self._running[key] = task
+        try:
+            # Waiting (rather than awaiting the task) tells a cancelled item apart from worker shutdown
+            await asyncio.wait([task])
+        except asyncio.CancelledError:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.to_thread(self.store.release, *key)
+            raise
+        finally:
+            heartbeat.cancel()
+            del self._running[key]
+
+        if task.cancelled():
+            # Job was cancelled; the store already marked the item
+            return
+        try:
+            if task.exception() is not None:
+                self.failed += 1
+                logger.error(f"Job {key[0]} item {key[1]} failed: {str(task.exception())}")
+                await asyncio.to_thread(self.store.finish, *key, "failed", error=str(task.exception()))
+            else:
+                result, report_id = task.result()
+                self.completed += 1
+                await asyncio.to_thread(self.store.finish, *key, "done", result=result, report_id=report_id)
+        except Exception as e:
+            logger.error(f"Job {key[0]} item {key[1]} could not be recorded: {str(e)}")
+        await self._notify()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "running": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+        }
@@ -0,0 +1,112 @@
+"""Concurrent /api/chat throughput against in-process fakes of OpenAI and Supabase.
+
+Each fake upstream call sleeps for a fixed latency, so a non-blocking request
+path should scale throughput with the number of in-flight requests while a
+blocking one stays flat.
+
+Usage (from backend/):
+    python benchmarks/bench_chat_concurrency.py [--llm-latency 0.2] [--db-latency 0.02]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+import httpx
+import jwt
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+os.environ.setdefault("SUPABASE_URL", "http://supabase.local")
+os.environ.setdefault("SUPABASE_ANON_KEY", jwt.encode({"role": "anon"}, "bench-anon-signing-key-0123456789abcdef"))
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+os.environ.setdefault("JWT_SECRET", "bench-jwt-signing-key-0123456789abcdef")
+
+import main  # noqa: E402
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+COMPLETION_TEXT = """The dataset looks skewed toward one group.
+
+---BIAS_REPORT_START---
+{"bias_detected": true, "reasons": ["Sampling bias"], "fixes": ["Rebalance the sample"]}
+---BIAS_REPORT_END---"""
+
+
+def fake_upstream(llm_latency: float, db_latency: float) -> httpx.MockTransport:
+    """Transport answering OpenAI and PostgREST calls after a fixed delay"""
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/chat/completions"):
+            await asyncio.sleep(llm_latency)
+            return httpx.Response(200, json={
+                "id": "chatcmpl-bench",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "gpt-4o-mini",
+                "choices": [{
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": COMPLETION_TEXT},
+                }],
+                "usage": {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150},
+            })
+        await asyncio.sleep(db_latency)
+        if request.url.path.endswith("/rpc/save_chat_turn"):
+            # Returns the appended message rows, like the real function (the report insert is a no-op here)
+            body = json.loads(request.content)
+            return httpx.Response(200, json=[
+                {"chat_id": body["p_chat_id"], "seq": seq, "user_id": body["p_user_id"],
+                 "role": m["role"], "content": m["content"], "created_at": m["timestamp"]}
+                for seq, m in enumerate(body["p_messages"], start=1)
+            ])
+        if request.method == "GET":
+            return httpx.Response(200, json=[])
+        return httpx.Response(201, json=[json.loads(request.content or b"{}")])
+    return httpx.MockTransport(handler)
+
+
+async def run_level(client: httpx.AsyncClient, token: str, concurrency: int, requests_per_worker: int) -> float:
+    """Drive /api/chat with `concurrency` in-flight requests, returning requests per second"""
+    async def worker():
+        for _ in range(requests_per_worker):
+            response = await client.post(
+                "/api/chat",
+                params={"authorization": f"Bearer {token}"},
+                # Unique message per request so every call misses the analysis cache
+                json={"chatId": str(uuid.uuid4()), "message": f"Is this hiring data biased? ({uuid.uuid4()})"},
+            )
+            response.raise_for_status()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return concurrency * requests_per_worker / elapsed
+
+
+async def main_async(args):
+    main.HTTP_TRANSPORT = fake_upstream(args.llm_latency, args.db_latency)
+    token = jwt.encode(
+        {"user_id": str(uuid.uuid4()), "email": "bench@example.com", "username": "bench"},
+        main.JWT_SECRET,
+        algorithm=main.JWT_ALGORITHM,
+    )
+    async with main.lifespan(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            print(f"{'in-flight':>10} {'req/s':>10}")
+            for concurrency in args.levels:
+                rps = await run_level(client, token, concurrency, args.requests_per_worker)
+                print(f"{concurrency:>10} {rps:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--db-latency", type=float, default=0.02)
+    parser.add_argument("--requests-per-worker", type=int, default=5)
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""LLMScheduler fairness and rate-limit handling against the local fake OpenAI server.
+
+One "batch" user floods the scheduler while a few interactive users submit a
+handful of calls each. With fair queuing the interactive users' waits stay
+short, and 429s from the fake server are retried after Retry-After instead of
+failing.
+
+Usage (from backend/):
+    python benchmarks/bench_llm_scheduler.py [--batch-calls 100] [--max-concurrency 8]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+import httpx
+import uvicorn
+from openai import AsyncOpenAI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_openai import create_app  # noqa: E402
+from llm_scheduler import LLMScheduler  # noqa: E402
+
+logging.getLogger("llm_scheduler").setLevel(logging.ERROR)
+
+
+async def start_server(app, port: int) -> tuple[uvicorn.Server, asyncio.Task]:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    return server, task
+
+
+async def main_async(args):
+    server, server_task = await start_server(
+        create_app(latency=args.latency, max_concurrent=args.server_limit, retry_after=args.retry_after,
+                   error_rate=args.error_rate),
+        args.port,
+    )
+    client = AsyncOpenAI(api_key="sk-fake", base_url=f"http://127.0.0.1:{args.port}/v1", max_retries=0)
+    scheduler = LLMScheduler(max_concurrency=args.max_concurrency, tokens_per_minute=args.tpm,
+                             base_delay=0.1, max_delay=5)
+    waits = {}
+
+    async def call(user_id: str):
+        started = time.perf_counter()
+        await scheduler.run(user_id, 500, lambda: client.chat.completions.create(
+            model="gpt-4o-mini", messages=[{"role": "user", "content": "Is this biased?"}], max_tokens=100
+        ))
+        waits.setdefault(user_id, []).append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    batch = [asyncio.create_task(call("batch-user")) for _ in range(args.batch_calls)]
+    await asyncio.sleep(0.05)  # Let the batch fill the queue first
+    interactive = [call(f"user-{u}") for u in range(args.interactive_users) for _ in range(args.interactive_calls)]
+    await asyncio.gather(*batch, *interactive)
+    elapsed = time.perf_counter() - started
+
+    async with httpx.AsyncClient() as http:
+        server_stats = (await http.get(f"http://127.0.0.1:{args.port}/stats")).json()
+    await client.close()
+    server.should_exit = True
+    await server_task
+
+    print(f"total time: {elapsed:.2f}s")
+    print(f"{'user':<12} {'calls':>6} {'p50 s':>8} {'max s':>8}")
+    for user_id, latencies in sorted(waits.items()):
+        print(f"{user_id:<12} {len(latencies):>6} {statistics.median(latencies):>8.2f} {max(latencies):>8.2f}")
+    print(f"server: {server_stats}")
+    print(f"scheduler: {scheduler.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--batch-calls", type=int, default=100)
+    parser.add_argument("--interactive-users", type=int, default=4)
+    parser.add_argument("--interactive-calls", type=int, default=3)
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--server-limit", type=int, default=6, help="Concurrent calls before the fake server returns 429")
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--tpm", type=int, default=1_000_000)
+    asyncio.run(main_async(parser.parse_args()))
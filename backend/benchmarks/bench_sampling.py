@@ -0,0 +1,99 @@
+"""Representativeness and size of the file content sent for large tables.
+
+Writes CSVs of growing size, sorted by a protected attribute so the rare group
+comes last, and compares what a single analysis call would see:
+- head: the first FILE_CONTENT_LIMIT characters of the file
+- sample: render_sample() of the stratified sample taken while extracting it
+For each, it reports the prompt size, the share of rows from the rare group
+(against its share of the whole file) and the outcome rate among them.
+The sample's size stays put as the file grows and its shares track the file's;
+the head sees none of the rare group.
+
+Usage (from backend/):
+    python benchmarks/bench_sampling.py [--rows 10000 100000 1000000] [--budget 5000]
+"""
+import argparse
+import csv
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fairness_metrics import compute_fairness_metrics  # noqa: E402
+from tabular_sample import TabularSampler, render_sample  # noqa: E402
+
+HEADER = ["id", "gender", "age", "income", "approved"]
+
+
+def write_table(path: str, rows: int, minority_share: float, seed: int = 0):
+    """Applicants sorted by gender (majority first), with a lower approval rate for the minority"""
+    rng = np.random.default_rng(seed)
+    minority = rng.random(rows) < minority_share
+    approved = rng.random(rows) < np.where(minority, 0.35, 0.6)
+    order = np.argsort(minority, kind="stable")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+        for start in range(0, rows, 100_000):
+            index = order[start:start + 100_000]
+            writer.writerows(zip(
+                index,
+                np.where(minority[index], "female", "male"),
+                rng.integers(18, 80, len(index)),
+                np.round(rng.lognormal(10, 0.5, len(index)), 2),
+                approved[index].astype(int),
+            ))
+
+
+def sampled_rows(text: str) -> list:
+    """Rows of the CSV part of a prompt text (everything from the header line on)"""
+    start = text.find(",".join(HEADER))
+    if start < 0:
+        return []
+    return list(csv.DictReader(io.StringIO(text[start:])))[:-1]  # The last row may be cut off
+
+
+def describe(rows: list) -> str:
+    minority = [row for row in rows if row.get("gender") == "female"]
+    share = len(minority) / len(rows) if rows else 0.0
+    rate = sum(row["approved"] == "1" for row in minority) / len(minority) if minority else float("nan")
+    return f"{len(rows):>5} rows, female {share:>6.1%}, female approval {rate:>6.1%}"
+
+
+def main(args):
+    workdir = tempfile.mkdtemp(prefix="biasbuster-sampling-")
+    print(f"{'rows':>9} {'file MB':>8} {'extract s':>9}  {'content':<8} {'chars':>6}  sent rows")
+    for rows in args.rows:
+        path = os.path.join(workdir, f"{rows}.csv")
+        write_table(path, rows, args.minority_share)
+        sampler = TabularSampler()
+        started = time.perf_counter()
+        metrics = compute_fairness_metrics(path, "csv", on_batch=sampler.add_batch)
+        seconds = time.perf_counter() - started
+        with open(path, encoding="utf-8") as f:
+            head = f.read(args.budget)
+        sample = render_sample(sampler.result(), args.budget)
+
+        size = os.path.getsize(path) / 1e6
+        print(f"{rows:>9} {size:>8.1f} {seconds:>9.2f}  {'head':<8} {len(head):>6}  {describe(sampled_rows(head))}")
+        print(f"{'':>28}  {'sample':<8} {len(sample):>6}  {describe(sampled_rows(sample))}")
+        gender = next(attribute for attribute in metrics["attributes"] if attribute["column"] == "gender")
+        groups = {group["value"]: group for group in gender["groups"]}
+        female = groups.get("female", {})
+        print(f"{'':>28}  {'file':<8} {'':>6}  {rows:>5} rows, female {female.get('share', 0):>6.1%}, "
+              f"female approval {female.get('positiveRate', float('nan')):>6.1%}")
+        os.remove(path)
+    os.rmdir(workdir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--budget", type=int, default=5000, help="Characters of file content per call")
+    parser.add_argument("--minority-share", type=float, default=0.1)
+    main(parser.parse_args())
@@ -0,0 +1,190 @@
+"""Startup time of the API: import time and time to first successful response.
+
+Measures, over a number of fresh processes:
+- import: seconds to `import main` in a new interpreter
+- first200: seconds from launching uvicorn to the first 200 from GET /
+- ready: seconds until GET /ready returns 200 (clients open, pools connected)
+- firstApi200: seconds until an authenticated GET /api/history returns 200
+against the local fake Supabase and OpenAI servers, and reports the median of
+each. --importtime also lists the slowest modules imported by `import main`.
+
+Save a run with --json and pass it back as --baseline to fail (exit 1) when a
+median grows by more than --tolerance.
+
+Usage (from backend/):
+    python benchmarks/bench_startup.py [--trials 5] [--importtime]
+    python benchmarks/bench_startup.py --json > startup.json
+    python benchmarks/bench_startup.py --baseline startup.json --tolerance 0.25
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List
+
+import httpx
+import jwt
+
+from load_test import BACKEND_DIR, BENCH_DIR, JWT_SECRET, free_port, spawn, stop, wait_until_up
+
+IMPORT_SNIPPET = "import time; started = time.perf_counter(); import main; print(time.perf_counter() - started)"
+
+
+def app_env(supabase_url: str, openai_url: str, workdir: str) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "SUPABASE_URL": supabase_url,
+        "SUPABASE_ANON_KEY": jwt.encode({"role": "anon"}, "load-test-anon-signing-key-0123456789"),
+        "OPENAI_API_KEY": "sk-load-test",
+        "OPENAI_BASE_URL": f"{openai_url}/v1",
+        "JWT_SECRET": JWT_SECRET,
+        "ARTIFACT_CACHE_DIR": os.path.join(workdir, "artifacts"),
+        "BATCH_JOBS_DB": os.path.join(workdir, "jobs.sqlite3"),
+        "CHAT_OUTBOX_DB": os.path.join(workdir, "outbox.sqlite3"),
+        "CHUNK_STORE_DB": os.path.join(workdir, "chunks.sqlite3"),
+    }
+
+
+def import_seconds(env: Dict[str, str]) -> float:
+    output = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(env: Dict[str, str], top: int) -> List[Dict[str, Any]]:
+    """Packages loaded by `import main`, by cumulative import time (nested packages overlap)"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stderr
+    packages = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        if cumulative.strip().isdigit() and "." not in name and name != "main":
+            packages.append({"module": name, "seconds": int(cumulative) / 1e6})
+    return sorted(packages, key=lambda package: package["seconds"], reverse=True)[:top]
+
+
+async def poll_until_ok(client: httpx.AsyncClient, url: str, process: subprocess.Popen, started: float,
+                        timeout: float, **kwargs) -> float:
+    """Seconds from started until url returns 200"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app exited with {process.returncode}")
+        try:
+            response = await client.get(url, **kwargs)
+            if response.status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.005)
+    raise RuntimeError(f"{url} did not return 200 within {timeout}s")
+
+
+async def trial(env: Dict[str, str], args) -> Dict[str, float]:
+    port = free_port()
+    app_url = f"http://127.0.0.1:{port}"
+    token = jwt.encode({"user_id": str(uuid.uuid4()), "email": "startup@example.com", "username": "startup"},
+                       JWT_SECRET, algorithm="HS256")
+    started = time.perf_counter()
+    app = spawn(["-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                 "--log-level", "warning"], env, quiet=not args.verbose)
+    try:
+        # A new connection per poll, so a refused connect fails fast instead of waiting on the pool
+        async with httpx.AsyncClient(timeout=args.timeout, limits=httpx.Limits(max_keepalive_connections=0)) as client:
+            first = await poll_until_ok(client, f"{app_url}/", app, started, args.timeout)
+            ready = await poll_until_ok(client, f"{app_url}/ready", app, started, args.timeout)
+            api = await poll_until_ok(client, f"{app_url}/api/history", app, started, args.timeout,
+                                      params={"authorization": f"Bearer {token}"})
+    finally:
+        stop(app)
+    return {"first200": first, "ready": ready, "firstApi200": api}
+
+
+async def main_async(args) -> Dict[str, Any]:
+    supabase_port, openai_port = free_port(), free_port()
+    supabase_url = f"http://127.0.0.1:{supabase_port}"
+    openai_url = f"http://127.0.0.1:{openai_port}"
+    workdir = tempfile.mkdtemp(prefix="biasbuster-startup-")
+    processes: List[subprocess.Popen] = []
+    try:
+        processes.append(spawn([os.path.join(BENCH_DIR, "fake_supabase.py"), "--port", str(supabase_port)]))
+        processes.append(spawn([os.path.join(BENCH_DIR, "fake_openai.py"), "--port", str(openai_port)]))
+        await wait_until_up(f"{supabase_url}/_stats", processes[0])
+        await wait_until_up(f"{openai_url}/stats", processes[1])
+        env = app_env(supabase_url, openai_url, workdir)
+
+        # One unmeasured import first, so every trial sees warm bytecode and page caches
+        import_seconds(env)
+        imports = [import_seconds(env) for _ in range(args.trials)]
+        trials = [await trial(env, args) for _ in range(args.trials)]
+        modules = slowest_imports(env, args.top) if args.importtime else []
+    finally:
+        for process in reversed(processes):
+            stop(process)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    medians = {"import": statistics.median(imports)}
+    for key in ("first200", "ready", "firstApi200"):
+        medians[key] = statistics.median(result[key] for result in trials)
+    return {
+        "config": {"trials": args.trials},
+        "median": medians,
+        "samples": {"import": imports, "trials": trials},
+        "slowestImports": modules,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    print(f"median of {report['config']['trials']} trials")
+    labels = {"import": "import main", "first200": "first 200 (/)", "ready": "/ready 200",
+              "firstApi200": "first API 200"}
+    for key, label in labels.items():
+        print(f"{label:<16} {report['median'][key] * 1000:>8.1f} ms")
+    if report["slowestImports"]:
+        print("slowest imports:")
+        for module in report["slowestImports"]:
+            print(f"  {module['module']:<28} {module['seconds'] * 1000:>8.1f} ms")
+
+
+def regressions(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    found = []
+    for key, seconds in report["median"].items():
+        before = baseline["median"].get(key)
+        if before and seconds > before * (1 + tolerance):
+            found.append(f"{key}: {before * 1000:.1f} ms -> {seconds * 1000:.1f} ms")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=5, help="Fresh processes to measure")
+    parser.add_argument("--importtime", action="store_true", help="List the slowest modules imported by main")
+    parser.add_argument("--top", type=int, default=10, help="Modules listed with --importtime")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--verbose", action="store_true", help="Show the app's log output")
+    parser.add_argument("--json", action="store_true", help="Print the full result as JSON")
+    parser.add_argument("--baseline", help="JSON result of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative regression vs --baseline")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
@@ -0,0 +1,141 @@
+"""Local stand-in for the OpenAI chat-completions API.
+
+Serves /v1/chat/completions with configurable latency, streaming, random error
+injection and a concurrency limit beyond which it answers 429 with Retry-After,
+like the real API does when a rate limit is hit. Requests with a json_schema
+response_format get the reply as a JSON object with the schema's properties, and
+usage reports prompt tokens of a message prefix seen before as cached, in 128-token
+steps from 1024 prompt tokens on, like the API's prompt cache.
+
+Usage (from backend/):
+    python benchmarks/fake_openai.py --port 8100 --latency 0.2 --max-concurrent 8
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+DEFAULT_REPLY = """The sample over-represents one group, so conclusions may not generalise.
+
+---BIAS_REPORT_START---
+{"bias_detected": true, "reasons": ["Sampling bias"], "fixes": ["Rebalance the sample"]}
+---BIAS_REPORT_END---"""
+
+
+def structured_reply(reply: str, response_format: dict) -> str:
+    """The marker-delimited reply as a JSON object with the properties of the requested schema"""
+    text, _, report = reply.partition("---BIAS_REPORT_START---")
+    data = json.loads(report.partition("---BIAS_REPORT_END---")[0] or "{}")
+    data["reply"] = text.strip()
+    properties = response_format["json_schema"]["schema"]["properties"]
+    return json.dumps({key: data.get(key) for key in properties})
+
+
+def create_app(latency: float = 0.2, stream_chunk_delay: float = 0.01, error_rate: float = 0.0,
+               max_concurrent: int = 0, retry_after: float = 1.0, reply: str = DEFAULT_REPLY) -> FastAPI:
+    """Build the fake API; max_concurrent=0 disables the rate limit"""
+    app = FastAPI(title="Fake OpenAI")
+    state = {"in_flight": 0, "requests": 0, "rate_limited": 0, "errors": 0}
+    seen_prefixes = set()
+
+    def cached_tokens(messages: list, prompt_tokens: int) -> int:
+        cached = 0
+        for end in range(1, len(messages) + 1):
+            prefix = json.dumps(messages[:end], sort_keys=True)
+            if prefix in seen_prefixes:
+                cached = sum(len(m.get("content") or "") for m in messages[:end]) // 4
+            seen_prefixes.add(prefix)
+        return cached // 128 * 128 if prompt_tokens >= 1024 else 0
+
+    def usage(body, content: str) -> dict:
+        messages = body.get("messages", [])
+        prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens(messages, prompt_tokens)},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        state["requests"] += 1
+        if max_concurrent and state["in_flight"] >= max_concurrent:
+            state["rate_limited"] += 1
+            return JSONResponse(
+                status_code=429,
+                headers={"retry-after": str(retry_after)},
+                content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+            )
+        if error_rate and random.random() < error_rate:
+            state["errors"] += 1
+            return JSONResponse(status_code=500, content={"error": {"message": "Injected failure", "type": "server_error"}})
+
+        created = int(time.time())
+        content = reply
+        if (body.get("response_format") or {}).get("type") == "json_schema":
+            content = structured_reply(reply, body["response_format"])
+        if body.get("stream"):
+            async def events():
+                state["in_flight"] += 1
+                try:
+                    await asyncio.sleep(latency)
+                    for start in range(0, len(content), 8):
+                        chunk = {
+                            "id": "chatcmpl-fake",
+                            "object": "chat.completion.chunk",
+                            "created": created,
+                            "model": body.get("model", "fake"),
+                            "choices": [{"index": 0, "delta": {"content": content[start:start + 8]}, "finish_reason": None}],
+                        }
+                        yield f"data: {json.dumps(chunk)}\n\n"
+                        await asyncio.sleep(stream_chunk_delay)
+                    yield "data: [DONE]\n\n"
+                finally:
+                    state["in_flight"] -= 1
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        state["in_flight"] += 1
+        try:
+            await asyncio.sleep(latency)
+        finally:
+            state["in_flight"] -= 1
+        return {
+            "id": "chatcmpl-fake",
+            "object": "chat.completion",
+            "created": created,
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": usage(body, content),
+        }
+
+    @app.get("/stats")
+    async def stats():
+        return state
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.01)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--max-concurrent", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(args.latency, args.stream_chunk_delay, args.error_rate, args.max_concurrent, args.retry_after),
+        host="127.0.0.1",
+        port=args.port,
+        log_level="warning",
+    )
@@ -0,0 +1,534 @@
+"""Local stand-in for the Supabase REST (PostgREST) and storage APIs.
+
+Keeps tables in memory and implements the subset of PostgREST the backend
+uses: select with column lists, eq/neq/gt/gte/lt/lte/in/is filters, or=(...)
+with nested and(...), multi-column order, limit/offset, insert (and upsert),
+update, delete, the append_chat_messages, save_chat_turn, bias_analytics,
+delete_chats, orphaned_uploads, claim_orphaned_uploads and
+record_dataset_version RPCs, the report_rollups and chat_deletions triggers and
+ON DELETE CASCADE from chats. Storage supports object
+upload, download, HEAD and the TUS resumable protocol. Every request can be
+delayed by a fixed latency to model the network round trip, and a share of
+database writes can be failed with 503s (from a seeded RNG, so runs repeat).
+POST /_errors {"enabled": false} pauses the failures, e.g. while a load test
+seeds its data.
+
+Usage (from backend/):
+    python benchmarks/fake_supabase.py --port 8200 --db-latency 0.005
+"""
+import argparse
+import asyncio
+import base64
+import random
+import re
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+FILTER_OPS = {
+    "eq": lambda a, b: a == b,
+    "neq": lambda a, b: a != b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+}
+# Column defaults from schema.sql, applied to inserted rows that leave them out
+TABLE_DEFAULTS = {
+    "chats": {"messages": [], "message_count": 0, "last_message": None, "context_summary": None,
+              "context_summary_seq": 0, "context_file_hash": None},
+    "reports": {"chat_id": None, "job_id": None, "bias_detected": False, "reasons": [], "fixes": [],
+                "categories": []},
+}
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "or", "and", "on_conflict", "columns"}
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat()
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split on commas that are outside quotes and parentheses"""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        if char == "," and depth == 0 and not quoted:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def _coerce(raw: str, like: Any) -> Any:
+    """Convert a filter value to the type of the stored value it is compared with"""
+    raw = raw[1:-1] if len(raw) >= 2 and raw[0] == raw[-1] == '"' else raw
+    if raw == "null":
+        return None
+    if isinstance(like, bool):
+        return raw == "true"
+    if isinstance(like, int):
+        return int(raw)
+    if isinstance(like, float):
+        return float(raw)
+    return raw
+
+
+def _condition(column: str, expression: str) -> Callable[[Dict[str, Any]], bool]:
+    """Predicate for one PostgREST filter such as gt.5 or in.(a,b)"""
+    negate = expression.startswith("not.")
+    if negate:
+        expression = expression[4:]
+    op, _, raw = expression.partition(".")
+
+    def check(row: Dict[str, Any]) -> bool:
+        value = row.get(column)
+        if op == "in":
+            result = value in [_coerce(part, value) for part in _split_top_level(raw.strip("()"))]
+        elif op == "is":
+            result = value is None if raw == "null" else value is (raw == "true")
+        else:
+            result = FILTER_OPS[op](value, _coerce(raw, value))
+        return not result if negate else result
+
+    return check
+
+
+def _logic(text: str, combine: Callable) -> Callable[[Dict[str, Any]], bool]:
+    """Predicate for the inside of or(...) / and(...)"""
+    checks = []
+    for part in _split_top_level(text):
+        match = re.fullmatch(r"(or|and)\((.*)\)", part)
+        if match:
+            checks.append(_logic(match.group(2), any if match.group(1) == "or" else all))
+        else:
+            column, _, expression = part.partition(".")
+            checks.append(_condition(column, expression))
+    return lambda row: combine(check(row) for check in checks)
+
+
+def _order_key(order: str) -> List[tuple]:
+    keys = []
+    for part in order.split(","):
+        column, *modifiers = part.split(".")
+        keys.append((column, "desc" in modifiers))
+    return keys
+
+
+def _sort(rows: List[Dict[str, Any]], order: str) -> List[Dict[str, Any]]:
+    # Stable sorts applied from the last key to the first
+    for column, descending in reversed(_order_key(order)):
+        rows = sorted(rows, key=lambda row: (row.get(column) is None, "" if row.get(column) is None else row.get(column)),
+                      reverse=descending)
+    return rows
+
+
+def _project(row: Dict[str, Any], select: str) -> Dict[str, Any]:
+    columns = [column.strip() for column in select.split(",")]
+    if "*" in columns:
+        return dict(row)
+    return {column: row.get(column) for column in columns}
+
+
+def _bucket_start(day: date, bucket: str) -> date:
+    """date_trunc for day, week and month"""
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def create_app(db_latency: float = 0.005, storage_latency: float = 0.01, db_error_rate: float = 0.0,
+               seed: int = 0) -> FastAPI:
+    """Build the fake API with empty tables"""
+    app = FastAPI(title="Fake Supabase")
+    tables: Dict[str, List[Dict[str, Any]]] = {}
+    # table -> id -> row, so lookups by id stay O(1) as tables grow during a run
+    by_id: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    objects: Dict[str, bytes] = {}
+    resumable: Dict[str, Dict[str, Any]] = {}
+    # turn id -> messages stored by save_chat_turn
+    turn_writes: Dict[str, List[Dict[str, Any]]] = {}
+    # (user id, day, category) -> report count, as maintained by the report_rollups trigger
+    rollups: Dict[tuple, int] = {}
+    state = {"db_requests": 0, "storage_requests": 0, "injected_errors": 0, "errors_enabled": True}
+    rng = random.Random(seed)
+
+    async def db_write() -> Optional[JSONResponse]:
+        """Delay a write and, at db_error_rate, return the error to answer it with"""
+        await asyncio.sleep(db_latency)
+        state["db_requests"] += 1
+        if state["errors_enabled"] and rng.random() < db_error_rate:
+            state["injected_errors"] += 1
+            return JSONResponse({"message": "Service temporarily unavailable"}, status_code=503)
+        return None
+
+    def matching(table: str, request: Request) -> List[Dict[str, Any]]:
+        rows = tables.setdefault(table, [])
+        id_filter = request.query_params.get("id", "")
+        if id_filter.startswith("eq."):
+            row = by_id.get(table, {}).get(id_filter[3:])
+            rows = [row] if row is not None else []
+        checks = []
+        for key, value in request.query_params.multi_items():
+            if key in ("or", "and"):
+                checks.append(_logic(value.strip("()"), any if key == "or" else all))
+            elif key not in RESERVED_PARAMS:
+                checks.append(_condition(key, value))
+        return [row for row in rows if all(check(row) for check in checks)]
+
+    def respond(rows: List[Dict[str, Any]], request: Request, status: int = 200, total: Optional[int] = None):
+        select = request.query_params.get("select", "*")
+        headers = {}
+        if "count=exact" in request.headers.get("prefer", ""):
+            count = len(rows) if total is None else total
+            headers["Content-Range"] = f"0-{max(len(rows) - 1, 0)}/{count}"
+        return JSONResponse([_project(row, select) for row in rows], status_code=status, headers=headers)
+
+    def update_rollups(table: str, row: Dict[str, Any], delta: int):
+        if table != "reports" or not row.get("bias_detected") or not row.get("user_id"):
+            return
+        day = str(row.get("created_at") or _now())[:10]
+        for category in [*row.get("categories", []), "all"]:
+            key = (row["user_id"], day, category)
+            rollups[key] = rollups.get(key, 0) + delta
+
+    @app.get("/rest/v1/{table}")
+    async def select_rows(table: str, request: Request):
+        await asyncio.sleep(db_latency)
+        state["db_requests"] += 1
+        rows = matching(table, request)
+        total = len(rows)
+        if "order" in request.query_params:
+            rows = _sort(rows, request.query_params["order"])
+        offset = int(request.query_params.get("offset", 0))
+        limit = request.query_params.get("limit")
+        rows = rows[offset:offset + int(limit) if limit else None]
+        return respond(rows, request, total=total)
+
+    def append_messages(body: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """append_chat_messages; None if the chat belongs to another user"""
+        chats = tables.setdefault("chats", [])
+        chat = by_id.get("chats", {}).get(body["p_chat_id"])
+        now = _now()
+        if chat is None:
+            chat = {**TABLE_DEFAULTS["chats"], "id": body["p_chat_id"], "user_id": body["p_user_id"],
+                    "last_message": body["p_last_message"], "created_at": now, "updated_at": now}
+            chats.append(chat)
+            by_id.setdefault("chats", {})[chat["id"]] = chat
+        elif chat["user_id"] != body["p_user_id"]:
+            return None
+        inserted = []
+        for message in body["p_messages"]:
+            chat["message_count"] += 1
+            inserted.append({
+                "chat_id": chat["id"],
+                "seq": chat["message_count"],
+                "user_id": body["p_user_id"],
+                "role": message["role"],
+                "content": message["content"],
+                "file_path": message.get("file_path"),
+                "created_at": message.get("timestamp") or now,
+            })
+        tables.setdefault("chat_messages", []).extend(inserted)
+        chat["last_message"] = body["p_last_message"]
+        chat["updated_at"] = now
+        return inserted
+
+    @app.post("/rest/v1/rpc/append_chat_messages")
+    async def append_chat_messages(request: Request):
+        error = await db_write()
+        if error is not None:
+            return error
+        inserted = append_messages(await request.json())
+        if inserted is None:
+            return JSONResponse({"message": "Chat not found"}, status_code=400)
+        return inserted
+
+    @app.post("/rest/v1/rpc/save_chat_turn")
+    async def save_chat_turn(request: Request):
+        error = await db_write()
+        if error is not None:
+            return error
+        body = await request.json()
+        if body["p_turn_id"] in turn_writes:
+            return turn_writes[body["p_turn_id"]]
+        inserted = append_messages(body)
+        if inserted is None:
+            return JSONResponse({"message": "Chat not found"}, status_code=400)
+        turn_writes[body["p_turn_id"]] = inserted
+        report = body.get("p_report")
+        if report:
+            row = {**TABLE_DEFAULTS["reports"], **report, "user_id": body["p_user_id"], "chat_id": body["p_chat_id"]}
+            tables.setdefault("reports", []).append(row)
+            by_id.setdefault("reports", {})[row["id"]] = row
+            update_rollups("reports", row, 1)
+        return inserted
+
+    @app.post("/rest/v1/rpc/bias_analytics")
+    async def bias_analytics(request: Request):
+        await asyncio.sleep(db_latency)
+        state["db_requests"] += 1
+        body = await request.json()
+        start, end = date.fromisoformat(body["p_start"]), date.fromisoformat(body["p_end"])
+        buckets: Dict[str, Dict[str, int]] = {}
+        for (user_id, day, category), count in rollups.items():
+            if user_id != body["p_user_id"] or not start <= date.fromisoformat(day) <= end:
+                continue
+            counts = buckets.setdefault(_bucket_start(date.fromisoformat(day), body["p_bucket"]).isoformat(), {})
+            counts[category] = counts.get(category, 0) + count
+        return [
+            {"bucket_start": starts_on, "counts": {category: count for category, count in counts.items() if count}}
+            for starts_on, counts in sorted(buckets.items()) if any(counts.values())
+        ]
+
+    def remove_rows(table: str, doomed: List[Dict[str, Any]]):
+        doomed_ids = {id(row) for row in doomed}
+        tables[table] = [row for row in tables.get(table, []) if id(row) not in doomed_ids]
+        for row in doomed:
+            by_id.get(table, {}).pop(row.get("id"), None)
+            update_rollups(table, row, -1)
+            if table == "chats" and row.get("user_id"):
+                tables.setdefault("chat_deletions", []).append(
+                    {"chat_id": row["id"], "user_id": row["user_id"], "deleted_at": _now()}
+                )
+
+    @app.post("/rest/v1/rpc/delete_chats")
+    async def delete_chats(request: Request):
+        error = await db_write()
+        if error is not None:
+            return error
+        body = await request.json()
+        wanted = set(body["p_chat_ids"])
+        chats = [chat for chat in tables.get("chats", [])
+                 if chat["id"] in wanted and chat["user_id"] == body["p_user_id"]]
+        deleted = {chat["id"] for chat in chats}
+        remove_rows("chats", chats)
+        for table in ("chat_messages", "reports"):
+            remove_rows(table, [row for row in tables.get(table, []) if row.get("chat_id") in deleted])
+        return [{"id": chat_id} for chat_id in deleted]
+
+    def orphans(before: str, paths: Optional[set] = None) -> List[Dict[str, Any]]:
+        referenced = {row["file_path"] for row in tables.get("chat_messages", []) if row.get("file_path")}
+        return [row for row in tables.get("upload_objects", [])
+                if row["uploaded_at"] < before and row["path"] not in referenced
+                and (paths is None or row["path"] in paths)]
+
+    @app.post("/rest/v1/rpc/orphaned_uploads")
+    async def orphaned_uploads(request: Request):
+        await asyncio.sleep(db_latency)
+        state["db_requests"] += 1
+        body = await request.json()
+        rows = sorted(orphans(body["p_before"]), key=lambda row: (row["uploaded_at"], row["path"]))
+        if body.get("p_after_uploaded_at") is not None:
+            after = (body["p_after_uploaded_at"], body["p_after_path"])
+            rows = [row for row in rows if (row["uploaded_at"], row["path"]) > after]
+        return rows[:body["p_limit"]]
+
+    @app.post("/rest/v1/rpc/claim_orphaned_uploads")
+    async def claim_orphaned_uploads(request: Request):
+        error = await db_write()
+        if error is not None:
+            return error
+        body = await request.json()
+        claimed = orphans(body["p_before"], set(body["p_paths"]))
+        remove_rows("upload_objects", claimed)
+        return claimed
+
+    @app.post("/rest/v1/rpc/record_dataset_version")
+    async def record_dataset_version(request: Request):
+        error = await db_write()
+        if error is not None:
+            return error
+        body = await request.json()
+        versions = tables.setdefault("dataset_versions", [])
+        user_id, lineage_id = body["p_user_id"], body.get("p_lineage_id")
+        if lineage_id is None:
+            same_name = [row for row in versions
+                         if row["user_id"] == user_id and row["file_name"] == body["p_file_name"]]
+            lineage_id = same_name[-1]["lineage_id"] if same_name else None
+        lineage = [row for row in versions if lineage_id and row["lineage_id"] == lineage_id]
+        if lineage_id is not None and not any(row["user_id"] == user_id for row in lineage):
+            return []
+        latest = lineage[-1] if lineage else None
+        if latest is not None and latest["file_hash"] == body["p_file_hash"]:
+            parent = next((row["file_hash"] for row in lineage if row["version"] == latest["version"] - 1), None)
+            return [{"lineage_id": lineage_id, "version": latest["version"], "parent_hash": parent}]
+        row = {
+            "lineage_id": lineage_id or str(uuid.uuid4()),
+            "version": latest["version"] + 1 if latest else 1,
+            "user_id": user_id,
+            "file_name": body["p_file_name"],
+            "file_hash": body["p_file_hash"],
+            "created_at": _now(),
+        }
+        versions.append(row)
+        return [{"lineage_id": row["lineage_id"], "version": row["version"],
+                 "parent_hash": latest["file_hash"] if latest else None}]
+
+    @app.post("/rest/v1/rpc/{function}")
+    async def unknown_rpc(function: str):
+        return JSONResponse({"message": f"Function {function} not found"}, status_code=404)
+
+    @app.post("/rest/v1/{table}")
+    async def insert_rows(table: str, request: Request):
+        error = await db_write()
+        if error is not None:
+            return error
+        body = await request.json()
+        rows = body if isinstance(body, list) else [body]
+        prefer = request.headers.get("prefer", "")
+        conflict_column = request.query_params.get("on_conflict", "id")
+        stored = []
+        for row in rows:
+            if "resolution=" in prefer and conflict_column in row:
+                existing = next((old for old in tables.get(table, [])
+                                 if old.get(conflict_column) == row[conflict_column]), None)
+                if existing is not None:
+                    if "resolution=merge-duplicates" in prefer:
+                        existing.update(row)
+                    stored.append(existing)
+                    continue
+            row = {**TABLE_DEFAULTS.get(table, {}), **row}
+            row.setdefault("id", str(uuid.uuid4()))
+            row.setdefault("created_at", _now())
+            tables.setdefault(table, []).append(row)
+            by_id.setdefault(table, {})[row["id"]] = row
+            update_rollups(table, row, 1)
+            stored.append(row)
+        return respond(stored, request, status=201)
+
+    @app.patch("/rest/v1/{table}")
+    async def update_rows(table: str, request: Request):
+        error = await db_write()
+        if error is not None:
+            return error
+        changes = await request.json()
+        rows = matching(table, request)
+        for row in rows:
+            row.update(changes)
+        return respond(rows, request)
+
+    @app.delete("/rest/v1/{table}")
+    async def delete_rows(table: str, request: Request):
+        error = await db_write()
+        if error is not None:
+            return error
+        rows = matching(table, request)
+        remove_rows(table, rows)
+        return respond(rows, request)
+
+    @app.post("/storage/v1/object/{bucket}/{path:path}")
+    async def upload_object(bucket: str, path: str, request: Request):
+        await asyncio.sleep(storage_latency)
+        state["storage_requests"] += 1
+        key = f"{bucket}/{path}"
+        if key in objects and request.headers.get("x-upsert") != "true":
+            return JSONResponse({"error": "Duplicate", "message": "The resource already exists"}, status_code=409)
+        objects[key] = await request.body()
+        return {"Key": key}
+
+    @app.head("/storage/v1/object/{bucket}/{path:path}")
+    async def head_object(bucket: str, path: str):
+        await asyncio.sleep(storage_latency)
+        state["storage_requests"] += 1
+        data = objects.get(f"{bucket}/{path}")
+        if data is None:
+            return Response(status_code=404)
+        return Response(status_code=200, headers={"Content-Length": str(len(data))})
+
+    @app.get("/storage/v1/object/{bucket}/{path:path}")
+    async def download_object(bucket: str, path: str):
+        await asyncio.sleep(storage_latency)
+        state["storage_requests"] += 1
+        if path.startswith("public/"):
+            bucket, _, path = path[len("public/"):].partition("/")
+        data = objects.get(f"{bucket}/{path}")
+        if data is None:
+            return JSONResponse({"error": "not_found", "message": "Object not found"}, status_code=404)
+        return Response(content=data, media_type="application/octet-stream")
+
+    @app.delete("/storage/v1/object/{bucket}")
+    async def remove_objects(bucket: str, request: Request):
+        await asyncio.sleep(storage_latency)
+        state["storage_requests"] += 1
+        body = await request.json()
+        removed = [{"name": name} for name in body.get("prefixes", []) if objects.pop(f"{bucket}/{name}", None)]
+        return removed
+
+    @app.post("/storage/v1/upload/resumable")
+    async def create_resumable(request: Request):
+        await asyncio.sleep(storage_latency)
+        state["storage_requests"] += 1
+        metadata = {}
+        for pair in request.headers.get("upload-metadata", "").split(","):
+            key, _, value = pair.partition(" ")
+            metadata[key] = base64.b64decode(value).decode() if value else ""
+        key = f"{metadata.get('bucketName')}/{metadata.get('objectName')}"
+        if key in objects and request.headers.get("x-upsert") != "true":
+            return JSONResponse({"error": "Duplicate", "message": "The resource already exists"}, status_code=409)
+        upload_id = uuid.uuid4().hex
+        resumable[upload_id] = {
+            "key": key,
+            "length": int(request.headers["upload-length"]),
+            "upsert": request.headers.get("x-upsert") == "true",
+            "data": bytearray(),
+        }
+        location = f"{str(request.base_url).rstrip('/')}/storage/v1/upload/resumable/{upload_id}"
+        return Response(status_code=201, headers={"Location": location, "Tus-Resumable": "1.0.0"})
+
+    @app.patch("/storage/v1/upload/resumable/{upload_id}")
+    async def append_resumable(upload_id: str, request: Request):
+        await asyncio.sleep(storage_latency)
+        state["storage_requests"] += 1
+        upload = resumable[upload_id]
+        if int(request.headers["upload-offset"]) != len(upload["data"]):
+            return Response(status_code=409)
+        data = upload["data"] + await request.body()
+        if len(data) >= upload["length"]:
+            if upload["key"] in objects and not upload["upsert"]:
+                return JSONResponse({"error": "Duplicate", "message": "The resource already exists"}, status_code=409)
+            objects[upload["key"]] = bytes(data)
+        upload["data"] = data
+        return Response(status_code=204, headers={"Upload-Offset": str(len(upload["data"])), "Tus-Resumable": "1.0.0"})
+
+    @app.head("/storage/v1/upload/resumable/{upload_id}")
+    async def resumable_offset(upload_id: str):
+        upload = resumable[upload_id]
+        return Response(status_code=200, headers={"Upload-Offset": str(len(upload["data"])), "Tus-Resumable": "1.0.0"})
+
+    @app.post("/_errors")
+    async def toggle_errors(request: Request):
+        state["errors_enabled"] = bool((await request.json())["enabled"])
+        return {"enabled": state["errors_enabled"]}
+
+    @app.get("/_stats")
+    async def stats():
+        return {**state, "rows": {name: len(rows) for name, rows in tables.items()}, "objects": len(objects)}
+
+    return app
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--storage-latency", type=float, default=0.01)
+    parser.add_argument("--db-error-rate", type=float, default=0.0, help="Share of database writes failed with 503")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the error injection RNG")
+    args = parser.parse_args()
+    uvicorn.run(create_app(args.db_latency, args.storage_latency, args.db_error_rate, args.seed), host="127.0.0.1",
+                port=args.port, log_level="warning")
@@ -0,0 +1,514 @@
+"""Offline load test of the API against local fake Supabase and OpenAI servers.
+
+Starts benchmarks/fake_supabase.py and benchmarks/fake_openai.py, then the app
+itself under uvicorn pointed at them, seeds users, chats, reports and one
+uploaded CSV per user, and drives a weighted mix of /api/chat,
+/api/chat/stream, /api/history, /api/upload, /api/report/download and (when
+given a weight in --mix) /api/analytics from a fixed number of closed-loop
+virtual users. Reports p50/p95/p99 latency and throughput per operation and
+the peak RSS of the app's process tree.
+
+Runs are reproducible for a given --seed. Save a run with --json and pass it
+back as --baseline to fail (exit 1) when p95 latency, throughput or error rate
+regress by more than --tolerance.
+
+Usage (from backend/):
+    python benchmarks/load_test.py [--users 20] [--duration 30] [--workers 1]
+    python benchmarks/load_test.py --json > baseline.json
+    python benchmarks/load_test.py --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import httpx
+import jwt
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+JWT_SECRET = "load-test-jwt-signing-key-0123456789abcdef"
+DEFAULT_MIX = "chat=30,chat_stream=15,history=30,upload=10,report=15"
+MESSAGES = [
+    "Is this hiring data biased against older applicants?",
+    "Does this loan approval summary treat all regions fairly?",
+    "Check this job advert for gendered language.",
+    "Are the survey respondents representative of the population?",
+]
+REASONS = ["Sampling bias", "Under-representation of one group", "Proxy variable for a protected attribute"]
+# What bias_categories.categorize() makes of each reason, so seeded reports land in the rollups
+REASON_CATEGORIES = {REASONS[0]: "sampling", REASONS[1]: "sampling", REASONS[2]: "algorithmic"}
+FIXES = ["Rebalance the sample", "Audit outcomes by group", "Remove the proxy feature"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, int(round(p * len(values))) - 1))]
+
+
+def parse_mix(text: str) -> Dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def seeded_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def csv_content(rng: random.Random, rows: int) -> bytes:
+    """A small tabular dataset with a protected attribute and an outcome column"""
+    lines = ["age,gender,region,income,hired"]
+    for _ in range(rows):
+        lines.append(",".join([
+            str(rng.randint(18, 70)),
+            rng.choice(["female", "male", "nonbinary"]),
+            rng.choice(["north", "south", "east", "west"]),
+            str(rng.randint(20_000, 150_000)),
+            rng.choice(["0", "1"]),
+        ]))
+    return ("\n".join(lines) + "\n").encode()
+
+
+# Process tree memory
+def _children(pid: int) -> List[int]:
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def tree_rss_bytes(root: int) -> int:
+    """Resident memory of a process and all its descendants (uvicorn workers, PDF renderers)"""
+    total, stack = 0, [root]
+    while stack:
+        pid = stack.pop()
+        total += _rss_bytes(pid)
+        stack.extend(_children(pid))
+    return total
+
+
+class RssSampler:
+    """Polls the app's process tree RSS and keeps the peak"""
+
+    def __init__(self, pid: int, interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, tree_rss_bytes(self.pid))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+# Servers
+def spawn(args: List[str], env: Optional[Dict[str, str]] = None, quiet: bool = False) -> subprocess.Popen:
+    output = subprocess.DEVNULL if quiet else None
+    return subprocess.Popen([sys.executable, *args], cwd=BACKEND_DIR, env=env, stdout=output, stderr=output)
+
+
+async def wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{' '.join(process.args)} exited with {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+# Virtual users
+class VirtualUser:
+    def __init__(self, index: int, rng: random.Random):
+        self.user_id = seeded_uuid(rng)
+        self.token = jwt.encode({"user_id": self.user_id, "email": f"load{index}@example.com",
+                                 "username": f"load{index}"}, JWT_SECRET, algorithm="HS256")
+        self.rng = rng
+        self.chat_ids: List[str] = []
+        self.report_ids: List[str] = []
+        self.file_url: Optional[str] = None
+
+    @property
+    def auth(self) -> Dict[str, str]:
+        return {"authorization": f"Bearer {self.token}"}
+
+
+def chat_body(user: VirtualUser, args) -> Dict[str, Any]:
+    message = user.rng.choice(MESSAGES)
+    if user.rng.random() < args.unique_messages:
+        # Distinct text misses the analysis cache and reaches the model
+        message = f"{message} ({user.rng.getrandbits(64):x})"
+    body = {"chatId": user.rng.choice(user.chat_ids), "message": message}
+    if user.file_url and user.rng.random() < args.file_chats:
+        body["fileUrl"] = user.file_url
+    return body
+
+
+async def op_chat(client: httpx.AsyncClient, user: VirtualUser, args) -> httpx.Response:
+    return await client.post("/api/chat", params=user.auth, json=chat_body(user, args))
+
+
+async def op_chat_stream(client: httpx.AsyncClient, user: VirtualUser, args) -> httpx.Response:
+    async with client.stream("POST", "/api/chat/stream", params=user.auth, json=chat_body(user, args)) as response:
+        body = await response.aread()
+    if b"event: error" in body:
+        # The turn failed after the stream started with a 200
+        return httpx.Response(500, content=body)
+    return response
+
+
+async def op_history(client: httpx.AsyncClient, user: VirtualUser, args) -> httpx.Response:
+    return await client.get("/api/history", params={**user.auth, "limit": 50})
+
+
+async def op_upload(client: httpx.AsyncClient, user: VirtualUser, args) -> httpx.Response:
+    content = csv_content(user.rng, args.upload_rows)
+    files = {"file": (f"dataset-{user.rng.getrandbits(32):x}.csv", content, "text/csv")}
+    return await client.post("/api/upload", params=user.auth, files=files)
+
+
+async def op_report(client: httpx.AsyncClient, user: VirtualUser, args) -> httpx.Response:
+    body = {"reportId": user.rng.choice(user.report_ids),
+            "format": "pdf" if user.rng.random() < args.pdf_share else "json"}
+    return await client.post("/api/report/download", params=user.auth, json=body)
+
+
+async def op_analytics(client: httpx.AsyncClient, user: VirtualUser, args) -> httpx.Response:
+    bucket = user.rng.choice(["day", "week", "month"])
+    return await client.get("/api/analytics", params={**user.auth, "bucket": bucket})
+
+
+OPERATIONS = {
+    "chat": op_chat,
+    "chat_stream": op_chat_stream,
+    "history": op_history,
+    "upload": op_upload,
+    "report": op_report,
+    "analytics": op_analytics,
+}
+
+
+async def seed(client: httpx.AsyncClient, supabase_url: str, users: List[VirtualUser], args):
+    """Chats and reports written straight to the fake database, one upload per user through the API.
+
+    Injected database errors are paused meanwhile; they are for the measured load, not its setup.
+    """
+    started = datetime.utcnow() - timedelta(days=30)
+    chats, reports = [], []
+    for user in users:
+        for _ in range(args.chats_per_user):
+            chat_id = seeded_uuid(user.rng)
+            updated_at = (started + timedelta(minutes=user.rng.randint(0, 43_000))).isoformat()
+            user.chat_ids.append(chat_id)
+            chats.append({"id": chat_id, "user_id": user.user_id, "messages": [], "message_count": 0,
+                          "last_message": user.rng.choice(MESSAGES), "created_at": started.isoformat(),
+                          "updated_at": updated_at})
+            for _ in range(args.reports_per_chat):
+                report_id = seeded_uuid(user.rng)
+                user.report_ids.append(report_id)
+                reasons = user.rng.sample(REASONS, 2)
+                categories = [category for category in ("sampling", "algorithmic")
+                              if category in {REASON_CATEGORIES[reason] for reason in reasons}]
+                reports.append({"id": report_id, "user_id": user.user_id, "chat_id": chat_id,
+                                "bias_detected": user.rng.random() < 0.7, "reasons": reasons,
+                                "fixes": user.rng.sample(FIXES, 2), "categories": categories,
+                                "created_at": updated_at})
+    async def upload(user: VirtualUser):
+        response = await op_upload(client, user, args)
+        response.raise_for_status()
+        user.file_url = response.json()["fileUrl"]
+
+    async with httpx.AsyncClient(base_url=supabase_url) as db:
+        (await db.post("/_errors", json={"enabled": False})).raise_for_status()
+        try:
+            (await db.post("/rest/v1/chats", json=chats)).raise_for_status()
+            (await db.post("/rest/v1/reports", json=reports)).raise_for_status()
+            await asyncio.gather(*(upload(user) for user in users))
+        finally:
+            (await db.post("/_errors", json={"enabled": True})).raise_for_status()
+
+
+async def drive(client: httpx.AsyncClient, users: List[VirtualUser], mix: Dict[str, float], args) -> Dict[str, Any]:
+    """Run every virtual user in a closed loop; samples taken during warmup are discarded"""
+    names, weights = list(mix), list(mix.values())
+    samples: Dict[str, List[float]] = {name: [] for name in names}
+    errors: Dict[str, int] = {name: 0 for name in names}
+    error_examples: Dict[str, str] = {}
+    loop = asyncio.get_running_loop()
+    measure_from = loop.time() + args.warmup
+    deadline = measure_from + args.duration
+
+    async def run_user(user: VirtualUser):
+        while loop.time() < deadline:
+            name = user.rng.choices(names, weights)[0]
+            started = loop.time()
+            try:
+                response = await OPERATIONS[name](client, user, args)
+                ok = response.status_code < 400
+                if not ok:
+                    error_examples.setdefault(name, f"{response.status_code} {response.text[:200]}")
+            except httpx.HTTPError as e:
+                ok = False
+                error_examples.setdefault(name, f"{type(e).__name__}: {e}")
+            finished = loop.time()
+            if started < measure_from or finished > deadline:
+                continue
+            samples[name].append(finished - started)
+            if not ok:
+                errors[name] += 1
+            if args.think_time:
+                await asyncio.sleep(user.rng.expovariate(1 / args.think_time))
+
+    await asyncio.gather(*(run_user(user) for user in users))
+
+    operations = {}
+    for name in names:
+        latencies = sorted(samples[name])
+        operations[name] = {
+            "count": len(latencies),
+            "errors": errors[name],
+            "throughput": round(len(latencies) / args.duration, 2),
+            "p50": round(percentile(latencies, 0.50), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+        }
+    everything = sorted(latency for latencies in samples.values() for latency in latencies)
+    total_errors = sum(errors.values())
+    return {
+        "operations": operations,
+        "total": {
+            "count": len(everything),
+            "errors": total_errors,
+            "throughput": round(len(everything) / args.duration, 2),
+            "p50": round(percentile(everything, 0.50), 4),
+            "p95": round(percentile(everything, 0.95), 4),
+            "p99": round(percentile(everything, 0.99), 4),
+        },
+        "errorExamples": error_examples,
+    }
+
+
+async def main_async(args) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    users = [VirtualUser(n, random.Random(rng.getrandbits(64))) for n in range(args.users)]
+
+    supabase_port, openai_port, app_port = free_port(), free_port(), free_port()
+    supabase_url = f"http://127.0.0.1:{supabase_port}"
+    openai_url = f"http://127.0.0.1:{openai_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    workdir = tempfile.mkdtemp(prefix="biasbuster-load-")
+    processes: List[subprocess.Popen] = []
+    try:
+        processes.append(spawn([
+            os.path.join(BENCH_DIR, "fake_supabase.py"), "--port", str(supabase_port),
+            "--db-latency", str(args.db_latency), "--storage-latency", str(args.storage_latency),
+            "--db-error-rate", str(args.db_error_rate), "--seed", str(args.seed),
+        ]))
+        processes.append(spawn([
+            os.path.join(BENCH_DIR, "fake_openai.py"), "--port", str(openai_port),
+            "--latency", str(args.llm_latency), "--stream-chunk-delay", str(args.stream_chunk_delay),
+            "--error-rate", str(args.llm_error_rate), "--max-concurrent", str(args.llm_max_concurrent),
+            "--retry-after", "0.2",
+        ]))
+        await wait_until_up(f"{supabase_url}/_stats", processes[0])
+        await wait_until_up(f"{openai_url}/stats", processes[1])
+
+        env = {
+            **os.environ,
+            "SUPABASE_URL": supabase_url,
+            "SUPABASE_ANON_KEY": jwt.encode({"role": "anon"}, "load-test-anon-signing-key-0123456789"),
+            "OPENAI_API_KEY": "sk-load-test",
+            "OPENAI_BASE_URL": f"{openai_url}/v1",
+            "JWT_SECRET": JWT_SECRET,
+            "ARTIFACT_CACHE_DIR": os.path.join(workdir, "artifacts"),
+            "BATCH_JOBS_DB": os.path.join(workdir, "jobs.sqlite3"),
+            "CHAT_OUTBOX_DB": os.path.join(workdir, "outbox.sqlite3"),
+            "CHUNK_STORE_DB": os.path.join(workdir, "chunks.sqlite3"),
+            "CHAT_WRITE_BEHIND": "true" if args.write_behind else "false",
+            "LLM_TOKENS_PER_MINUTE": str(args.llm_tokens_per_minute),
+            "LLM_RETRY_BASE_DELAY": "0.1",
+        }
+        app = spawn(["-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(app_port),
+                     "--workers", str(args.workers), "--log-level", "warning"], env, quiet=not args.verbose)
+        processes.append(app)
+        await wait_until_up(f"{app_url}/", app)
+
+        limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+        async with httpx.AsyncClient(base_url=app_url, limits=limits, timeout=args.timeout) as client:
+            await seed(client, supabase_url, users, args)
+            sampler = RssSampler(app.pid)
+            sampler.start()
+            try:
+                result = await drive(client, users, mix, args)
+            finally:
+                await sampler.stop()
+            async with httpx.AsyncClient() as http:
+                upstream = {
+                    "supabase": (await http.get(f"{supabase_url}/_stats")).json(),
+                    "openai": (await http.get(f"{openai_url}/stats")).json(),
+                }
+    finally:
+        for process in reversed(processes):
+            stop(process)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    peak_rss = sampler.peak
+    if not peak_rss:
+        # No /proc (e.g. macOS): fall back to the largest single child, in KB on Linux and bytes on macOS
+        max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        peak_rss = max_rss if sys.platform == "darwin" else max_rss * 1024
+    return {
+        "config": {
+            "users": args.users, "duration": args.duration, "warmup": args.warmup, "workers": args.workers,
+            "mix": mix, "seed": args.seed, "llmLatency": args.llm_latency, "dbLatency": args.db_latency,
+            "storageLatency": args.storage_latency, "llmErrorRate": args.llm_error_rate,
+            "dbErrorRate": args.db_error_rate, "writeBehind": args.write_behind,
+        },
+        **result,
+        "peakRssBytes": peak_rss,
+        "upstream": upstream,
+    }
+
+
+def print_report(report: Dict[str, Any]):
+    config = report["config"]
+    print(f"{config['users']} users, {config['duration']}s after {config['warmup']}s warmup, "
+          f"{config['workers']} worker(s), seed {config['seed']}")
+    print(f"{'operation':<12} {'count':>7} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    rows = [*report["operations"].items(), ("total", report["total"])]
+    for name, stats in rows:
+        print(f"{name:<12} {stats['count']:>7} {stats['errors']:>7} {stats['throughput']:>8.1f} "
+              f"{stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} {stats['p99'] * 1000:>8.1f}")
+    print(f"peak RSS: {report['peakRssBytes'] / 2 ** 20:.1f} MiB")
+    for name, example in report["errorExamples"].items():
+        print(f"first {name} error: {example}")
+
+
+def regressions(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Operations whose p95, throughput or error rate got worse than baseline by more than tolerance"""
+    found = []
+    for name, stats in [*report["operations"].items(), ("total", report["total"])]:
+        before = baseline["total"] if name == "total" else baseline["operations"].get(name)
+        if not before or not before["count"] or not stats["count"]:
+            continue
+        if stats["p95"] > before["p95"] * (1 + tolerance):
+            found.append(f"{name}: p95 {before['p95'] * 1000:.1f} ms -> {stats['p95'] * 1000:.1f} ms")
+        if stats["throughput"] < before["throughput"] * (1 - tolerance):
+            found.append(f"{name}: throughput {before['throughput']} -> {stats['throughput']} req/s")
+        before_rate, rate = before["errors"] / before["count"], stats["errors"] / stats["count"]
+        if rate > before_rate + tolerance * 0.05:
+            found.append(f"{name}: error rate {before_rate:.2%} -> {rate:.2%}")
+    if report["peakRssBytes"] > baseline["peakRssBytes"] * (1 + tolerance):
+        found.append(f"peak RSS {baseline['peakRssBytes'] / 2 ** 20:.1f} MiB -> "
+                     f"{report['peakRssBytes'] / 2 ** 20:.1f} MiB")
+    return found
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of load before measuring")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes for the app")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Operation weights, e.g. chat=50,history=50")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--think-time", type=float, default=0.0, help="Mean pause between a user's requests")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--unique-messages", type=float, default=0.5,
+                        help="Share of chat messages made unique so they miss the analysis cache")
+    parser.add_argument("--file-chats", type=float, default=0.3, help="Share of chat turns that attach the user's upload")
+    parser.add_argument("--pdf-share", type=float, default=0.5, help="Share of report downloads requested as PDF")
+    parser.add_argument("--upload-rows", type=int, default=2000, help="Rows in each uploaded CSV")
+    parser.add_argument("--chats-per-user", type=int, default=20)
+    parser.add_argument("--reports-per-chat", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.3)
+    parser.add_argument("--stream-chunk-delay", type=float, default=0.01)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--llm-max-concurrent", type=int, default=0, help="Concurrent model calls before 429s")
+    parser.add_argument("--llm-tokens-per-minute", type=int, default=100_000_000)
+    parser.add_argument("--db-latency", type=float, default=0.005)
+    parser.add_argument("--storage-latency", type=float, default=0.01)
+    parser.add_argument("--db-error-rate", type=float, default=0.0, help="Share of database writes failed with 503")
+    parser.add_argument("--write-behind", action="store_true", help="Run the app with CHAT_WRITE_BEHIND")
+    parser.add_argument("--verbose", action="store_true", help="Show the app's log output")
+    parser.add_argument("--json", action="store_true", help="Print the full result as JSON")
+    parser.add_argument("--baseline", help="JSON result of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression vs --baseline")
+    args = parser.parse_args()
+
+    report = asyncio.run(main_async(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(report, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if found else 0)
@@ -0,0 +1,79 @@
+"""Normalized bias categories and time buckets for report analytics.
+
+Reports store the categories of bias their reasons mention (the types listed in
+the bias system prompt) as a text array when they are written, and the database
+keeps per-user, per-day, per-category counts of them in report_rollups, updated
+by a trigger on every insert and delete. Analytics queries read only those
+rollups, so their cost depends on the date range asked for and not on how many
+reports a user has.
+
+The same patterns are used by the bias_categories() SQL function that backfills
+reports written before the column existed; keep the two in step.
+"""
+import re
+from datetime import date, timedelta
+from typing import Any, Dict, Iterable, List
+
+# In the order of the system prompt's list
+CATEGORY_PATTERNS = {
+    "gender": r"\b(gender\w*|sex|sexis\w*|women|woman|men|man|male|female|masculine|feminine)\b",
+    "racial": r"\b(racial\w*|race|races|racis\w*|ethnic\w*|skin colou?r)\b",
+    "age": r"\b(age|ageis\w*|aged|older|younger|elderly|youth)\b",
+    "socioeconomic": r"\b(socio-?economic\w*|income|wealth\w*|poverty|poor|social class|zip ?codes?|postcodes?)\b",
+    "cultural": r"\b(cultur\w*|religio\w*|nationalit\w*)\b",
+    "selection": r"\b(selection|self-selected|survivorship)\b",
+    "confirmation": r"\bconfirmation\b",
+    "sampling": r"\b(sampl\w*|under-?represent\w*|over-?represent\w*|unrepresentative)\b",
+    "algorithmic": r"\b(algorithm\w*|proxy|proxies|feedback loops?)\b",
+}
+CATEGORIES = tuple(CATEGORY_PATTERNS)
+OTHER = "other"  # Reasons that match none of the above
+ALL = "all"  # Rollup rows counting every report, whatever its categories
+BUCKETS = ("day", "week", "month")
+
+_COMPILED = {category: re.compile(pattern, re.IGNORECASE) for category, pattern in CATEGORY_PATTERNS.items()}
+
+
+def categorize(reasons: Iterable[str]) -> List[str]:
+    """Categories mentioned by a report's reasons, in CATEGORIES order; [OTHER] if none match"""
+    text = "\n".join(reasons)
+    found = [category for category, pattern in _COMPILED.items() if pattern.search(text)]
+    return found or [OTHER]
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    """First day of the bucket containing day; weeks start on Monday, as with date_trunc"""
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def bucket_starts(start: date, end: date, bucket: str) -> List[date]:
+    """Start of every bucket overlapping start..end, oldest first"""
+    starts = []
+    current = bucket_start(start, bucket)
+    while current <= end:
+        starts.append(current)
+        if bucket == "month":
+            current = (current.replace(day=28) + timedelta(days=4)).replace(day=1)
+        else:
+            current += timedelta(days=7 if bucket == "week" else 1)
+    return starts
+
+
+def fill_buckets(rows: List[Dict[str, Any]], start: date, end: date, bucket: str,
+                 categories: Iterable[str]) -> List[Dict[str, Any]]:
+    """API buckets for start..end from bias_analytics rows ({bucket_start, counts}), empty ones included"""
+    categories = list(categories)
+    counts_by_start = {row["bucket_start"]: row["counts"] for row in rows}
+    buckets = []
+    for starts_on in bucket_starts(start, end, bucket):
+        counts = counts_by_start.get(starts_on.isoformat(), {})
+        buckets.append({
+            "start": starts_on.isoformat(),
+            "reports": counts.get(ALL, 0),
+            "categories": {category: counts.get(category, 0) for category in categories}
+        })
+    return buckets
@@ -0,0 +1,112 @@
+"""Stored analyses of file chunks, for incremental re-analysis of new file versions.
+
+Chunked analysis splits files at content-defined boundaries (see chunked_analysis),
+so a new version of a dataset shares almost all of its chunks with the previous
+one. This SQLite store keeps every chunk's analysis under its fingerprint and the
+analysis context (the message, system prompt and model settings it was analysed
+with), so a re-analysis only sends the chunks that changed. Unlike the analysis
+cache it has no entry limit, so a whole large file's chunks stay available; rows
+not read or written for ttl_seconds are purged at startup.
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from chunked_analysis import ChunkAnalysis
+
+# Fingerprints looked up per query, within SQLite's bound parameter limit
+LOOKUP_BATCH = 500
+
+
+class ChunkStore:
+    """SQLite table of chunk analyses keyed by (context, fingerprint)"""
+
+    def __init__(self, path: str, ttl_seconds: float = 30 * 86400):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+
+    def open(self):
+        """Connect, create the table and purge expired rows (called at startup)"""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS chunk_results ("
+            " context TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " reply TEXT NOT NULL,"
+            " report TEXT NOT NULL,"
+            " used_at REAL NOT NULL,"
+            " PRIMARY KEY (context, fingerprint));"
+            "CREATE INDEX IF NOT EXISTS idx_chunk_results_used_at ON chunk_results(used_at);"
+        )
+        self.purge_expired()
+
+    def get_many(self, context: str, fingerprints: List[str]) -> Dict[str, ChunkAnalysis]:
+        """Stored analyses of the given chunks, marking them as used"""
+        found: Dict[str, ChunkAnalysis] = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(fingerprints), LOOKUP_BATCH):
+                batch = fingerprints[start:start + LOOKUP_BATCH]
+                placeholders = ", ".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT fingerprint, reply, report FROM chunk_results"
+                    f" WHERE context = ? AND fingerprint IN ({placeholders})",
+                    (context, *batch),
+                ).fetchall()
+                for fingerprint, reply, report in rows:
+                    found[fingerprint] = (reply, json.loads(report))
+                # Reading an analysis keeps it alive, so chunks shared by every version never expire
+                self._conn.execute(
+                    f"UPDATE chunk_results SET used_at = ? WHERE context = ? AND fingerprint IN ({placeholders})",
+                    (now, context, *batch),
+                )
+        self.hits += len(found)
+        self.misses += len(fingerprints) - len(found)
+        return found
+
+    def put_many(self, context: str, results: Dict[str, ChunkAnalysis]):
+        now = time.time()
+        rows = [
+            (context, fingerprint, reply, json.dumps(report), now) for fingerprint, (reply, report) in results.items()
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunk_results (context, fingerprint, reply, report, used_at)"
+                    " VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        self.stored += len(results)
+
+    def purge_expired(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunk_results WHERE used_at < ?", (time.time() - self.ttl_seconds,))
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": self.hits / lookups if lookups else 0.0,
+            "stored": self.stored,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+            self._conn = None
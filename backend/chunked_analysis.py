@@ -0,0 +1,215 @@
+"""Map-reduce bias analysis over whole files.
+
+Large uploads are split into token-bounded chunks that never cut a CSV or JSONL
+record in half, each chunk is analysed concurrently under a parallelism limit,
+and the per-chunk reports are merged into one with deduplicated findings and a
+trace of the chunks each finding came from.
+
+Chunk boundaries are content-defined: a chunk ends after a record whose hash
+says so (once the chunk is past a minimum size), not after a fixed amount of
+text. Editing, inserting or deleting rows therefore only changes the chunks
+around the edit, and every other chunk of a new version of a file has the same
+text, and so the same fingerprint, as before. Given stored results by
+fingerprint, only new chunks are analysed.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English text and tabular data
+CHARS_PER_TOKEN = 4
+
+CHUNK_PROMPT_NOTE = (
+    "This is one part of a larger uploaded file. Only report bias that is visible in this part."
+)
+
+# Content-defined chunking: no boundary before half the budget, then one after each
+# record with probability len(record) / (budget * BOUNDARY_SPACING), so chunks average
+# about two thirds of the budget and a chunk is forced to end at the budget only rarely
+MIN_CHUNK_FRACTION = 0.5
+BOUNDARY_SPACING = 1 / 6
+
+# (reply, report dict) for one chunk
+ChunkAnalysis = Tuple[str, Dict[str, Any]]
+# fingerprints -> stored analyses of those that have one
+LoadResults = Callable[[List[str]], Awaitable[Dict[str, ChunkAnalysis]]]
+# new analyses by fingerprint
+SaveResults = Callable[[Dict[str, ChunkAnalysis]], Awaitable[Any]]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used to size chunks"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def detect_file_format(file_name: Optional[str]) -> str:
+    """Return "csv", "tsv", "jsonl" or "text" from a file name or URL"""
+    extension = (file_name or "").split("?")[0].rsplit(".", 1)[-1].lower()
+    if extension in ("csv", "tsv"):
+        return extension
+    if extension in ("jsonl", "ndjson"):
+        return "jsonl"
+    return "text"
+
+
+def iter_records(content: str, quoted: bool) -> Iterator[str]:
+    """Yield records (with their line endings), keeping quoted newlines inside a record"""
+    record: List[str] = []
+    open_quote = False
+    for line in content.splitlines(keepends=True):
+        record.append(line)
+        if quoted and line.count('"') % 2:
+            open_quote = not open_quote
+        if not open_quote:
+            yield "".join(record)
+            record = []
+    if record:
+        yield "".join(record)
+
+
+def _split_oversized(record: str, max_chars: int) -> Iterator[str]:
+    for start in range(0, len(record), max_chars):
+        yield record[start:start + max_chars]
+
+
+def _is_boundary(record: str, average_chars: float) -> bool:
+    """Whether a chunk may end after this record; depends only on the record's content"""
+    return zlib.crc32(record.encode("utf-8", "surrogatepass")) < (len(record) / average_chars) * 2 ** 32
+
+
+def split_into_chunks(content: str, max_tokens: int, file_format: str = "text") -> List[str]:
+    """Split content into chunks of at most max_tokens at content-defined record boundaries.
+
+    CSV/TSV chunks each repeat the header row so every chunk is self-describing.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    records = iter_records(content, quoted=file_format in ("csv", "tsv"))
+
+    header = ""
+    if file_format in ("csv", "tsv"):
+        header = next(records, "")
+        if header and not header.endswith("\n"):
+            header += "\n"
+    budget = max(max_chars - len(header), CHARS_PER_TOKEN)
+    min_size = budget * MIN_CHUNK_FRACTION
+    average_chars = budget * BOUNDARY_SPACING
+
+    chunks: List[str] = []
+    current: List[str] = []
+    current_size = 0
+    for record in records:
+        pieces = [record] if len(record) <= budget else list(_split_oversized(record, budget))
+        for piece in pieces:
+            if current and current_size + len(piece) > budget:
+                chunks.append(header + "".join(current))
+                current, current_size = [], 0
+            current.append(piece)
+            current_size += len(piece)
+            if current_size >= min_size and _is_boundary(piece, average_chars):
+                chunks.append(header + "".join(current))
+                current, current_size = [], 0
+    if current or not chunks:
+        chunks.append(header + "".join(current))
+    return chunks
+
+
+def chunk_fingerprint(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode("utf-8", "surrogatepass")).hexdigest()
+
+
+def _finding_key(text: str) -> str:
+    """Normalize a finding for deduplication"""
+    return re.sub(r"[^a-z0-9]+", " ", text.lower()).strip()
+
+
+def merge_chunk_reports(reports: List[Tuple[int, Dict[str, Any]]]) -> Dict[str, Any]:
+    """Merge per-chunk reports into one, deduplicating findings and tracing their chunks"""
+    merged: Dict[str, Any] = {"bias_detected": False, "reasons": [], "fixes": [], "trace": []}
+    seen: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for chunk_index, report in sorted(reports, key=lambda item: item[0]):
+        merged["bias_detected"] = merged["bias_detected"] or bool(report.get("bias_detected"))
+        for kind, field in (("reason", "reasons"), ("fix", "fixes")):
+            for finding in report.get(field) or []:
+                key = (kind, _finding_key(finding))
+                if key in seen:
+                    if chunk_index not in seen[key]["chunks"]:
+                        seen[key]["chunks"].append(chunk_index)
+                    continue
+                entry = {"finding": finding, "kind": kind, "chunks": [chunk_index]}
+                seen[key] = entry
+                merged[field].append(finding)
+                merged["trace"].append(entry)
+    return merged
+
+
+def fingerprinted_chunks(text: str, max_tokens: int, file_format: str) -> Tuple[List[str], List[str]]:
+    """split_into_chunks and the fingerprint of every chunk"""
+    chunks = split_into_chunks(text, max_tokens, file_format)
+    return chunks, [chunk_fingerprint(chunk) for chunk in chunks]
+
+
+async def map_reduce_analysis(
+    message: str,
+    file_content: str,
+    analyse_chunk: Callable[[str, str], Awaitable[ChunkAnalysis]],
+    file_name: Optional[str] = None,
+    max_tokens: int = 3000,
+    max_parallel: int = 4,
+    load_results: Optional[LoadResults] = None,
+    save_results: Optional[SaveResults] = None,
+) -> ChunkAnalysis:
+    """Analyse every chunk of file_content concurrently and merge the results.
+
+    analyse_chunk(message, chunk) must raise on failure; failed chunks are left out
+    of the merged report and only an all-chunk failure is raised to the caller.
+    With load_results, chunks that already have a stored analysis (for this message)
+    aren't analysed again; save_results receives the analyses of the rest.
+    """
+    # Hashing every record and chunk of a large file takes long enough to stall the event loop
+    chunks, fingerprints = await asyncio.to_thread(
+        fingerprinted_chunks, file_content, max_tokens, detect_file_format(file_name)
+    )
+    stored = await load_results(list(set(fingerprints))) if load_results is not None else {}
+    chunk_message = f"{message}\n\n{CHUNK_PROMPT_NOTE}"
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def run(index: int, chunk: str) -> Tuple[int, ChunkAnalysis]:
+        if fingerprints[index] in stored:
+            return index, stored[fingerprints[index]]
+        async with semaphore:
+            return index, await analyse_chunk(chunk_message, chunk)
+
+    results = await asyncio.gather(*(run(i, chunk) for i, chunk in enumerate(chunks)), return_exceptions=True)
+
+    succeeded: List[Tuple[int, ChunkAnalysis]] = []
+    failed: List[int] = []
+    for index, result in enumerate(results):
+        if isinstance(result, BaseException):
+            logger.error(f"Chunk {index} analysis failed: {str(result)}")
+            failed.append(index)
+        else:
+            succeeded.append(result)
+    new = {fingerprints[index]: analysis for index, analysis in succeeded if fingerprints[index] not in stored}
+    if new and save_results is not None:
+        try:
+            await save_results(new)
+        except Exception as e:
+            logger.error(f"Could not store chunk analyses: {str(e)}")
+    if not succeeded:
+        raise RuntimeError(f"All {len(chunks)} chunks failed analysis")
+
+    merged = merge_chunk_reports([(index, report) for index, (_, report) in succeeded])
+    first_reply = min(succeeded, key=lambda item: item[0])[1][0]
+    summary = f"Analysed the full file in {len(chunks)} part{'s' if len(chunks) != 1 else ''}"
+    reused = sum(fingerprint in stored for fingerprint in fingerprints)
+    if reused:
+        summary += f" (findings for {reused} unchanged part{'s' if reused != 1 else ''} reused from an earlier analysis)"
+    if failed:
+        summary += f" ({len(failed)} could not be analysed: {', '.join(str(i) for i in failed)})"
+    reply = f"{first_reply}\n\n{summary}; the report merges the findings from every part."
+    return reply, merged
@@ -0,0 +1,135 @@
+"""Token-budgeted conversation history for chat turns.
+
+Each model call gets the chat's earlier turns within a fixed token budget: a
+rolling summary of older messages first, then as many of the most recent
+messages as fit, newest kept first. The summary is stored on the chat with the
+seq of the last message it covers and is refreshed in the background once
+enough unsummarized messages have built up, folding them into the previous
+summary rather than re-reading the whole chat. Prompt size therefore stays
+bounded however long the conversation gets, and the summary is computed once
+every few turns instead of on every request.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from chunked_analysis import CHARS_PER_TOKEN, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_SYSTEM_PROMPT = """You maintain a running summary of a conversation between a user and BiasBuster, \
+an assistant that detects bias in datasets, AI models and text.
+Update the summary with the new messages. Keep what later questions may refer to: the material being \
+analysed (files, columns, groups, numbers), the bias findings and recommended fixes, and the user's open \
+questions. Drop pleasantries and repetition. Reply with the updated summary only, in at most {words} words."""
+
+# Stored message roles -> chat-completions roles
+MODEL_ROLES = {"user": "user", "ai": "assistant"}
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, marking the cut"""
+    max_chars = max(max_tokens, 0) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    return text[:max(max_chars - 3, 0)] + "..."
+
+
+def summary_message(summary: str) -> Dict[str, str]:
+    return {"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}
+
+
+def fit_history(summary: Optional[str], summary_seq: int, recent: List[Dict[str, Any]],
+                max_tokens: int) -> List[Dict[str, str]]:
+    """Model messages for the history part of a prompt, within max_tokens.
+
+    recent holds the chat's latest stored messages (seq, role, content), in any
+    order; those already covered by the summary are skipped. If even the newest
+    message doesn't fit whole, it is truncated rather than dropped.
+    """
+    history: List[Dict[str, str]] = []
+    remaining = max_tokens
+    if summary and remaining > 0:
+        message = summary_message(truncate_to_tokens(summary, remaining))
+        history.append(message)
+        remaining -= estimate_tokens(message["content"])
+
+    turns: List[Dict[str, str]] = []
+    for row in sorted(recent, key=lambda row: row["seq"], reverse=True):
+        if row["seq"] <= summary_seq or remaining <= 0:
+            break
+        content = row["content"]
+        tokens = estimate_tokens(content)
+        if tokens > remaining:
+            if turns:
+                break
+            content, tokens = truncate_to_tokens(content, remaining), remaining
+        turns.append({"role": MODEL_ROLES.get(row["role"], "user"), "content": content})
+        remaining -= tokens
+    turns.reverse()
+    return history + turns
+
+
+def history_cache_context(history: List[Dict[str, str]]) -> str:
+    """Stable text form of a prompt's history, for cache keys"""
+    return "\n".join(f"{message['role']}: {message['content']}" for message in history)
+
+
+def summary_due(summary_seq: int, last_seq: int, keep_messages: int, every_messages: int) -> Optional[int]:
+    """Seq the summary should be advanced to, or None while too few new messages have built up.
+
+    The last keep_messages stay out of the summary so recent turns are always sent verbatim.
+    """
+    if last_seq - summary_seq < keep_messages + every_messages:
+        return None
+    return last_seq - keep_messages
+
+
+def build_summary_messages(previous: Optional[str], rows: List[Dict[str, Any]], max_words: int,
+                           message_max_tokens: int) -> List[Dict[str, str]]:
+    """Prompt folding new messages into the previous summary"""
+    transcript = "\n".join(
+        f"{'User' if row['role'] == 'user' else 'Assistant'}: {truncate_to_tokens(row['content'], message_max_tokens)}"
+        for row in sorted(rows, key=lambda row: row["seq"])
+    )
+    return [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.format(words=max_words)},
+        {"role": "user", "content": f"Current summary:\n{previous or '(none yet)'}\n\nNew messages:\n{transcript}"},
+    ]
+
+
+class SummaryRefresher:
+    """Runs summary refreshes in the background, at most one at a time per chat"""
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.refreshes = 0
+        self.failures = 0
+
+    def schedule(self, chat_id: str, refresh: Callable[[], Awaitable[None]]) -> bool:
+        """Start refresh for a chat unless one is already running; returns whether it started"""
+        if chat_id in self._tasks:
+            return False
+        task = asyncio.create_task(self._run(chat_id, refresh))
+        self._tasks[chat_id] = task
+        return True
+
+    async def _run(self, chat_id: str, refresh: Callable[[], Awaitable[None]]):
+        try:
+            await refresh()
+            self.refreshes += 1
+        except Exception as e:
+            # The next turn tries again; until then the prompt uses the older summary
+            self.failures += 1
+            logger.error(f"Conversation summary error: {str(e)}")
+        finally:
+            del self._tasks[chat_id]
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": len(self._tasks), "refreshes": self.refreshes, "failures": self.failures}
@@ -0,0 +1,404 @@
+"""Local, deterministic fairness metrics for tabular uploads.
+
+Files are read in row batches so memory stays bounded however large the upload
+is. Each batch is turned into NumPy column arrays and aggregated with vectorised
+group counts; only per-group running totals are kept between batches. Fixed-width
+string arrays pad every cell to the longest one in the column, so cells are cut
+to MAX_CELL_CHARS and batches end once their arrays would exceed BATCH_MAX_BYTES,
+whichever of that and BATCH_ROWS comes first.
+
+Computed per candidate protected attribute:
+- representation: share of rows per group and the smallest/largest share ratio
+- label rate per group, demographic-parity difference and disparate-impact ratio
+  (when a binary label column is found)
+- missing-value rate per group across the other columns and its max/min skew
+"""
+import csv
+import io
+import mmap
+import re
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+BATCH_ROWS = 50_000
+BATCH_MAX_BYTES = 32 * 1024 * 1024  # Upper bound on a batch's column arrays (4 bytes per character)
+# Longer cells (free text) are truncated; groups, labels, numbers and missing markers are far shorter
+MAX_CELL_CHARS = 200
+# Bytes of a memory-mapped file decoded at a time
+MMAP_SLICE_BYTES = 4 * 1024 * 1024
+# Attributes with more distinct values than this are not treated as groups
+MAX_GROUPS = 50
+
+MISSING_VALUES = np.array(["", "na", "n/a", "nan", "null", "none", "?"])
+POSITIVE_VALUES = {"1", "true", "yes", "y", "positive", "approved", "accepted", "hired", "pass", "granted", ">50k"}
+
+PROTECTED_PATTERNS = {
+    "gender": r"gender|sex",
+    "race": r"race|ethnic",
+    "age": r"(^|_|\b)age($|_|\b)|age_group|agegroup|birth",
+    "religion": r"religion|faith",
+    "nationality": r"nationality|citizenship|country_of_origin|native_country",
+    "disability": r"disab",
+    "marital_status": r"marital|married",
+}
+LABEL_PATTERN = r"^(label|target|outcome|class|y|decision|approved|hired|admitted|default|result|income)$"
+
+AGE_BANDS = [0, 18, 25, 35, 45, 55, 65, np.inf]
+AGE_BAND_LABELS = np.array(["<18", "18-24", "25-34", "35-44", "45-54", "55-64", "65+"])
+
+# Thresholds used when turning metrics into report findings
+REPRESENTATION_RATIO_THRESHOLD = 0.5
+DISPARATE_IMPACT_THRESHOLD = 0.8  # Four-fifths rule
+MISSING_SKEW_THRESHOLD = 2.0
+MISSING_RATE_FLOOR = 0.001  # Denominator floor so groups with no missing values give a finite skew
+MIN_REPORTED_MISSING_RATE = 0.01
+
+
+class FairnessMetricsError(Exception):
+    """Raised when a file can't be read as a table"""
+
+
+def detect_tabular_format(file_name: Optional[str]) -> Optional[str]:
+    """Return "csv", "tsv" or "parquet" for tabular uploads, otherwise None"""
+    extension = (file_name or "").split("?")[0].rsplit(".", 1)[-1].lower()
+    if extension in ("csv", "tsv"):
+        return extension
+    if extension in ("parquet", "pq"):
+        return "parquet"
+    return None
+
+
+def _normalize_name(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", name.strip().lower()).strip("_")
+
+
+def _iter_mapped_lines(f) -> Iterator[str]:
+    """Lines of a file read through a memory map, split like open(newline="") would.
+
+    The file is decoded a few MB at a time, cut after a newline so no line (or UTF-8
+    sequence) straddles two slices; the page cache is read directly, without copying
+    through a read buffer.
+    """
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        start = 0
+        size = len(mapped)
+        while start < size:
+            end = min(start + MMAP_SLICE_BYTES, size)
+            if end < size:
+                newline = mapped.rfind(b"\n", start, end)
+                if newline >= 0:
+                    end = newline + 1
+            yield from io.StringIO(mapped[start:end].decode("utf-8", errors="ignore"), newline="")
+            start = end
+
+
+def _iter_lines(f) -> Iterator[str]:
+    try:
+        yield from _iter_mapped_lines(f)
+    except (ValueError, OSError):
+        # Empty files and non-regular files can't be mapped
+        f.seek(0)
+        yield from io.TextIOWrapper(f, encoding="utf-8", errors="ignore", newline="")
+
+
+def _iter_csv_batches(path: str, delimiter: str) -> Iterator[tuple[List[str], List[np.ndarray]]]:
+    with open(path, "rb") as f:
+        reader = csv.reader(_iter_lines(f), delimiter=delimiter)
+        header = next(reader, None)
+        if not header:
+            raise FairnessMetricsError("File has no header row")
+        width = len(header)
+        rows: List[List[str]] = []
+        longest = 1
+        for row in reader:
+            if len(row) != width:
+                row = (row + [""] * width)[:width]
+            row_longest = max(map(len, row), default=0)
+            if row_longest > MAX_CELL_CHARS:
+                row = [value[:MAX_CELL_CHARS] for value in row]
+                row_longest = MAX_CELL_CHARS
+            longest = max(longest, row_longest)
+            rows.append(row)
+            # Every column padded to the batch's longest cell bounds the arrays' size from above
+            if len(rows) >= BATCH_ROWS or len(rows) * width * longest * 4 >= BATCH_MAX_BYTES:
+                yield header, [np.asarray(col, dtype=str) for col in zip(*rows)]
+                rows = []
+                longest = 1
+        if rows:
+            yield header, [np.asarray(col, dtype=str) for col in zip(*rows)]
+
+
+def _iter_parquet_batches(path: str) -> Iterator[tuple[List[str], List[np.ndarray]]]:
+    try:
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise FairnessMetricsError("Parquet support requires the pyarrow package") from e
+    parquet_file = pq.ParquetFile(path)
+    header = parquet_file.schema_arrow.names
+    # Cell lengths aren't known before reading, so batches are sized for the longest possible cells
+    batch_rows = max(1, min(BATCH_ROWS, BATCH_MAX_BYTES // (max(len(header), 1) * MAX_CELL_CHARS * 4)))
+    for batch in parquet_file.iter_batches(batch_size=batch_rows):
+        columns = []
+        for column in batch.columns:
+            values = column.to_pylist()
+            columns.append(np.asarray(["" if v is None else str(v)[:MAX_CELL_CHARS] for v in values], dtype=str))
+        yield header, columns
+
+
+def iter_batches(path: str, file_format: str) -> Iterator[tuple[List[str], List[np.ndarray]]]:
+    """Yield (header, column arrays) for successive row batches of a tabular file"""
+    if file_format == "parquet":
+        return _iter_parquet_batches(path)
+    return _iter_csv_batches(path, "\t" if file_format == "tsv" else ",")
+
+
+def missing_mask(column: np.ndarray) -> np.ndarray:
+    return np.isin(np.char.lower(np.char.strip(column)), MISSING_VALUES)
+
+
+def to_float(column: np.ndarray) -> Optional[np.ndarray]:
+    """Parse a column as numbers (missing values become NaN), or None if it isn't numeric"""
+    try:
+        return np.where(missing_mask(column), "nan", column).astype(float)
+    except ValueError:
+        return None
+
+
+def age_bands(column: np.ndarray) -> Optional[np.ndarray]:
+    numbers = to_float(column)
+    if numbers is None:
+        return None
+    bands = np.digitize(np.nan_to_num(numbers, nan=-1), AGE_BANDS[1:-1])
+    grouped = AGE_BAND_LABELS[bands].astype(object)
+    grouped[np.isnan(numbers) | (numbers < 0)] = "(missing)"
+    return grouped.astype(str)
+
+
+def detect_protected_columns(header: Sequence[str], columns: Sequence[np.ndarray]) -> Dict[int, str]:
+    """Map column index to protected category for columns that look like sensitive attributes"""
+    found: Dict[int, str] = {}
+    for index, name in enumerate(header):
+        normalized = _normalize_name(name)
+        for category, pattern in PROTECTED_PATTERNS.items():
+            if re.search(pattern, normalized):
+                if category != "age" and len(np.unique(columns[index])) > MAX_GROUPS:
+                    break
+                found[index] = category
+                break
+    return found
+
+
+def detect_label_column(header: Sequence[str], columns: Sequence[np.ndarray],
+                        label_column: Optional[str] = None) -> Optional[tuple[int, str]]:
+    """Return (index, positive value) of a binary outcome column, if one is found"""
+    for index, name in enumerate(header):
+        if label_column is not None:
+            if name != label_column:
+                continue
+        elif not re.match(LABEL_PATTERN, _normalize_name(name)):
+            continue
+        column = columns[index]
+        values = np.unique(np.char.strip(column[~missing_mask(column)]))
+        if len(values) != 2:
+            continue
+        lowered = [v.lower() for v in values]
+        positive = next((v for v, low in zip(values, lowered) if low in POSITIVE_VALUES), None)
+        return index, str(positive if positive is not None else values[-1])
+    return None
+
+
+class _GroupTotals:
+    """Running per-group totals for one attribute"""
+
+    def __init__(self, name: str, category: str):
+        self.name = name
+        self.category = category
+        self.count: Dict[str, float] = {}
+        self.positives: Dict[str, float] = {}
+        self.labeled: Dict[str, float] = {}
+        self.missing_cells: Dict[str, float] = {}
+        self.overflow = False
+
+    def add(self, groups: np.ndarray, positive: Optional[np.ndarray], labeled: Optional[np.ndarray],
+            missing_per_row: np.ndarray):
+        values, inverse = np.unique(groups, return_inverse=True)
+        sums = {
+            "count": np.bincount(inverse, minlength=len(values)),
+            "missing_cells": np.bincount(inverse, weights=missing_per_row, minlength=len(values)),
+        }
+        if positive is not None:
+            sums["positives"] = np.bincount(inverse, weights=positive, minlength=len(values))
+            sums["labeled"] = np.bincount(inverse, weights=labeled, minlength=len(values))
+        for field, totals in sums.items():
+            target = getattr(self, field)
+            for value, total in zip(values.tolist(), totals.tolist()):
+                target[value] = target.get(value, 0) + total
+        if len(self.count) > MAX_GROUPS:
+            self.overflow = True
+
+
+def compute_fairness_metrics(path: str, file_format: str, label_column: Optional[str] = None,
+                             on_batch: Optional[Callable[[List[str], List[np.ndarray], np.ndarray], None]] = None
+                             ) -> Dict[str, Any]:
+    """Stream a tabular file and compute group fairness metrics for its protected attributes.
+
+    on_batch, if given, sees every (header, columns, missing) batch, where missing is the
+    columns' missing_mask stacked, so other per-row work can share the same pass over the file.
+    """
+    rows = 0
+    header: List[str] = []
+    totals: Dict[int, _GroupTotals] = {}
+    label: Optional[tuple[int, str]] = None
+
+    for header, columns in iter_batches(path, file_format):
+        if rows == 0:
+            protected = detect_protected_columns(header, columns)
+            totals = {index: _GroupTotals(header[index], category) for index, category in protected.items()}
+            label = detect_label_column(header, columns, label_column)
+        rows += len(columns[0]) if columns else 0
+
+        missing = np.vstack([missing_mask(column) for column in columns])
+        missing_per_row = missing.sum(axis=0)
+        if on_batch is not None:
+            on_batch(header, columns, missing)
+
+        positive = labeled = None
+        if label is not None:
+            label_values = np.char.strip(columns[label[0]])
+            positive = (label_values == label[1]).astype(float)
+            labeled = (~missing[label[0]]).astype(float)
+
+        for index, group_totals in totals.items():
+            if group_totals.overflow:
+                continue
+            groups = columns[index]
+            if group_totals.category == "age":
+                banded = age_bands(groups)
+                if banded is not None:
+                    groups = banded
+            groups = np.where(missing[index], "(missing)", np.char.strip(groups))
+            group_totals.add(groups, positive, labeled, missing_per_row - missing[index])
+
+    attributes = []
+    other_columns = max(len(header) - 1, 1)
+    for group_totals in totals.values():
+        if group_totals.overflow:
+            continue
+        attributes.append(_attribute_metrics(group_totals, rows, other_columns, label is not None))
+
+    return {
+        "rows": rows,
+        "columns": header,
+        "labelColumn": header[label[0]] if label is not None else None,
+        "positiveLabel": label[1] if label is not None else None,
+        "attributes": attributes,
+    }
+
+
+def _ratio(low: float, high: float) -> Optional[float]:
+    return round(low / high, 4) if high else None
+
+
+def _attribute_metrics(totals: _GroupTotals, rows: int, other_columns: int, has_label: bool) -> Dict[str, Any]:
+    groups = []
+    for value, count in sorted(totals.count.items(), key=lambda item: -item[1]):
+        group: Dict[str, Any] = {
+            "value": value,
+            "count": int(count),
+            "share": round(count / rows, 4) if rows else 0.0,
+            "missingRate": round(totals.missing_cells.get(value, 0) / (count * other_columns), 4),
+        }
+        if has_label:
+            labeled = totals.labeled.get(value, 0)
+            group["positiveRate"] = round(totals.positives.get(value, 0) / labeled, 4) if labeled else None
+        groups.append(group)
+
+    # "(missing)" is reported as a group but excluded from the disparity ratios
+    present = [g for g in groups if g["value"] != "(missing)"]
+    shares = [g["share"] for g in present]
+    metrics: Dict[str, Any] = {
+        "column": totals.name,
+        "category": totals.category,
+        "groups": groups,
+        "representationRatio": _ratio(min(shares), max(shares)) if shares else None,
+    }
+    missing_rates = [g["missingRate"] for g in present]
+    if missing_rates:
+        highest = max(missing_rates)
+        metrics["missingRateSkew"] = round(highest / max(min(missing_rates), MISSING_RATE_FLOOR), 4) if highest else 1.0
+    if has_label:
+        rates = [g["positiveRate"] for g in present if g.get("positiveRate") is not None]
+        if rates:
+            metrics["demographicParityDifference"] = round(max(rates) - min(rates), 4)
+            metrics["disparateImpactRatio"] = _ratio(min(rates), max(rates))
+    return metrics
+
+
+def metrics_to_report(metrics: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn computed metrics into bias report reasons and fixes"""
+    reasons: List[str] = []
+    fixes: List[str] = []
+    for attribute in metrics["attributes"]:
+        column = attribute["column"]
+        present = [g for g in attribute["groups"] if g["value"] != "(missing)"]
+        if len(present) < 2:
+            continue
+        smallest, largest = present[-1], present[0]
+
+        ratio = attribute.get("representationRatio")
+        if ratio is not None and ratio < REPRESENTATION_RATIO_THRESHOLD:
+            reasons.append(
+                f"Representation bias in '{column}': group '{smallest['value']}' makes up "
+                f"{smallest['share']:.1%} of rows versus {largest['share']:.1%} for '{largest['value']}'"
+            )
+            fixes.append(f"Collect more data for under-represented '{column}' groups or reweight/resample them")
+
+        impact = attribute.get("disparateImpactRatio")
+        if impact is not None and impact < DISPARATE_IMPACT_THRESHOLD:
+            rated = [g for g in present if g.get("positiveRate") is not None]
+            low = min(rated, key=lambda g: g["positiveRate"])
+            high = max(rated, key=lambda g: g["positiveRate"])
+            reasons.append(
+                f"Outcome disparity by '{column}': '{metrics['labelColumn']}' = '{metrics['positiveLabel']}' "
+                f"for {low['positiveRate']:.1%} of '{low['value']}' versus {high['positiveRate']:.1%} of "
+                f"'{high['value']}' (disparate impact {impact:.2f}, below the four-fifths rule)"
+            )
+            fixes.append(
+                f"Audit how '{metrics['labelColumn']}' was assigned across '{column}' groups and consider "
+                f"fairness constraints or threshold adjustment"
+            )
+
+        skew = attribute.get("missingRateSkew")
+        worst = max(present, key=lambda g: g["missingRate"])
+        if skew is not None and skew > MISSING_SKEW_THRESHOLD and worst["missingRate"] >= MIN_REPORTED_MISSING_RATE:
+            reasons.append(
+                f"Missing-data skew by '{column}': group '{worst['value']}' has {worst['missingRate']:.1%} "
+                f"missing values, {skew:.1f}x the least affected group"
+            )
+            fixes.append(f"Investigate why data is missing more often for some '{column}' groups before imputing")
+
+    return {"bias_detected": bool(reasons), "reasons": reasons, "fixes": fixes}
+
+
+def summarize_metrics(metrics: Dict[str, Any]) -> str:
+    """Plain-text summary of the metrics, used as a reply and as prompt context"""
+    lines = [f"Rows analysed: {metrics['rows']}"]
+    if metrics["labelColumn"]:
+        lines.append(f"Outcome column: {metrics['labelColumn']} (positive = {metrics['positiveLabel']})")
+    if not metrics["attributes"]:
+        lines.append("No protected-attribute columns were detected.")
+    for attribute in metrics["attributes"]:
+        lines.append(f"{attribute['column']} ({attribute['category']}):")
+        for group in attribute["groups"][:10]:
+            detail = f"  - {group['value']}: {group['count']} rows ({group['share']:.1%}), missing {group['missingRate']:.1%}"
+            if group.get("positiveRate") is not None:
+                detail += f", positive rate {group['positiveRate']:.1%}"
+            lines.append(detail)
+        for key, label in (("representationRatio", "representation ratio"),
+                           ("disparateImpactRatio", "disparate impact ratio"),
+                           ("demographicParityDifference", "demographic parity difference"),
+                           ("missingRateSkew", "missing-value skew")):
+            if attribute.get(key) is not None:
+                lines.append(f"  {label}: {attribute[key]}")
+    return "\n".join(lines)
@@ -0,0 +1,250 @@
+"""Central scheduler for model calls.
+
+Every OpenAI request goes through one LLMScheduler, which enforces:
+- a global cap on concurrent calls
+- a tokens-per-minute budget (token bucket refilled continuously)
+- per-user fair queuing: waiting users are served round-robin, so one user with
+  hundreds of queued calls can't starve everyone else
+- retries of rate-limit, timeout and 5xx failures with capped exponential backoff, or
+  after exactly the Retry-After the server asked for; the slot is released while backing
+  off, and a call gives up once retrying would run past its retry deadline
+- on a 429, all dispatching pauses for the Retry-After period and the concurrency
+  limit is halved, then grows back by one per limit's worth of successes (AIMD),
+  since provider rate limits are shared by every caller
+
+Queue depth, wait times and retry counts are kept for monitoring.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Recent wait times kept for percentile reporting
+WAIT_SAMPLE_SIZE = 1000
+
+
+def retry_after_seconds(error: Exception) -> Optional[float]:
+    """Delay requested by the server through Retry-After / retry-after-ms, if any"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, timeouts, connection failures and server errors are worth retrying"""
+    # Imported here so importing the scheduler doesn't load the openai package
+    import openai
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class LLMScheduler:
+    """Fair, budgeted, retrying gate in front of all model calls"""
+
+    def __init__(self, max_concurrency: int = 16, tokens_per_minute: int = 200_000, max_retries: int = 5,
+                 base_delay: float = 0.5, max_delay: float = 30.0, retry_deadline: float = 120.0):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_deadline = retry_deadline
+
+        self._queues: "OrderedDict[str, Deque[tuple[asyncio.Future, int]]]" = OrderedDict()
+        self._in_flight = 0
+        self._limit = float(max_concurrency)
+        self._paused_until = 0.0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._wake_handle: Optional[asyncio.TimerHandle] = None
+
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLE_SIZE)
+        self.total_wait_seconds = 0.0
+
+    # Token bucket
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.tokens_per_minute),
+            self._tokens + (now - self._refilled_at) * self.tokens_per_minute / 60,
+        )
+        self._refilled_at = now
+
+    def _affordable(self, tokens: int) -> bool:
+        # A request larger than the whole budget waits for a full bucket rather than forever
+        return self._tokens >= min(tokens, self.tokens_per_minute)
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: Optional[int]):
+        """Correct the budget once a call reports what it really used"""
+        if actual_tokens is not None:
+            self._tokens -= actual_tokens - estimated_tokens
+
+    # Queueing
+    def _dispatch(self):
+        """Grant slots to waiting calls, one user at a time in round-robin order"""
+        self._refill()
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            self._schedule_wake_in(pause)
+            return
+        while self._queues and self._in_flight < int(self._limit):
+            user_id, queue = next(iter(self._queues.items()))
+            future, tokens = queue[0]
+            if future.done():
+                # Caller gave up while waiting
+                queue.popleft()
+            elif self._affordable(tokens):
+                queue.popleft()
+                self._tokens -= tokens
+                self._in_flight += 1
+                future.set_result(None)
+            else:
+                self._schedule_wake(tokens)
+                return
+            # Rotate this user to the back so the next user is served first
+            self._queues.move_to_end(user_id)
+            if not queue:
+                del self._queues[user_id]
+
+    def _schedule_wake(self, tokens: int):
+        needed = min(tokens, self.tokens_per_minute) - self._tokens
+        self._schedule_wake_in(needed * 60 / self.tokens_per_minute)
+
+    def _schedule_wake_in(self, delay: float):
+        if self._wake_handle is not None:
+            return
+
+        def wake():
+            self._wake_handle = None
+            self._dispatch()
+
+        self._wake_handle = asyncio.get_running_loop().call_later(max(delay, 0.01), wake)
+
+    async def acquire(self, user_id: str, tokens: int, front: bool = False):
+        """Wait for a concurrency slot and token budget for one call"""
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(user_id, deque())
+        if front:
+            queue.appendleft((future, tokens))
+        else:
+            queue.append((future, tokens))
+        queued_at = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted just as we were cancelled
+                self.release()
+            raise
+        waited = time.monotonic() - queued_at
+        self._waits.append(waited)
+        self.total_wait_seconds += waited
+
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def reserve(self, user_id: str, tokens: int) -> AsyncIterator[None]:
+        """Hold one slot for the body of the block (for streamed calls, which aren't retried)"""
+        await self.acquire(user_id, tokens)
+        try:
+            yield
+        except Exception:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+        finally:
+            self.release()
+
+    async def run(self, user_id: str, tokens: int, call: Callable[[], Awaitable[T]]) -> T:
+        """Run call under the scheduler, retrying transient failures with backoff"""
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            await self.acquire(user_id, tokens, front=attempt > 0)
+            try:
+                result = await call()
+            except asyncio.CancelledError:
+                self.release()
+                raise
+            except Exception as e:
+                self.release()
+                if not is_retryable(e) or attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                # Retrying sooner than the server asked would only be refused again, so
+                # Retry-After is honoured as given and just our own backoff is capped
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    # Full jitter keeps retries from many callers from arriving together
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if time.monotonic() + delay - started > self.retry_deadline:
+                    self.failed += 1
+                    raise
+                if getattr(e, "status_code", None) == 429:
+                    self.rate_limited += 1
+                    self._limit = max(1.0, self._limit / 2)
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                attempt += 1
+                self.retries += 1
+                logger.warning(f"Model call failed ({type(e).__name__}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+            self.release()
+            self.completed += 1
+            usage = getattr(result, "usage", None)
+            self.record_usage(tokens, getattr(usage, "total_tokens", None))
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, wait times and outcome counters"""
+        self._refill()
+        waits = sorted(self._waits)
+
+        def percentile(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 4) if waits else 0.0
+
+        return {
+            "queueDepth": sum(len(queue) for queue in self._queues.values()),
+            "queuedUsers": len(self._queues),
+            "inFlight": self._in_flight,
+            "maxConcurrency": self.max_concurrency,
+            "concurrencyLimit": int(self._limit),
+            "tokensAvailable": int(self._tokens),
+            "tokensPerMinute": self.tokens_per_minute,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retries": self.retries,
+            "rateLimited": self.rate_limited,
+            "waitSeconds": {
+                "total": round(self.total_wait_seconds, 3),
+                "p50": percentile(0.5),
+                "p95": percentile(0.95),
+                "max": round(waits[-1], 4) if waits else 0.0,
+            },
+        }
@@ -1,30 +1,287 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Form, Header, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+from typing import TYPE_CHECKING, Optional, List, Dict, Any
+from datetime import date, datetime, timedelta, timezone
+from contextlib import asynccontextmanager
+import asyncio
 import uuid
+import time
+import base64
+import hashlib
+import importlib
 import os
 from dotenv import load_dotenv
 import httpx
 import json
-from supabase import create_client, Client
-from openai import OpenAI
+from postgrest import AsyncPostgrestClient
+from postgrest.types import ReturnMethod
+from storage3 import AsyncStorageClient
 import jwt
 from passlib.context import CryptContext
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
 import logging
+import re
+import tempfile
+import aiofiles
+import aiofiles.os
+import aiofiles.tempfile
+from analysis_cache import AnalysisCache, analysis_cache_key
+from bias_categories import BUCKETS, CATEGORIES, OTHER, categorize, fill_buckets
+from chunked_analysis import CHARS_PER_TOKEN, CHUNK_PROMPT_NOTE, estimate_tokens, map_reduce_analysis
+from chunk_store import ChunkStore
+from conversation_context import (SummaryRefresher, build_summary_messages, fit_history, history_cache_context,
+                                  summary_due, truncate_to_tokens)
+from llm_scheduler import LLMScheduler
+from uploads import UploadTooLarge, hash_upload, object_exists, resumable_upload, stream_upload
+from artifact_cache import ArtifactCache
+from tabular_sample import render_sample
+from fairness_metrics import compute_fairness_metrics, detect_tabular_format, metrics_to_report, summarize_metrics
+from report_export import ReportRenderer, export_filename, iter_ndjson, iter_pdf_zip, report_document
+from batch_jobs import TERMINAL_JOB_STATUSES, JobStore, JobWorkerPool
+from write_behind import Outbox, OutboxFlusher
+from upload_gc import UploadCollector
+from metrics import (FILE_BYTES, REQUEST_SECONDS, record_llm_usage, registry, server_timing_header, stage,
+                     start_request_timing)
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+    from supabase import Client
 
 # Load environment variables
 load_dotenv()
 
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Supabase settings; data and storage go through the async clients below, auth through
+# a supabase client created on first sign-up or login
+supabase_url = os.getenv("SUPABASE_URL")
+supabase_key = os.getenv("SUPABASE_ANON_KEY")
+supabase_service_key = os.getenv("SUPABASE_SERVICE_KEY")
+_auth_client: Optional["Client"] = None
+
+def get_auth_client() -> "Client":
+    """Supabase client for auth calls, built on first use (the package is slow to import)"""
+    global _auth_client
+    if _auth_client is None:
+        from supabase import create_client
+        _auth_client = create_client(supabase_url, supabase_key)
+    return _auth_client
+
+# Connection pool shared by every outbound HTTP client on this worker
+HTTP_POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")),
+)
+HTTP_TIMEOUT = httpx.Timeout(float(os.getenv("HTTP_TIMEOUT", "60")), connect=10.0)
+# HTTP/2 multiplexes concurrent requests over one keep-alive connection per upstream (https only)
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+HTTP_WARMUP_TIMEOUT = float(os.getenv("HTTP_WARMUP_TIMEOUT", "5"))
+# Overridable transport, used by the benchmarks to swap in local fakes
+HTTP_TRANSPORT: Optional[httpx.AsyncBaseTransport] = None
+
+def pooled_http_client(**kwargs) -> httpx.AsyncClient:
+    """Build an httpx client on the shared pool settings"""
+    kwargs.setdefault("timeout", HTTP_TIMEOUT)
+    return httpx.AsyncClient(limits=HTTP_POOL_LIMITS, transport=HTTP_TRANSPORT, http2=HTTP2_ENABLED, **kwargs)
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """Async PostgREST client on the shared pool settings"""
+    def create_session(self, base_url, headers, timeout):
+        return pooled_http_client(base_url=base_url, headers=headers)
+
+class PooledStorageClient(AsyncStorageClient):
+    """Async storage client on the shared pool settings"""
+    def _create_session(self, base_url, headers, timeout, verify=True):
+        return pooled_http_client(base_url=base_url, headers=headers, follow_redirects=True)
+
+class AppClients:
+    """Async OpenAI, PostgREST and storage clients, opened and closed by the app lifespan.
+
+    Opening runs in the background so the server accepts connections straight away:
+    the openai package is imported off the event loop, the clients are built and one
+    keep-alive connection to each upstream is opened. Requests that need the clients
+    wait for wait_ready().
+    """
+    def __init__(self):
+        self.openai: Optional["AsyncOpenAI"] = None
+        self.db: Optional[AsyncPostgrestClient] = None
+        self.storage: Optional[AsyncStorageClient] = None
+        self._opening: Optional[asyncio.Task] = None
+        self.ready = False
+        self.warm: Dict[str, bool] = {}
+        self.error: Optional[str] = None
+        self.ready_seconds: Optional[float] = None
+
+    def open(self):
+        """Start opening the clients in the background"""
+        self.ready, self.warm, self.error, self.ready_seconds = False, {}, None, None
+        self._opening = asyncio.create_task(self._open())
+
+    async def _open(self):
+        started = time.perf_counter()
+        try:
+            # The slowest import in the app; in a thread, so the event loop keeps serving
+            openai = await asyncio.to_thread(importlib.import_module, "openai")
+            auth_headers = {"apiKey": supabase_key, "Authorization": f"Bearer {supabase_key}"}
+            self.openai = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,  # Retries are handled by llm_scheduler
+                http_client=pooled_http_client(),
+            )
+            self.db = PooledPostgrestClient(
+                f"{supabase_url}/rest/v1",
+                headers={"Accept": "application/json", "Content-Type": "application/json", **auth_headers},
+            )
+            self.storage = PooledStorageClient(f"{supabase_url}/storage/v1", headers=auth_headers)
+        except Exception as e:
+            self.error = str(e)
+            logger.error(f"Client startup error: {str(e)}")
+            raise
+        
+        # Any response will do: the point is the TCP/TLS handshake, which the pool then keeps
+        upstreams = {
+            "openai": (self.openai._client, str(self.openai.base_url)),
+            "db": (self.db.session, ""),
+            "storage": (self.storage.session, "")
+        }
+        
+        async def warm(name: str, session: httpx.AsyncClient, url: str):
+            try:
+                await asyncio.wait_for(session.head(url), HTTP_WARMUP_TIMEOUT)
+                self.warm[name] = True
+            except Exception as e:
+                self.warm[name] = False
+                logger.warning(f"Could not pre-connect to {name}: {type(e).__name__} {str(e)}")
+        
+        await asyncio.gather(*(warm(name, session, url) for name, (session, url) in upstreams.items()))
+        self.ready = True
+        self.ready_seconds = time.perf_counter() - started
+
+    async def wait_ready(self):
+        """Wait until the clients are open; raises if they could not be built"""
+        if not self.ready:
+            await asyncio.shield(self._opening)
+
+    async def close(self):
+        if self._opening is not None and not self._opening.done():
+            self._opening.cancel()
+        await asyncio.gather(
+            *(client.close() if client is self.openai else client.aclose()
+              for client in (self.openai, self.db, self.storage) if client is not None),
+            return_exceptions=True,
+        )
+        self.openai = self.db = self.storage = None
+        self.ready = False
+
+clients = AppClients()
+
+# Cache of analysis results keyed on message, file content, prompt and model settings
+analysis_cache = AnalysisCache(
+    max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=float(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", "86400")),
+    db_path=os.getenv("ANALYSIS_CACHE_DB") or None,
+)
+
+# Gate in front of every model call: concurrency cap, token budget, fair queuing, retries
+llm_scheduler = LLMScheduler(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+    tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", "200000")),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", "5")),
+    base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", "0.5")),
+    max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", "30")),
+    retry_deadline=float(os.getenv("LLM_RETRY_DEADLINE", "120")),
+)
+
+# Extracted text and summaries of uploaded files, keyed by content hash
+artifact_cache = ArtifactCache(
+    os.getenv("ARTIFACT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "biasbuster-artifacts")),
+    int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024))),
+)
+
+# Rendered PDFs; REPORT_RENDER_PROCESSES=0 renders in the thread pool instead of worker processes
+report_renderer = ReportRenderer(
+    processes=int(os.getenv("REPORT_RENDER_PROCESSES", str(min(4, os.cpu_count() or 1)))),
+    cache_max_bytes=int(os.getenv("REPORT_PDF_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+)
+
+# Analyses of file chunks by content fingerprint, so re-analysing a new version of a file
+# only sends the chunks that changed
+chunk_store = ChunkStore(
+    os.getenv("CHUNK_STORE_DB", os.path.join(tempfile.gettempdir(), "biasbuster-chunks.sqlite3")),
+    ttl_seconds=float(os.getenv("CHUNK_STORE_TTL_SECONDS", str(30 * 86400))),
+)
+
+# Batch analysis jobs: SQLite queue drained by a bounded pool of background workers
+job_store = JobStore(os.getenv("BATCH_JOBS_DB", os.path.join(tempfile.gettempdir(), "biasbuster-jobs.sqlite3")))
+job_pool = JobWorkerPool(
+    job_store,
+    lambda item: run_batch_item(item),
+    workers=int(os.getenv("BATCH_WORKERS", "4")),
+    lease_seconds=float(os.getenv("BATCH_LEASE_SECONDS", "60")),
+)
+
+# Background refreshes of the rolling conversation summaries stored on chats
+summary_refresher = SummaryRefresher()
+
+# With CHAT_WRITE_BEHIND, chat turns are acknowledged once queued in a local outbox and
+# written to the database in the background, with retries
+CHAT_WRITE_BEHIND = os.getenv("CHAT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+chat_outbox = Outbox(os.getenv("CHAT_OUTBOX_DB", os.path.join(tempfile.gettempdir(), "biasbuster-outbox.sqlite3")))
+chat_flusher = OutboxFlusher(
+    chat_outbox,
+    lambda turn: flush_chat_turn(turn),
+    concurrency=int(os.getenv("CHAT_OUTBOX_CONCURRENCY", "8")),
+    max_attempts=int(os.getenv("CHAT_OUTBOX_MAX_ATTEMPTS", "20")),
+)
+
+# Background removal of upload objects no message refers to any more (0 turns it off);
+# uploads younger than the grace period are kept, so they can still be sent in a chat
+UPLOAD_GC_INTERVAL = float(os.getenv("UPLOAD_GC_INTERVAL", "3600"))
+upload_collector = UploadCollector(
+    lambda before, after, limit: find_orphaned_uploads(before, after, limit),
+    lambda paths, before: claim_orphaned_uploads(paths, before),
+    lambda paths: clients.storage.from_("uploads").remove(paths),
+    lambda rows: release_orphaned_uploads(rows),
+    lambda: uploads_in_use(),
+    interval_seconds=UPLOAD_GC_INTERVAL or 3600,
+    grace_seconds=float(os.getenv("UPLOAD_GC_GRACE_SECONDS", "86400")),
+    batch_size=int(os.getenv("UPLOAD_GC_BATCH_SIZE", "100")),
+)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    clients.open()
+    chunk_store.open()
+    job_store.open()
+    job_pool.start()
+    if CHAT_WRITE_BEHIND:
+        chat_outbox.open()
+        chat_flusher.start()
+    if UPLOAD_GC_INTERVAL > 0:
+        upload_collector.start()
+    try:
+        yield
+    finally:
+        await upload_collector.stop()
+        await job_pool.stop()
+        if CHAT_WRITE_BEHIND:
+            # Whatever isn't written by now stays in the outbox for the next start
+            await chat_flusher.stop()
+            chat_outbox.close()
+        await summary_refresher.close()
+        await clients.close()
+        await analysis_cache.close()
+        chunk_store.close()
+        job_store.close()
+        report_renderer.close()
+
 # Initialize FastAPI app
-app = FastAPI(title="BiasBuster API", version="1.0.0")
+app = FastAPI(title="BiasBuster API", version="1.0.0", lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -33,20 +290,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+# Answered while the upstream clients are still opening
+CLIENTLESS_PATHS = {"/", "/ready", "/metrics", "/docs", "/openapi.json"}
 
-# Initialize Supabase client
-supabase_url = os.getenv("SUPABASE_URL")
-supabase_key = os.getenv("SUPABASE_ANON_KEY")
-supabase_service_key = os.getenv("SUPABASE_SERVICE_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+@app.middleware("http")
+async def wait_for_clients(request: Request, call_next):
+    """Hold requests that need the upstream clients until they are open"""
+    if not clients.ready and request.url.path not in CLIENTLESS_PATHS:
+        try:
+            await clients.wait_ready()
+        except Exception:
+            return JSONResponse(status_code=503, content={"detail": "Service is not ready"},
+                                headers={"Retry-After": "1"})
+    return await call_next(request)
 
-# Initialize OpenAI client
-openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized uploads from their Content-Length, before the body is read"""
+    if request.url.path == "/api/upload":
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"File exceeds the maximum upload size of {MAX_UPLOAD_BYTES} bytes"}
+            )
+    return await call_next(request)
+
+# Adds a Server-Timing header with per-stage durations to every response when enabled
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Time every request by route template and status, and report stage timings"""
+    started = time.perf_counter()
+    timings = start_request_timing()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - started
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        elapsed, request.method, route.path if route is not None else "unmatched", str(response.status_code)
+    )
+    if SERVER_TIMING_ENABLED:
+        # Streamed responses send headers first, so only stages finished by then are listed
+        response.headers["Server-Timing"] = server_timing_header(timings, elapsed)
+    return response
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -54,6 +344,8 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # JWT settings
 JWT_SECRET = os.getenv("JWT_SECRET", "your-secret-key-here")
 JWT_ALGORITHM = "HS256"
+# Users allowed to read the operational stats endpoints (comma-separated ids); /metrics is for scrapers
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
 
 # Pydantic models
 class SignupRequest(BaseModel):
@@ -69,6 +361,25 @@ class ChatRequest(BaseModel):
     chatId: str
     message: str
     fileUrl: Optional[str] = None
+    chunked: bool = False  # Analyse the whole file in parallel chunks instead of a sample of it
+    fastMode: bool = False  # Answer tabular uploads from locally computed fairness metrics, without a model call
+    labelColumn: Optional[str] = None  # Outcome column for fairness metrics; detected by name when omitted
+    reportOnly: bool = False  # Only the bias report is generated; the reply is a short summary of it
+
+class BatchJobItem(BaseModel):
+    text: Optional[str] = None
+    fileUrl: Optional[str] = None
+
+class BatchJobRequest(BaseModel):
+    items: List[BatchJobItem]
+    message: Optional[str] = None  # Instruction applied to every item
+    chunked: bool = False
+    fastMode: bool = False
+    labelColumn: Optional[str] = None
+    reportOnly: bool = False
+
+class DeleteChatsRequest(BaseModel):
+    chatIds: List[str]
 
 class ReportDownloadRequest(BaseModel):
     reportId: str
@@ -83,10 +394,16 @@ class AuthResponse(BaseModel):
     user: UserResponse
     token: str
 
+class FindingTrace(BaseModel):
+    finding: str
+    kind: str  # "reason" or "fix"
+    chunks: List[int]
+
 class BiasReport(BaseModel):
     bias_detected: bool
     reasons: List[str]
     fixes: List[str]
+    trace: Optional[List[FindingTrace]] = None  # Set for chunked analyses
 
 class Message(BaseModel):
     role: str  # "user" or "ai"
@@ -119,16 +436,14 @@ def get_current_user(authorization: str = None):
         raise HTTPException(status_code=401, detail="Authorization header missing")
     return verify_token(authorization)
 
-async def detect_bias_with_gpt(message: str, file_content: Optional[str] = None) -> tuple[str, BiasReport]:
-    """Use GPT-4o-mini to generate response and detect bias"""
-    try:
-        # Prepare the full message
-        full_message = message
-        if file_content:
-            full_message = f"{message}\n\nFile content:\n{file_content[:5000]}"  # Limit file content
-        
-        # System prompt for bias detection
-        system_prompt = """You are BiasBuster, an AI assistant that detects bias in datasets, AI models, and text.
+def get_admin_user(user=Depends(get_current_user)):
+    """Dependency for operational endpoints, whose stats span every user"""
+    if user["user_id"] not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    return user
+
+# System prompt for bias detection
+BIAS_SYSTEM_PROMPT = """You are BiasBuster, an AI assistant that detects bias in datasets, AI models, and text.
 Your task is to:
 1. Respond naturally to the user's query
 2. Analyze the content for potential bias
@@ -154,50 +469,786 @@ Types of bias to check for:
 - Algorithmic bias
 """
 
-        # Call OpenAI API
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": full_message}
-            ],
-            temperature=0.7,
-            max_tokens=2000
-        )
-        
-        full_response = response.choices[0].message.content
+# Used with structured output, where the API enforces the report's shape and the
+# instructions only need to cover its content
+STRUCTURED_SYSTEM_PROMPT = """You are BiasBuster, an AI assistant that detects bias in datasets, AI models, and text.
+Answer the user's query in "reply", then report your bias analysis: "bias_detected", and the
+"reasons" for it and suggested "fixes", one short sentence each.
+
+Types of bias to check for: gender, racial/ethnic, age, socioeconomic, cultural, selection,
+confirmation, sampling and algorithmic bias.
+"""
+
+REPORT_ONLY_SYSTEM_PROMPT = """You are BiasBuster, a bias detector for datasets, AI models, and text.
+Report whether the content is biased ("bias_detected"), the "reasons", and suggested "fixes",
+one short sentence each. Do not write anything else.
+
+Types of bias to check for: gender, racial/ethnic, age, socioeconomic, cultural, selection,
+confirmation, sampling and algorithmic bias.
+"""
+
+BIAS_MODEL = "gpt-4o-mini"
+BIAS_TEMPERATURE = 0.7
+BIAS_MAX_TOKENS = 2000
+REPORT_ONLY_MAX_TOKENS = 500
+
+# "markers": the model appends the report as JSON between text markers to a prose reply.
+# "structured": the API's structured output returns reply and report as one schema-checked
+# JSON object, which can't come back malformed. Report-only requests always use structured output.
+BIAS_OUTPUT_MODE = os.getenv("BIAS_OUTPUT_MODE", "markers")
+# Routes requests with the same static prompt prefix together so the API's prompt cache hits;
+# empty to leave it out (e.g. for API-compatible servers that reject it)
+PROMPT_CACHE_KEY = os.getenv("PROMPT_CACHE_KEY", "biasbuster")
+
+REPORT_SCHEMA_PROPERTIES = {
+    "bias_detected": {"type": "boolean"},
+    "reasons": {"type": "array", "items": {"type": "string"}},
+    "fixes": {"type": "array", "items": {"type": "string"}}
+}
+
+def report_response_format(with_reply: bool) -> Dict[str, Any]:
+    """Strict JSON schema response format; reply comes first so it can be streamed as it is written"""
+    properties = {"reply": {"type": "string"}, **REPORT_SCHEMA_PROPERTIES} if with_reply else REPORT_SCHEMA_PROPERTIES
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "bias_analysis" if with_reply else "bias_report",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties),
+                "additionalProperties": False
+            }
+        }
+    }
+
+STRUCTURED_RESPONSE_FORMAT = report_response_format(with_reply=True)
+REPORT_ONLY_RESPONSE_FORMAT = report_response_format(with_reply=False)
+FILE_CONTENT_LIMIT = int(os.getenv("FILE_CONTENT_LIMIT", "5000"))  # Characters of file content sent in a single (non-chunked) call
+
+# Size of the pieces uploads are streamed in
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(200 * 1024 * 1024)))
+MULTIPART_OVERHEAD_BYTES = 64 * 1024  # Allowance for multipart boundaries and headers
+# Files above this size go through the resumable (TUS) endpoint
+RESUMABLE_UPLOAD_THRESHOLD = int(os.getenv("RESUMABLE_UPLOAD_THRESHOLD", str(6 * 1024 * 1024)))
+
+# Chunked (map-reduce) file analysis
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "3000"))
+CHUNK_MAX_PARALLEL = int(os.getenv("CHUNK_MAX_PARALLEL", "4"))
+
+# Conversation history sent with chat turns; the whole prompt (system prompt, history,
+# file content and message) is kept within CONTEXT_MAX_TOKENS
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "6000"))
+CONTEXT_HISTORY_MAX_TOKENS = int(os.getenv("CONTEXT_HISTORY_MAX_TOKENS", "2000"))
+CONTEXT_KEEP_MESSAGES = int(os.getenv("CONTEXT_KEEP_MESSAGES", "6"))  # Latest messages always sent verbatim
+CONTEXT_SUMMARY_EVERY = int(os.getenv("CONTEXT_SUMMARY_EVERY", "8"))  # New messages folded in per summary refresh
+CONTEXT_FILE_OVERVIEW_MAX_TOKENS = 400
+SUMMARY_MAX_TOKENS = 400
+SUMMARY_MAX_WORDS = 250
+SUMMARY_BATCH_MESSAGES = 20  # Messages folded in per summary call when catching up on a long chat
+SUMMARY_MESSAGE_MAX_TOKENS = 500  # Per message, so one long reply can't crowd out the rest
+
+REPORT_START_MARKER = "---BIAS_REPORT_START---"
+REPORT_END_MARKER = "---BIAS_REPORT_END---"
+
+def limit_file_content(file_content: Optional[str]) -> Optional[str]:
+    """Truncate file content to what a single analysis call sends"""
+    return file_content[:FILE_CONTENT_LIMIT] if file_content else file_content
+
+def bias_output(report_only: bool = False) -> tuple[str, Optional[Dict[str, Any]], int]:
+    """System prompt, response format (None for marker-delimited reports) and completion limit of an analysis"""
+    if report_only:
+        return REPORT_ONLY_SYSTEM_PROMPT, REPORT_ONLY_RESPONSE_FORMAT, REPORT_ONLY_MAX_TOKENS
+    if BIAS_OUTPUT_MODE == "structured":
+        return STRUCTURED_SYSTEM_PROMPT, STRUCTURED_RESPONSE_FORMAT, BIAS_MAX_TOKENS
+    return BIAS_SYSTEM_PROMPT, None, BIAS_MAX_TOKENS
+
+def bias_completion_options(report_only: bool = False) -> Dict[str, Any]:
+    """Keyword arguments of a bias analysis completion call, besides the messages"""
+    _, response_format, max_tokens = bias_output(report_only)
+    options = {"model": BIAS_MODEL, "temperature": BIAS_TEMPERATURE, "max_tokens": max_tokens}
+    if response_format is not None:
+        options["response_format"] = response_format
+    if PROMPT_CACHE_KEY:
+        # Not a keyword argument of the pinned SDK version, so it goes into the request body as is
+        options["extra_body"] = {"prompt_cache_key": PROMPT_CACHE_KEY}
+    return options
+
+def build_bias_messages(message: str, file_content: Optional[str] = None,
+                        history: Optional[List[Dict[str, str]]] = None,
+                        report_only: bool = False) -> List[Dict[str, str]]:
+    """Build the chat messages sent to the model for a bias detection request.
+
+    The static system prompt always comes first and the history before the new message,
+    so consecutive requests share the longest possible prefix for the API's prompt cache.
+    """
+    full_message = message
+    if file_content:
+        full_message = f"{message}\n\nFile content:\n{file_content}"
+    return [
+        {"role": "system", "content": bias_output(report_only)[0]},
+        *(history or []),
+        {"role": "user", "content": full_message}
+    ]
+
+def parse_bias_response(full_response: str) -> tuple[str, BiasReport, bool]:
+    """Split a model response into the visible reply and its bias report, and whether the report parsed"""
+    bias_report = BiasReport(
+        bias_detected=False,
+        reasons=[],
+        fixes=[]
+    )
+    parsed = False
+    
+    if REPORT_START_MARKER in full_response and REPORT_END_MARKER in full_response:
+        report_start = full_response.find(REPORT_START_MARKER) + len(REPORT_START_MARKER)
+        report_end = full_response.find(REPORT_END_MARKER)
+        report_json = full_response[report_start:report_end].strip()
         
-        # Extract bias report from response
-        bias_report = BiasReport(
-            bias_detected=False,
-            reasons=[],
-            fixes=[]
+        try:
+            report_data = json.loads(report_json)
+            bias_report = BiasReport(**report_data)
+            # Remove the bias report from the response
+            reply = full_response[:full_response.find(REPORT_START_MARKER)].strip()
+            parsed = True
+        except (ValueError, TypeError) as e:
+            # The reply is still worth showing; the report falls back to the empty one
+            logger.warning(f"Unparsable bias report: {str(e)}")
+            reply = full_response
+    else:
+        reply = full_response
+    
+    return reply, bias_report, parsed
+
+def error_bias_report() -> BiasReport:
+    """Report returned when the model call fails"""
+    return BiasReport(
+        bias_detected=False,
+        reasons=["Error in processing"],
+        fixes=["Please try again"]
+    )
+
+class BiasReportStreamParser:
+    """Incrementally separates streamed reply text from the trailing bias report block.
+
+    Text is released as soon as it cannot be the beginning of the start marker;
+    everything from the marker onwards is held back and parsed in finish().
+    """
+    def __init__(self):
+        self._buffer = ""
+        self._in_report = False
+        self._parts: List[str] = []
+
+    def feed(self, delta: str) -> str:
+        """Add a chunk of model output and return the text that is safe to show"""
+        self._parts.append(delta)
+        if self._in_report:
+            return ""
+        self._buffer += delta
+        marker_at = self._buffer.find(REPORT_START_MARKER)
+        if marker_at != -1:
+            self._in_report = True
+            visible, self._buffer = self._buffer[:marker_at], ""
+            return visible
+        # Hold back a tail that could still grow into the start marker
+        hold = 0
+        for size in range(min(len(self._buffer), len(REPORT_START_MARKER) - 1), 0, -1):
+            if REPORT_START_MARKER.startswith(self._buffer[-size:]):
+                hold = size
+                break
+        visible = self._buffer[:len(self._buffer) - hold]
+        self._buffer = self._buffer[len(visible):]
+        return visible
+
+    def finish(self) -> tuple[str, str, BiasReport, bool]:
+        """Return (remaining visible text, full reply, bias report, whether it parsed) once the stream ends"""
+        remaining = "" if self._in_report else self._buffer
+        self._buffer = ""
+        reply, bias_report, parsed = parse_bias_response("".join(self._parts))
+        return remaining, reply, bias_report, parsed
+
+STRUCTURED_REPLY_START = re.compile(r'\s*\{\s*"reply"\s*:\s*"')
+
+class StructuredReplyStreamParser:
+    """Incrementally decodes the reply string of a streamed structured-output completion.
+
+    The schema puts reply first, so its text is released as it is generated while the
+    report that follows it is held back and parsed in finish(). Report-only completions
+    have no reply to stream; theirs is written from the report in finish().
+    """
+    def __init__(self, report_only: bool = False):
+        self.report_only = report_only
+        self._raw = ""
+        self._position: Optional[int] = None  # Start of the reply string's undecoded part
+        self._closed = False
+
+    def feed(self, delta: str) -> str:
+        """Add a chunk of model output and return the reply text it completes"""
+        self._raw += delta
+        if self.report_only or self._closed:
+            return ""
+        if self._position is None:
+            match = STRUCTURED_REPLY_START.match(self._raw)
+            if match is None:
+                return ""
+            self._position = match.end()
+        raw, end = self._raw, self._position
+        while end < len(raw):
+            if raw[end] == '"':
+                self._closed = True
+                break
+            if raw[end] != "\\":
+                end += 1
+                continue
+            # Only complete escapes are decoded; a high surrogate also waits for the low one
+            size = 6 if raw[end + 1:end + 2] == "u" else 2
+            if size == 6 and end + 6 <= len(raw) and 0xD800 <= int(raw[end + 2:end + 6], 16) <= 0xDBFF:
+                size = 12
+            if end + size > len(raw):
+                break
+            end += size
+        text = json.loads(f'"{raw[self._position:end]}"')
+        self._position = end
+        return text
+
+    def finish(self) -> tuple[str, str, BiasReport, bool]:
+        """Return (remaining visible text, full reply, bias report, whether it parsed) once the stream ends"""
+        reply, bias_report, parsed = parse_structured_response(self._raw, self.report_only)
+        return (reply if self._position is None else ""), reply, bias_report, parsed
+
+def bias_stream_parser(report_only: bool = False):
+    """Stream parser for the output mode of an analysis"""
+    if bias_output(report_only)[1] is None:
+        return BiasReportStreamParser()
+    return StructuredReplyStreamParser(report_only)
+
+def report_only_reply(bias_report: BiasReport) -> str:
+    """Reply of a report-only analysis, written from its report instead of by the model"""
+    if not bias_report.bias_detected:
+        return "No bias detected."
+    return "Bias detected:\n" + "\n".join(f"- {reason}" for reason in bias_report.reasons)
+
+def parse_structured_response(content: Optional[str], report_only: bool = False,
+                              finish_reason: Optional[str] = None) -> tuple[str, BiasReport, bool]:
+    """Reply and bias report of a structured-output completion, and whether the report parsed.
+
+    The API guarantees the schema unless the completion was cut short, in which case
+    whatever reply text was written is kept and the report falls back to the empty one.
+    """
+    parsed = False
+    try:
+        data = json.loads(content or "")
+        reply = data.pop("reply", "")
+        bias_report = BiasReport(**data)
+        parsed = True
+    except (ValueError, TypeError) as e:
+        logger.warning(f"Unparsable structured bias report (finish reason {finish_reason}): {str(e)}")
+        bias_report = BiasReport(bias_detected=False, reasons=[], fixes=[])
+        salvage = StructuredReplyStreamParser()
+        reply = salvage.feed(content or "") or "I couldn't complete the analysis of this request."
+    if report_only:
+        reply = report_only_reply(bias_report)
+    return reply, bias_report, parsed
+
+def parse_completion(response, report_only: bool = False) -> tuple[str, BiasReport, bool]:
+    """Reply, bias report and whether it parsed, of a (non-streamed) bias analysis completion"""
+    choice = response.choices[0]
+    if bias_output(report_only)[1] is None:
+        return parse_bias_response(choice.message.content)
+    return parse_structured_response(choice.message.content, report_only, choice.finish_reason)
+
+def bias_cache_key(message: str, file_content: Optional[str] = None,
+                   history: Optional[List[Dict[str, str]]] = None, report_only: bool = False) -> str:
+    """Cache key for an analysis of this message and file in this conversation"""
+    system_prompt, response_format, _ = bias_output(report_only)
+    if response_format is not None:
+        # The schema determines the output as much as the prompt does
+        system_prompt += json.dumps(response_format, sort_keys=True)
+    return analysis_cache_key(
+        message, file_content, system_prompt, BIAS_MODEL, BIAS_TEMPERATURE,
+        context=history_cache_context(history) if history else ""
+    )
+
+def estimate_request_tokens(messages: List[Dict[str, str]], max_tokens: int = BIAS_MAX_TOKENS) -> int:
+    """Upper-bound token estimate of a completion request, for the scheduler's budget"""
+    return sum(estimate_tokens(m["content"]) for m in messages) + max_tokens
+
+def record_completion_usage(usage):
+    """Record a completion's reported token usage, including the prompt tokens served from the prompt cache"""
+    if usage is None:
+        return
+    # A plain dict in SDK versions that predate the field
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = details.get("cached_tokens") if isinstance(details, dict) else getattr(details, "cached_tokens", None)
+    record_llm_usage(BIAS_MODEL, usage.prompt_tokens, usage.completion_tokens, cached_prompt_tokens=cached or 0)
+
+async def cached_bias_analysis(message: str, file_content: Optional[str] = None, user_id: str = "anonymous",
+                               history: Optional[List[Dict[str, str]]] = None,
+                               report_only: bool = False, require_report: bool = False) -> tuple[str, Dict[str, Any]]:
+    """Analyse exactly this message and file content, through the cache; raises on failure.
+
+    A reply whose report didn't parse is returned with the empty report but not cached, so
+    asking again gets a fresh answer; with require_report it is raised as a failure instead.
+    """
+    messages = build_bias_messages(message, file_content, history, report_only)
+    options = bias_completion_options(report_only)
+    
+    async def call_openai():
+        with stage("openai"):
+            return await clients.openai.chat.completions.create(messages=messages, **options)
+    
+    async def analyse():
+        # Call OpenAI API through the scheduler; "llm" includes queueing and retries
+        with stage("llm"):
+            response = await llm_scheduler.run(
+                user_id, estimate_request_tokens(messages, options["max_tokens"]), call_openai
+            )
+        record_completion_usage(response.usage)
+        reply, bias_report, parsed = parse_completion(response, report_only)
+        if not parsed and require_report:
+            raise ValueError("Model response had no parsable bias report")
+        return (reply, bias_report.model_dump()), parsed
+    
+    return await analysis_cache.get_or_compute(
+        bias_cache_key(message, file_content, history, report_only), analyse
+    )
+
+def wants_chunked_analysis(file_content: Optional[str], chunked: bool) -> bool:
+    return chunked and bool(file_content) and len(file_content) > FILE_CONTENT_LIMIT
+
+async def run_bias_analysis(message: str, file_content: Optional[str] = None, chunked: bool = False,
+                            file_name: Optional[str] = None, user_id: str = "anonymous",
+                            history: Optional[List[Dict[str, str]]] = None,
+                            metrics: Optional[Dict[str, Any]] = None,
+                            report_only: bool = False) -> tuple[str, BiasReport]:
+    """Model-backed bias analysis, raising on failure (chunk calls see only their chunk, not the history).
+
+    Fairness metrics of a chunked file are added to the merged reply; unchunked prompts already carry them.
+    """
+    if wants_chunked_analysis(file_content, chunked):
+        # Chunks analysed before with the same message, by this or an earlier version of the file, are reused
+        context = bias_cache_key(f"{message}\n\n{CHUNK_PROMPT_NOTE}", report_only=report_only)
+        reply, report_data = await map_reduce_analysis(
+            message,
+            file_content,
+            # A chunk without a parsable report counts as failed, so it isn't stored for reuse either
+            lambda chunk_message, chunk: cached_bias_analysis(
+                chunk_message, chunk, user_id, report_only=report_only, require_report=True
+            ),
+            file_name=file_name,
+            max_tokens=CHUNK_MAX_TOKENS,
+            max_parallel=CHUNK_MAX_PARALLEL,
+            load_results=lambda fingerprints: run_in_threadpool(chunk_store.get_many, context, fingerprints),
+            save_results=lambda results: run_in_threadpool(chunk_store.put_many, context, results)
+        )
+        if report_only:
+            # The merged reply would only repeat the first part's findings
+            reply = report_only_reply(BiasReport(**report_data))
+        elif metrics:
+            reply += f"\n\nFairness metrics computed locally over the whole file:\n\n{summarize_metrics(metrics)}"
+    else:
+        reply, report_data = await cached_bias_analysis(
+            message, limit_file_content(file_content), user_id, history, report_only
+        )
+    return reply, BiasReport(**report_data)
+
+async def detect_bias_with_gpt(message: str, file_content: Optional[str] = None, chunked: bool = False,
+                               file_name: Optional[str] = None, user_id: str = "anonymous",
+                               history: Optional[List[Dict[str, str]]] = None,
+                               metrics: Optional[Dict[str, Any]] = None,
+                               report_only: bool = False) -> tuple[str, BiasReport]:
+    """Use GPT-4o-mini to generate response and detect bias"""
+    try:
+        return await run_bias_analysis(
+            message, file_content, chunked, file_name, user_id, history, metrics, report_only
         )
         
-        if "---BIAS_REPORT_START---" in full_response and "---BIAS_REPORT_END---" in full_response:
-            report_start = full_response.find("---BIAS_REPORT_START---") + len("---BIAS_REPORT_START---")
-            report_end = full_response.find("---BIAS_REPORT_END---")
-            report_json = full_response[report_start:report_end].strip()
-            
-            try:
-                report_data = json.loads(report_json)
-                bias_report = BiasReport(**report_data)
-                # Remove the bias report from the response
-                reply = full_response[:full_response.find("---BIAS_REPORT_START---")].strip()
-            except:
-                reply = full_response
+    except Exception as e:
+        logger.error(f"Error in bias detection: {str(e)}")
+        return "I encountered an error while processing your request.", error_bias_report()
+
+def storage_path_from_url(file_url: str) -> str:
+    """Object path inside the uploads bucket for a public storage URL"""
+    return file_url.split("/storage/v1/object/public/")[1].split("?")[0].split("/", 1)[1]
+
+def upload_path_from_url(file_url: Optional[str]) -> Optional[str]:
+    """storage_path_from_url, or None for URLs that aren't public upload URLs (e.g. signed or external ones)"""
+    try:
+        return storage_path_from_url(file_url) if file_url else None
+    except IndexError:
+        return None
+
+def file_hash_from_url(file_url: str) -> Optional[str]:
+    """SHA-256 of a content-addressed upload, read from its object name (None for other URLs)"""
+    path = upload_path_from_url(file_url)
+    if path is None:
+        return None
+    name = os.path.splitext(os.path.basename(path))[0]
+    return name if re.fullmatch(r"[0-9a-f]{64}", name) else None
+
+async def download_upload(file_url: str) -> tuple[str, str]:
+    """Stream an uploaded object into a temporary file, returning its path and SHA-256"""
+    suffix = os.path.splitext(storage_path_from_url(file_url))[1]
+    digest = hashlib.sha256()
+    size = 0
+    async with aiofiles.tempfile.NamedTemporaryFile("wb", suffix=suffix, delete=False) as tmp:
+        try:
+            with stage("storage_download"):
+                async with clients.storage.session.stream(
+                    "GET", f"object/uploads/{storage_path_from_url(file_url)}"
+                ) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(UPLOAD_CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        await tmp.write(chunk)
+        except BaseException:
+            await aiofiles.os.remove(tmp.name)
+            raise
+        FILE_BYTES.observe(size, "download")
+        return tmp.name, digest.hexdigest()
+
+async def ensure_file_artifact(file_hash: str, source_path: str, file_name: Optional[str]) -> Dict[str, Any]:
+    """Return the stored artifact summary for a file, extracting it if needed"""
+    summary = await run_in_threadpool(artifact_cache.get_summary, file_hash)
+    if summary is None:
+        with stage("artifact_extract"):
+            summary = await run_in_threadpool(artifact_cache.put, file_hash, source_path, file_name)
+    return summary
+
+async def load_file_artifact(file_url: str) -> tuple[str, Dict[str, Any]]:
+    """Return (hash, summary) for an uploaded file, downloading it only on a cache miss"""
+    file_hash = file_hash_from_url(file_url)
+    if file_hash:
+        summary = await run_in_threadpool(artifact_cache.get_summary, file_hash)
+        if summary is not None:
+            return file_hash, summary
+    
+    path, file_hash = await download_upload(file_url)
+    try:
+        return file_hash, await ensure_file_artifact(file_hash, path, file_url)
+    finally:
+        await aiofiles.os.remove(path)
+
+async def fairness_metrics_for_label(file_url: str, label_column: str) -> Dict[str, Any]:
+    """Recompute fairness metrics with an explicit outcome column"""
+    path, _ = await download_upload(file_url)
+    try:
+        return await run_in_threadpool(
+            compute_fairness_metrics, path, detect_tabular_format(file_url), label_column
+        )
+    finally:
+        await aiofiles.os.remove(path)
+
+async def read_chat_input(request: ChatRequest) -> tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+    """Load the request's file from its extracted artifacts, raising if it can't be read.
+
+    Returns the prompt message (with fairness metrics context for tabular files analysed
+    in one call), the file text to analyse and the metrics themselves.
+    """
+    if not request.fileUrl:
+        return request.message, None, None
+    
+    file_hash, summary = await load_file_artifact(request.fileUrl)
+    metrics = summary.get("fairnessMetrics")
+    if metrics and request.labelColumn and request.labelColumn != metrics["labelColumn"]:
+        metrics = await fairness_metrics_for_label(request.fileUrl, request.labelColumn)
+    
+    file_content = None
+    if not (request.fastMode and metrics):
+        if summary.get("sample") and not request.chunked and summary["textBytes"] > FILE_CONTENT_LIMIT:
+            # A table too big to send whole goes as column statistics and a stratified sample of its
+            # rows rather than as its first FILE_CONTENT_LIMIT characters
+            file_content = render_sample(summary["sample"], FILE_CONTENT_LIMIT)
         else:
-            reply = full_response
+            # Only chunked analysis needs more than the first FILE_CONTENT_LIMIT characters
+            limit = None if request.chunked else FILE_CONTENT_LIMIT
+            with stage("artifact_read"):
+                file_content = await run_in_threadpool(artifact_cache.read_text, file_hash, limit)
+    
+    if not metrics:
+        return request.message, file_content, None
+    if wants_chunked_analysis(file_content, request.chunked):
+        # Whole-file metrics change with every edit, so they'd stop the chunks of a new version of
+        # the file from reusing earlier analyses; they go with the merged reply instead
+        return request.message, file_content, metrics
+    prompt = (
+        f"{request.message}\n\nPrecomputed fairness metrics (computed locally over every row of the file):\n"
+        f"{summarize_metrics(metrics)}"
+    )
+    return prompt, file_content, metrics
+
+async def prepare_chat_input(request: ChatRequest) -> tuple[str, Optional[str], Optional[Dict[str, Any]]]:
+    """read_chat_input for chat turns, which go ahead with a placeholder if the file can't be read"""
+    try:
+        return await read_chat_input(request)
+    except Exception as e:
+        logger.error(f"Error reading file: {str(e)}")
+        return request.message, "Error reading file content", None
+
+def local_bias_analysis(metrics: Dict[str, Any]) -> tuple[str, BiasReport]:
+    """Reply and report built only from locally computed fairness metrics"""
+    reply = f"Fairness metrics computed locally over the whole file:\n\n{summarize_metrics(metrics)}"
+    return reply, BiasReport(**metrics_to_report(metrics))
+
+async def analyse_chat_input(request: ChatRequest, user_id: str, prompt: str, file_content: Optional[str],
+                             metrics: Optional[Dict[str, Any]],
+                             context: Optional[Dict[str, Any]] = None) -> tuple[str, BiasReport]:
+    """Run fast (local) or model-backed analysis for a prepared chat request"""
+    if request.fastMode and metrics is not None:
+        return local_bias_analysis(metrics)
+    history = None
+    if context is not None and not wants_chunked_analysis(file_content, request.chunked):
+        history, file_content = fit_conversation(
+            context, prompt, limit_file_content(file_content), bias_output(request.reportOnly)[0]
+        )
+    return await detect_bias_with_gpt(
+        prompt, file_content, request.chunked, request.fileUrl, user_id, history, metrics, request.reportOnly
+    )
+
+def file_overview(summary: Dict[str, Any]) -> str:
+    """Compact description of an uploaded file from its artifact summary"""
+    lines = [f"Format: {summary['format']}, {summary['sizeBytes']} bytes"]
+    if "rowCount" in summary:
+        lines.append(f"Rows: {summary['rowCount']}; columns: {', '.join(summary['columns'])}")
+    if summary.get("fairnessMetrics"):
+        lines.append(f"Fairness metrics:\n{summarize_metrics(summary['fairnessMetrics'])}")
+    return truncate_to_tokens("\n".join(lines), CONTEXT_FILE_OVERVIEW_MAX_TOKENS)
+
+def pending_chat_messages(chat_id: str, user_id: str) -> List[Dict[str, Any]]:
+    """Messages of the chat's turns still waiting in the write-behind outbox, oldest first"""
+    if not CHAT_WRITE_BEHIND:
+        return []
+    return [
+        message
+        for turn in chat_outbox.pending(chat_id) if turn["userId"] == user_id
+        for message in turn["messages"]
+    ]
+
+async def load_chat_context(chat_id: str, user_id: str, file_url: Optional[str]) -> Dict[str, Any]:
+    """The chat's rolling summary, latest messages and, for follow-ups without a file, the file
+    discussed earlier; a chat that doesn't exist yet (or can't be read) has no context"""
+    context = {"summary": None, "summarySeq": 0, "fileHash": None, "fileOverview": None, "recent": []}
+    try:
+        chat_query = clients.db.table("chats").select(
+            "context_summary, context_summary_seq, context_file_hash"
+        ).eq("id", chat_id).eq("user_id", user_id)
+        messages_query = clients.db.table("chat_messages").select(
+            "seq, role, content"
+        ).eq("chat_id", chat_id).eq("user_id", user_id).order("seq", desc=True).limit(
+            CONTEXT_KEEP_MESSAGES + CONTEXT_SUMMARY_EVERY
+        )
+        with stage("db_select_context"):
+            chat_response, messages_response, pending = await asyncio.gather(
+                chat_query.execute(),
+                messages_query.execute(),
+                run_in_threadpool(pending_chat_messages, chat_id, user_id)
+            )
+        # Turns not yet written follow the stored ones
+        last_seq = max((row["seq"] for row in messages_response.data), default=0)
+        context["recent"] = messages_response.data + [
+            {**message, "seq": last_seq + offset} for offset, message in enumerate(pending, start=1)
+        ]
+        if not chat_response.data:
+            return context
+        chat = chat_response.data[0]
+        context.update(
+            summary=chat.get("context_summary"),
+            summarySeq=chat.get("context_summary_seq") or 0,
+            fileHash=chat.get("context_file_hash")
+        )
+        if context["fileHash"] and not file_url:
+            # Extracted once at upload, so this is a local read, not a download
+            summary = await run_in_threadpool(artifact_cache.get_summary, context["fileHash"])
+            if summary is not None:
+                context["fileOverview"] = file_overview(summary)
+    except Exception as e:
+        logger.error(f"Error loading chat context: {str(e)}")
+    return context
+
+def fit_conversation(context: Dict[str, Any], prompt: str, file_content: Optional[str],
+                     system_prompt: str) -> tuple[List[Dict[str, str]], Optional[str]]:
+    """History for a prompt, and its file content trimmed if needed, within CONTEXT_MAX_TOKENS.
+
+    The message and file come first; history gets what is left, up to CONTEXT_HISTORY_MAX_TOKENS.
+    system_prompt is the one the request is sent with (see bias_output).
+    """
+    remaining = CONTEXT_MAX_TOKENS - estimate_tokens(system_prompt) - estimate_tokens(prompt)
+    if file_content:
+        file_content = file_content[:max(remaining, 0) * CHARS_PER_TOKEN]
+        remaining -= estimate_tokens(file_content)
+    budget = min(CONTEXT_HISTORY_MAX_TOKENS, remaining)
+    
+    history = []
+    if context["fileOverview"] and budget > 0:
+        history.append({
+            "role": "system",
+            "content": f"File discussed earlier in this chat:\n{truncate_to_tokens(context['fileOverview'], budget)}"
+        })
+        budget -= estimate_tokens(history[0]["content"])
+    history += fit_history(context["summary"], context["summarySeq"], context["recent"], budget)
+    return history, file_content
+
+async def summarize_chat(chat_id: str, user_id: str, summary: Optional[str], summary_seq: int, target_seq: int):
+    """Fold messages up to target_seq into the chat's stored summary, a batch at a time"""
+    while summary_seq < target_seq:
+        with stage("db_select_context"):
+            rows = (await clients.db.table("chat_messages").select(
+                "seq, role, content"
+            ).eq("chat_id", chat_id).eq("user_id", user_id).gt("seq", summary_seq).lte(
+                "seq", target_seq
+            ).order("seq").limit(SUMMARY_BATCH_MESSAGES).execute()).data
+        if not rows:
+            return
+        messages = build_summary_messages(summary, rows, SUMMARY_MAX_WORDS, SUMMARY_MESSAGE_MAX_TOKENS)
         
-        return reply, bias_report
+        async def call_openai():
+            with stage("openai"):
+                return await clients.openai.chat.completions.create(
+                    model=BIAS_MODEL,
+                    messages=messages,
+                    temperature=0,
+                    max_tokens=SUMMARY_MAX_TOKENS
+                )
         
-    except Exception as e:
-        logger.error(f"Error in bias detection: {str(e)}")
-        return "I encountered an error while processing your request.", BiasReport(
-            bias_detected=False,
-            reasons=["Error in processing"],
-            fixes=["Please try again"]
+        tokens = sum(estimate_tokens(m["content"]) for m in messages) + SUMMARY_MAX_TOKENS
+        with stage("llm_summary"):
+            response = await llm_scheduler.run(user_id, tokens, call_openai)
+        record_completion_usage(response.usage)
+        new_summary, new_seq = response.choices[0].message.content.strip(), rows[-1]["seq"]
+        
+        # Conditional on the seq read, so a concurrent refresh in another worker isn't overwritten
+        with stage("db_update_summary"):
+            updated = await clients.db.table("chats").update({
+                "context_summary": new_summary,
+                "context_summary_seq": new_seq
+            }).eq("id", chat_id).eq("context_summary_seq", summary_seq).execute()
+        if not updated.data:
+            return
+        summary, summary_seq = new_summary, new_seq
+
+async def remember_chat_file(chat_id: str, user_id: str, file_hash: str):
+    """Record the chat's latest file so follow-up turns can describe it"""
+    await clients.db.table("chats").update({"context_file_hash": file_hash}).eq("id", chat_id).eq(
+        "user_id", user_id
+    ).execute()
+
+def refresh_chat_context(chat_id: str, user_id: str, file_url: Optional[str], context: Dict[str, Any],
+                         rows: List[Dict[str, Any]]):
+    """After a written turn, start any summary refresh that is due and record a new file, in the background"""
+    if not rows:
+        return
+    target_seq = summary_due(
+        context["summarySeq"], max(row["seq"] for row in rows), CONTEXT_KEEP_MESSAGES, CONTEXT_SUMMARY_EVERY
+    )
+    if target_seq is not None:
+        summary_refresher.schedule(
+            f"{chat_id}:summary",
+            lambda: summarize_chat(chat_id, user_id, context["summary"], context["summarySeq"], target_seq)
         )
+    file_hash = file_hash_from_url(file_url) if file_url else None
+    if file_hash and file_hash != context["fileHash"]:
+        summary_refresher.schedule(f"{chat_id}:file", lambda: remember_chat_file(chat_id, user_id, file_hash))
+
+def message_from_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """API shape of a chat_messages row"""
+    return {
+        "seq": row["seq"],
+        "role": row["role"],
+        "content": row["content"],
+        "timestamp": row["created_at"]
+    }
+
+async def write_chat_turn(turn: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Write a turn's messages and report in one call, returning the stored message rows.
+
+    The save_chat_turn function creates the chat if needed, appends the messages and inserts
+    the report in a single transaction. It is idempotent on the turn id, so retries are safe.
+    """
+    with stage("db_save_turn"):
+        response = await clients.db.rpc("save_chat_turn", {
+            "p_turn_id": turn["turnId"],
+            "p_chat_id": turn["chatId"],
+            "p_user_id": turn["userId"],
+            "p_messages": turn["messages"],
+            "p_last_message": turn["lastMessage"],
+            "p_report": turn["report"]
+        }).execute()
+    return response.data
+
+async def flush_chat_turn(turn: Dict[str, Any]):
+    """Write a turn queued in the write-behind outbox"""
+    await clients.wait_ready()
+    rows = await write_chat_turn(turn)
+    refresh_chat_context(turn["chatId"], turn["userId"], turn["fileUrl"], turn["context"], rows)
+
+async def save_chat_turn(request: ChatRequest, user_id: str, ai_reply: str, bias_report: BiasReport,
+                         context: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Persist a user/AI exchange and its report (if bias was detected), returning the appended messages.
+
+    In write-behind mode the turn is only queued, so the messages have no seq yet.
+    """
+    timestamp = datetime.utcnow().isoformat()
+    turn = {
+        "turnId": str(uuid.uuid4()),
+        "chatId": request.chatId,
+        "userId": user_id,
+        "messages": [
+            {"role": "user", "content": request.message, "timestamp": timestamp,
+             # Keeps the file's object from being garbage collected while the chat exists
+             "file_path": upload_path_from_url(request.fileUrl)},
+            {"role": "ai", "content": ai_reply, "timestamp": timestamp}
+        ],
+        "lastMessage": request.message,
+        "report": {
+            "id": str(uuid.uuid4()),
+            "bias_detected": bias_report.bias_detected,
+            "reasons": bias_report.reasons,
+            "fixes": bias_report.fixes,
+            "categories": categorize(bias_report.reasons),
+            "created_at": timestamp
+        } if bias_report.bias_detected else None,
+        "fileUrl": request.fileUrl,
+        # What the summary refresh after the write needs to know
+        "context": {key: context[key] for key in ("summary", "summarySeq", "fileHash")}
+    }
+    
+    if CHAT_WRITE_BEHIND:
+        with stage("outbox_enqueue"):
+            await run_in_threadpool(chat_outbox.enqueue, request.chatId, turn)
+        chat_flusher.wake()
+        return [
+            {"seq": None, "role": message["role"], "content": message["content"], "timestamp": timestamp}
+            for message in turn["messages"]
+        ]
+    
+    rows = await write_chat_turn(turn)
+    refresh_chat_context(request.chatId, user_id, request.fileUrl, context, rows)
+    return [message_from_row(row) for row in rows]
+
+async def store_report(user_id: str, bias_report: BiasReport, timestamp: str, chat_id: Optional[str] = None,
+                       job_id: Optional[str] = None) -> str:
+    """Insert a reports row and return its id"""
+    report_id = str(uuid.uuid4())
+    with stage("db_insert_report"):
+        await clients.db.table("reports").insert({
+            "id": report_id,
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "job_id": job_id,
+            "bias_detected": bias_report.bias_detected,
+            "reasons": bias_report.reasons,
+            "fixes": bias_report.fixes,
+            "categories": categorize(bias_report.reasons) if bias_report.bias_detected else [],
+            "created_at": timestamp
+        }).execute()
+    return report_id
+
+def sse_event(event: str, data: Any) -> str:
+    """Format a Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
 # Auth endpoints
 @app.post("/signup", response_model=AuthResponse)
@@ -205,7 +1256,8 @@ async def signup(request: SignupRequest):
     """User signup endpoint"""
     try:
         # Create user in Supabase Auth
-        auth_response = supabase.auth.sign_up({
+        supabase = await run_in_threadpool(get_auth_client)
+        auth_response = await run_in_threadpool(supabase.auth.sign_up, {
             "email": request.email,
             "password": request.password,
             "options": {
@@ -244,7 +1296,8 @@ async def login(request: LoginRequest):
     """User login endpoint"""
     try:
         # Sign in with Supabase Auth
-        auth_response = supabase.auth.sign_in_with_password({
+        supabase = await run_in_threadpool(get_auth_client)
+        auth_response = await run_in_threadpool(supabase.auth.sign_in_with_password, {
             "email": request.email,
             "password": request.password
         })
@@ -293,76 +1346,26 @@ async def get_me(authorization: str = Depends(get_current_user)):
 async def chat(request: ChatRequest, user=Depends(get_current_user)):
     """Process chat message with bias detection"""
     try:
-        # Get file content if URL provided
-        file_content = None
-        if request.fileUrl:
-            # Download file content from Supabase storage
-            try:
-                # Extract file path from URL
-                file_path = request.fileUrl.split("/storage/v1/object/public/")[1]
-                response = supabase.storage.from_("uploads").download(file_path)
-                file_content = response.decode('utf-8', errors='ignore')
-            except Exception as e:
-                logger.error(f"Error downloading file: {str(e)}")
-                file_content = "Error reading file content"
+        # Get file content (and fairness metrics for tabular files) if URL provided, and the
+        # conversation so far
+        (prompt, file_content, metrics), context = await asyncio.gather(
+            prepare_chat_input(request),
+            load_chat_context(request.chatId, user["user_id"], request.fileUrl)
+        )
         
         # Get AI response and bias report
-        ai_reply, bias_report = await detect_bias_with_gpt(request.message, file_content)
-        
-        # Get existing chat or create new one
-        chat_response = supabase.table("chats").select("*").eq("id", request.chatId).execute()
-        
-        timestamp = datetime.utcnow().isoformat()
-        new_messages = []
-        
-        if chat_response.data:
-            # Update existing chat
-            existing_messages = chat_response.data[0].get("messages", [])
-            new_messages = existing_messages + [
-                {"role": "user", "content": request.message, "timestamp": timestamp},
-                {"role": "ai", "content": ai_reply, "timestamp": timestamp}
-            ]
-            
-            supabase.table("chats").update({
-                "messages": new_messages,
-                "last_message": request.message,
-                "updated_at": timestamp
-            }).eq("id", request.chatId).execute()
-        else:
-            # Create new chat
-            new_messages = [
-                {"role": "user", "content": request.message, "timestamp": timestamp},
-                {"role": "ai", "content": ai_reply, "timestamp": timestamp}
-            ]
-            
-            supabase.table("chats").insert({
-                "id": request.chatId,
-                "user_id": user["user_id"],
-                "messages": new_messages,
-                "last_message": request.message,
-                "created_at": timestamp,
-                "updated_at": timestamp
-            }).execute()
+        ai_reply, bias_report = await analyse_chat_input(
+            request, user["user_id"], prompt, file_content, metrics, context
+        )
         
-        # Store report if bias detected
-        if bias_report.bias_detected:
-            report_id = str(uuid.uuid4())
-            supabase.table("reports").insert({
-                "id": report_id,
-                "user_id": user["user_id"],
-                "chat_id": request.chatId,
-                "bias_detected": bias_report.bias_detected,
-                "reasons": bias_report.reasons,
-                "fixes": bias_report.fixes,
-                "created_at": timestamp
-            }).execute()
+        new_messages = await save_chat_turn(request, user["user_id"], ai_reply, bias_report, context)
         
         return ChatResponse(
             reply=ai_reply,
             report=bias_report,
             updatedChat={
                 "id": request.chatId,
-                "messages": new_messages
+                "messages": new_messages  # Only the messages appended by this turn
             }
         )
         
@@ -370,6 +1373,96 @@ async def chat(request: ChatRequest, user=Depends(get_current_user)):
         logger.error(f"Chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/stream")
+async def chat_stream(request: ChatRequest, user=Depends(get_current_user)):
+    """Stream a chat reply as Server-Sent Events.
+
+    Emits `token` events while the model generates, then a `report` event with the
+    parsed bias report and a `done` event once the turn has been persisted.
+    """
+    (prompt, file_content, metrics), context = await asyncio.gather(
+        prepare_chat_input(request),
+        load_chat_context(request.chatId, user["user_id"], request.fileUrl)
+    )
+    
+    chunked = wants_chunked_analysis(file_content, request.chunked)
+    fast = request.fastMode and metrics is not None
+    history = None
+    if not chunked:
+        history, file_content = fit_conversation(
+            context, prompt, limit_file_content(file_content), bias_output(request.reportOnly)[0]
+        )
+    cache_key = bias_cache_key(prompt, file_content, history, request.reportOnly)
+    cached = None if chunked or fast else await analysis_cache.get(cache_key)
+    
+    async def event_stream():
+        parser = bias_stream_parser(request.reportOnly)
+        try:
+            if chunked or fast:
+                # Merged chunk replies and local metrics arrive whole, so there is nothing to stream incrementally
+                ai_reply, bias_report = await analyse_chat_input(request, user["user_id"], prompt, file_content, metrics)
+                yield sse_event("token", {"text": ai_reply})
+            elif cached is not None:
+                ai_reply, bias_report = cached[0], BiasReport(**cached[1])
+                yield sse_event("token", {"text": ai_reply})
+            else:
+                started = time.perf_counter()
+                messages = build_bias_messages(prompt, file_content, history, request.reportOnly)
+                options = bias_completion_options(request.reportOnly)
+                completion_chars = 0
+                # The slot is held for the whole stream, not just the initial request
+                with stage("llm_stream"):
+                    async with llm_scheduler.reserve(
+                        user["user_id"], estimate_request_tokens(messages, options["max_tokens"])
+                    ):
+                        stream = await clients.openai.chat.completions.create(
+                            messages=messages,
+                            stream=True,
+                            **options
+                        )
+                        async for chunk in stream:
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta.content or ""
+                            completion_chars += len(delta)
+                            visible = parser.feed(delta)
+                            if visible:
+                                yield sse_event("token", {"text": visible})
+                
+                # Streamed responses carry no usage in this API version, so tokens are estimated
+                record_llm_usage(
+                    BIAS_MODEL,
+                    sum(estimate_tokens(m["content"]) for m in messages),
+                    -(-completion_chars // CHARS_PER_TOKEN),
+                    source="estimate"
+                )
+                remaining, ai_reply, bias_report, parsed = parser.finish()
+                if remaining:
+                    yield sse_event("token", {"text": remaining})
+                if parsed:
+                    await analysis_cache.put(
+                        cache_key, (ai_reply, bias_report.model_dump()), time.perf_counter() - started
+                    )
+        except Exception as e:
+            logger.error(f"Error in bias detection: {str(e)}")
+            ai_reply, bias_report = "I encountered an error while processing your request.", error_bias_report()
+            yield sse_event("token", {"text": ai_reply})
+        
+        yield sse_event("report", bias_report.model_dump())
+        
+        try:
+            new_messages = await save_chat_turn(request, user["user_id"], ai_reply, bias_report, context)
+            yield sse_event("done", {"chatId": request.chatId, "reply": ai_reply, "messages": new_messages})
+        except Exception as e:
+            logger.error(f"Chat stream error: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/chat/new")
 async def new_chat(user=Depends(get_current_user)):
     """Create a new chat session"""
@@ -377,7 +1470,7 @@ async def new_chat(user=Depends(get_current_user)):
     timestamp = datetime.utcnow().isoformat()
     
     try:
-        supabase.table("chats").insert({
+        await clients.db.table("chats").insert({
             "id": chat_id,
             "user_id": user["user_id"],
             "messages": [],
@@ -391,25 +1484,66 @@ async def new_chat(user=Depends(get_current_user)):
         logger.error(f"New chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/chat/{chat_id}/messages")
+async def get_chat_messages(chat_id: str, before: Optional[int] = None, after: Optional[int] = None,
+                            limit: int = 50, user=Depends(get_current_user)):
+    """Page through a chat's messages by sequence number.
+
+    With `before`, returns the `limit` messages preceding that seq (default: the latest
+    page); with `after`, the `limit` messages following it. Messages are in ascending order.
+    """
+    limit = max(1, min(limit, 200))
+    try:
+        query = clients.db.table("chat_messages").select(
+            "seq, role, content, created_at"
+        ).eq("chat_id", chat_id).eq("user_id", user["user_id"])
+        
+        with stage("db_select_messages"):
+            if after is not None:
+                response = await query.gt("seq", after).order("seq").limit(limit + 1).execute()
+                rows = response.data[:limit]
+            else:
+                if before is not None:
+                    query = query.lt("seq", before)
+                response = await query.order("seq", desc=True).limit(limit + 1).execute()
+                rows = list(reversed(response.data[:limit]))
+        
+        return {
+            "chatId": chat_id,
+            "messages": [message_from_row(row) for row in rows],
+            "hasMore": len(response.data) > limit
+        }
+        
+    except Exception as e:
+        logger.error(f"Chat messages error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+CHAT_DELETE_MAX_IDS = 1000
+
+async def delete_user_chats(user_id: str, chat_ids: List[str]) -> List[str]:
+    """Delete a user's chats in one statement, returning the ids that existed.
+
+    Messages, reports and turn writes go with them through ON DELETE CASCADE; files the
+    chats attached are left for the upload garbage collector.
+    """
+    with stage("db_delete_chats"):
+        response = await clients.db.rpc("delete_chats", {"p_user_id": user_id, "p_chat_ids": chat_ids}).execute()
+    deleted = [row["id"] for row in response.data]
+    
+    # Turns still queued for writing would recreate the chats
+    if CHAT_WRITE_BEHIND and deleted:
+        await run_in_threadpool(chat_outbox.discard, deleted)
+    if deleted:
+        upload_collector.wake()
+    return deleted
+
 @app.delete("/api/chat/{chat_id}")
 async def delete_chat(chat_id: str, user=Depends(get_current_user)):
     """Delete a chat session"""
     try:
-        # Verify chat belongs to user
-        chat_response = supabase.table("chats").select("user_id").eq("id", chat_id).execute()
-        
-        if not chat_response.data:
+        if not await delete_user_chats(user["user_id"], [chat_id]):
             raise HTTPException(status_code=404, detail="Chat not found")
         
-        if chat_response.data[0]["user_id"] != user["user_id"]:
-            raise HTTPException(status_code=403, detail="Unauthorized")
-        
-        # Delete associated reports first
-        supabase.table("reports").delete().eq("chat_id", chat_id).execute()
-        
-        # Delete chat
-        supabase.table("chats").delete().eq("id", chat_id).execute()
-        
         return {"success": True}
         
     except HTTPException:
@@ -418,24 +1552,137 @@ async def delete_chat(chat_id: str, user=Depends(get_current_user)):
         logger.error(f"Delete chat error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/chat/delete")
+async def delete_chats(request: DeleteChatsRequest, user=Depends(get_current_user)):
+    """Delete up to 1000 of the user's chats in one request.
+
+    Ids that don't exist or belong to someone else are returned in notFound.
+    """
+    if len(request.chatIds) > CHAT_DELETE_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {CHAT_DELETE_MAX_IDS} chats per request")
+    try:
+        chat_ids = list(dict.fromkeys(str(uuid.UUID(chat_id)) for chat_id in request.chatIds))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="chatIds must be UUIDs")
+    
+    try:
+        deleted = await delete_user_chats(user["user_id"], chat_ids) if chat_ids else []
+        deleted_set = set(deleted)
+        return {
+            "deleted": deleted,
+            "notFound": [chat_id for chat_id in chat_ids if chat_id not in deleted_set]
+        }
+    
+    except Exception as e:
+        logger.error(f"Delete chats error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+def encode_cursor(updated_at: str, row_id: str) -> str:
+    """Opaque keyset cursor for an (updated_at, id) position"""
+    return base64.urlsafe_b64encode(json.dumps([updated_at, row_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        updated_at, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return updated_at, row_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+# Deleted chats are reported to delta syncs for this long (schema.sql prunes older tombstones)
+CHAT_TOMBSTONE_DAYS = 30
+
+def keyset_filter(time_column: str, id_column: str, cursor: str, op: str) -> str:
+    """PostgREST or=(...) filter for rows past a keyset cursor"""
+    updated_at, row_id = decode_cursor(cursor)
+    return f'{time_column}.{op}."{updated_at}",and({time_column}.eq."{updated_at}",{id_column}.{op}.{row_id})'
+
 @app.get("/api/history")
-async def get_history(user=Depends(get_current_user)):
-    """Get user's chat history"""
+async def get_history(cursor: Optional[str] = None, limit: int = 50,
+                      updated_since: Optional[str] = None, if_none_match: Optional[str] = Header(None),
+                      user=Depends(get_current_user)):
+    """Get user's chat history.
+
+    Pages newest-first by keyset on (updated_at, id); the next page's cursor is returned
+    in the X-Next-Cursor header. With `updated_since`, returns only chats changed after
+    that timestamp, oldest-first, so clients can sync incrementally; chats deleted since
+    then come back as {"chatId", "deleted": true, "updatedAt"}. Deletions are only kept
+    for CHAT_TOMBSTONE_DAYS, so an older `updated_since` gets 410 and the client must
+    resync in full. Responses carry an ETag and an unchanged page returns 304.
+    """
+    limit = max(1, min(limit, 200))
+    
+    # Delta mode walks forwards from updated_since; normal mode walks backwards from now
+    ascending = updated_since is not None
+    if ascending:
+        try:
+            since = datetime.fromisoformat(updated_since.replace("Z", "+00:00"))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="updated_since must be an ISO timestamp")
+        if since.tzinfo is not None:
+            since = since.astimezone(timezone.utc).replace(tzinfo=None)
+        if since < datetime.utcnow() - timedelta(days=CHAT_TOMBSTONE_DAYS):
+            raise HTTPException(
+                status_code=410,
+                detail=f"updated_since is more than {CHAT_TOMBSTONE_DAYS} days old; resync without it"
+            )
+    
     try:
-        response = supabase.table("chats").select(
-            "id, last_message, created_at"
-        ).eq("user_id", user["user_id"]).order("updated_at", desc=True).execute()
+        query = clients.db.table("chats").select(
+            "id, last_message, created_at, updated_at"
+        ).eq("user_id", user["user_id"])
+        
+        if ascending:
+            query = query.gt("updated_at", updated_since)
+        if cursor:
+            query = query.or_(keyset_filter("updated_at", "id", cursor, "gt" if ascending else "lt"))
         
-        history = []
-        for chat in response.data:
-            history.append({
+        # postgrest-py repeats the order param per call, so both keys go in one order clause
+        with stage("db_select_history"):
+            chats_response = await query.order(
+                "updated_at,id" if ascending else "updated_at.desc,id", desc=not ascending
+            ).limit(limit + 1).execute()
+        
+        entries = [
+            (chat["updated_at"], chat["id"], {
                 "chatId": chat["id"],
                 "lastMessage": chat.get("last_message", "New chat"),
-                "createdAt": chat["created_at"]
+                "createdAt": chat["created_at"],
+                "updatedAt": chat["updated_at"]
             })
+            for chat in chats_response.data
+        ]
+        
+        # Tombstones share the keyset order, so one cursor pages through the merged stream
+        if ascending:
+            query = clients.db.table("chat_deletions").select("chat_id, deleted_at").eq(
+                "user_id", user["user_id"]
+            ).gt("deleted_at", updated_since)
+            if cursor:
+                query = query.or_(keyset_filter("deleted_at", "chat_id", cursor, "gt"))
+            with stage("db_select_chat_deletions"):
+                deletions_response = await query.order("deleted_at,chat_id").limit(limit + 1).execute()
+            entries.extend(
+                (row["deleted_at"], row["chat_id"],
+                 {"chatId": row["chat_id"], "deleted": True, "updatedAt": row["deleted_at"]})
+                for row in deletions_response.data
+            )
+            entries.sort(key=lambda entry: entry[:2])
+        
+        rows = entries[:limit]
+        history = [entry for _, _, entry in rows]
+        
+        headers = {}
+        if len(entries) > limit:
+            headers["X-Next-Cursor"] = encode_cursor(rows[-1][0], rows[-1][1])
+        body = json.dumps(history, separators=(",", ":"))
+        headers["ETag"] = f'W/"{hashlib.sha256((body + headers.get("X-Next-Cursor", "")).encode()).hexdigest()[:32]}"'
         
-        return history
+        if if_none_match and headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"History error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -446,7 +1693,8 @@ async def download_report(request: ReportDownloadRequest, user=Depends(get_curre
     """Download report in PDF or JSON format"""
     try:
         # Get report data
-        report_response = supabase.table("reports").select("*").eq("id", request.reportId).execute()
+        with stage("db_select_report"):
+            report_response = await clients.db.table("reports").select("*").eq("id", request.reportId).execute()
         
         if not report_response.data:
             raise HTTPException(status_code=404, detail="Report not found")
@@ -459,13 +1707,7 @@ async def download_report(request: ReportDownloadRequest, user=Depends(get_curre
         
         if request.format == "json":
             # Return JSON file
-            json_content = json.dumps({
-                "report_id": report["id"],
-                "created_at": report["created_at"],
-                "bias_detected": report["bias_detected"],
-                "reasons": report["reasons"],
-                "fixes": report["fixes"]
-            }, indent=2)
+            json_content = json.dumps(report_document(report), indent=2)
             
             return StreamingResponse(
                 io.StringIO(json_content),
@@ -476,44 +1718,12 @@ async def download_report(request: ReportDownloadRequest, user=Depends(get_curre
             )
         
         elif request.format == "pdf":
-            # Generate PDF
-            buffer = io.BytesIO()
-            doc = SimpleDocTemplate(buffer, pagesize=letter)
-            styles = getSampleStyleSheet()
-            story = []
-            
-            # Title
-            story.append(Paragraph("Bias Detection Report", styles['Title']))
-            story.append(Spacer(1, 12))
-            
-            # Report ID and Date
-            story.append(Paragraph(f"Report ID: {report['id']}", styles['Normal']))
-            story.append(Paragraph(f"Date: {report['created_at']}", styles['Normal']))
-            story.append(Spacer(1, 12))
-            
-            # Bias Detection Result
-            status = "Bias Detected" if report["bias_detected"] else "No Bias Detected"
-            story.append(Paragraph(f"Status: {status}", styles['Heading2']))
-            story.append(Spacer(1, 12))
-            
-            # Reasons
-            if report["reasons"]:
-                story.append(Paragraph("Reasons:", styles['Heading3']))
-                for reason in report["reasons"]:
-                    story.append(Paragraph(f"• {reason}", styles['Normal']))
-                story.append(Spacer(1, 12))
-            
-            # Fixes
-            if report["fixes"]:
-                story.append(Paragraph("Recommended Fixes:", styles['Heading3']))
-                for fix in report["fixes"]:
-                    story.append(Paragraph(f"• {fix}", styles['Normal']))
-            
-            doc.build(story)
-            buffer.seek(0)
+            # Rendered off the event loop, and only once per report
+            with stage("pdf_render"):
+                pdf = await report_renderer.render(report)
             
-            return StreamingResponse(
-                buffer,
+            return Response(
+                content=pdf,
                 media_type="application/pdf",
                 headers={
                     "Content-Disposition": f"attachment; filename=bias_report_{report['id']}.pdf"
@@ -529,43 +1739,537 @@ async def download_report(request: ReportDownloadRequest, user=Depends(get_curre
         logger.error(f"Download report error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+EXPORT_PAGE_SIZE = 200
+EXPORT_RENDER_AHEAD = 8
+
+async def iter_user_reports(user_id: str, since: Optional[str] = None):
+    """Yield a user's reports oldest-first, one keyset page at a time"""
+    position = None
+    while True:
+        query = clients.db.table("reports").select(
+            "id, chat_id, bias_detected, reasons, fixes, categories, created_at"
+        ).eq("user_id", user_id)
+        if since:
+            query = query.gt("created_at", since)
+        if position:
+            created_at, row_id = position
+            query = query.or_(
+                f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{row_id})'
+            )
+        with stage("db_select_reports"):
+            page = (await query.order("created_at,id").limit(EXPORT_PAGE_SIZE).execute()).data
+        for report in page:
+            yield report
+        if len(page) < EXPORT_PAGE_SIZE:
+            return
+        position = (page[-1]["created_at"], page[-1]["id"])
+
+@app.get("/api/report/export")
+async def export_reports(format: str = "ndjson", since: Optional[str] = None, user=Depends(get_current_user)):
+    """Stream all of the user's reports as NDJSON or as a ZIP of PDFs.
+
+    Entries are generated as the reports are paged in, so exports of any size are
+    sent without being built in memory first. `since` limits the export to reports
+    created after that timestamp.
+    """
+    if format not in ("ndjson", "zip"):
+        raise HTTPException(status_code=400, detail="Invalid format")
+    
+    reports = iter_user_reports(user["user_id"], since)
+    if format == "zip":
+        body = iter_pdf_zip(reports, report_renderer, EXPORT_RENDER_AHEAD)
+        media_type = "application/zip"
+    else:
+        body = iter_ndjson(reports)
+        media_type = "application/x-ndjson"
+    
+    async def stream():
+        try:
+            async for chunk in body:
+                yield chunk
+        except Exception as e:
+            # Headers are already sent; log and cut the stream short so the client sees a truncated file
+            logger.error(f"Report export error: {str(e)}")
+            raise
+    
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f"attachment; filename={export_filename(user['user_id'], format)}"
+        }
+    )
+
+# Analytics endpoints
+ANALYTICS_DEFAULT_DAYS = 30
+ANALYTICS_MAX_BUCKETS = 400
+
+@app.get("/api/analytics")
+async def get_analytics(bucket: str = "day", start: Optional[str] = None, end: Optional[str] = None,
+                        categories: Optional[str] = None, user=Depends(get_current_user)):
+    """Counts of the user's bias reports per day, week or month, by category.
+
+    Read from the report_rollups table, which the database keeps up to date as reports
+    are written, so the cost depends on the range asked for rather than on the number of
+    reports. `start` and `end` are dates (default: the last 30 days); `categories` is a
+    comma-separated subset of the categories to return.
+    """
+    if bucket not in BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {', '.join(BUCKETS)}")
+    try:
+        end_day = date.fromisoformat(end) if end else datetime.utcnow().date()
+        start_day = date.fromisoformat(start) if start else end_day - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be dates (YYYY-MM-DD)")
+    if start_day > end_day:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    span_days = (end_day - start_day).days + 1
+    if span_days > ANALYTICS_MAX_BUCKETS * {"day": 1, "week": 7, "month": 31}[bucket]:
+        raise HTTPException(status_code=400, detail=f"Range too long for {bucket} buckets")
+    
+    known = (*CATEGORIES, OTHER)
+    selected = [category.strip() for category in categories.split(",")] if categories else list(known)
+    unknown = [category for category in selected if category not in known]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown categories: {', '.join(unknown)}")
+    
+    try:
+        with stage("db_select_analytics"):
+            response = await clients.db.rpc("bias_analytics", {
+                "p_user_id": user["user_id"],
+                "p_start": start_day.isoformat(),
+                "p_end": end_day.isoformat(),
+                "p_bucket": bucket
+            }).execute()
+        
+        buckets = fill_buckets(response.data, start_day, end_day, bucket, selected)
+        return {
+            "bucket": bucket,
+            "start": start_day.isoformat(),
+            "end": end_day.isoformat(),
+            "categories": selected,
+            "buckets": buckets,
+            "totals": {
+                "reports": sum(entry["reports"] for entry in buckets),
+                "categories": {category: sum(entry["categories"][category] for entry in buckets)
+                               for category in selected}
+            }
+        }
+    
+    except Exception as e:
+        logger.error(f"Analytics error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Batch job endpoints
+BATCH_JOB_MAX_ITEMS = int(os.getenv("BATCH_JOB_MAX_ITEMS", "1000"))
+BATCH_DEFAULT_MESSAGE = "Analyse this content for bias."
+
+async def run_batch_item(item: Dict[str, Any]) -> tuple[Dict[str, Any], Optional[str]]:
+    """Analyse one job item like a chat turn and store its report if bias was detected"""
+    await clients.wait_ready()
+    options = item["options"]
+    request = ChatRequest(
+        chatId=item["job_id"],
+        message=options["message"],
+        fileUrl=item["input"] if item["kind"] == "file" else None,
+        chunked=options["chunked"],
+        fastMode=options["fastMode"],
+        labelColumn=options["labelColumn"],
+        reportOnly=options.get("reportOnly", False)  # Absent from jobs queued before the option existed
+    )
+    if item["kind"] == "file":
+        prompt, file_content, metrics = await read_chat_input(request)
+    else:
+        prompt, file_content, metrics = request.message, item["input"], None
+    
+    if request.fastMode and metrics is not None:
+        reply, bias_report = local_bias_analysis(metrics)
+    else:
+        reply, bias_report = await run_bias_analysis(
+            prompt, file_content, request.chunked, request.fileUrl, item["user_id"], metrics=metrics,
+            report_only=request.reportOnly
+        )
+    
+    report_id = None
+    if bias_report.bias_detected:
+        report_id = await store_report(item["user_id"], bias_report, datetime.utcnow().isoformat(), job_id=item["job_id"])
+    return {"reply": reply, "report": bias_report.model_dump()}, report_id
+
+def job_from_row(job: Dict[str, Any]) -> Dict[str, Any]:
+    """API shape of a stored job"""
+    result = {
+        "jobId": job["id"],
+        "status": job["status"],
+        "total": job["total"],
+        "createdAt": datetime.utcfromtimestamp(job["created_at"]).isoformat(),
+        "updatedAt": datetime.utcfromtimestamp(job["updated_at"]).isoformat()
+    }
+    if "counts" in job:
+        result["counts"] = job["counts"]
+    return result
+
+async def get_owned_job(job_id: str, user: Dict[str, Any]) -> Dict[str, Any]:
+    job = await run_in_threadpool(job_store.get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["user_id"] != user["user_id"]:
+        raise HTTPException(status_code=403, detail="Unauthorized")
+    return job
+
+@app.post("/api/jobs")
+async def create_job(request: BatchJobRequest, user=Depends(get_current_user)):
+    """Queue a batch of texts and/or uploaded file URLs for background bias analysis"""
+    if not request.items:
+        raise HTTPException(status_code=400, detail="A job needs at least one item")
+    if len(request.items) > BATCH_JOB_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"A job can have at most {BATCH_JOB_MAX_ITEMS} items")
+    items = []
+    for item in request.items:
+        if (item.text is None) == (item.fileUrl is None):
+            raise HTTPException(status_code=400, detail="Each item needs exactly one of text or fileUrl")
+        items.append(("text", item.text) if item.text is not None else ("file", item.fileUrl))
+    
+    try:
+        options = {
+            "message": request.message or BATCH_DEFAULT_MESSAGE,
+            "chunked": request.chunked,
+            "fastMode": request.fastMode,
+            "labelColumn": request.labelColumn,
+            "reportOnly": request.reportOnly
+        }
+        job_id = await run_in_threadpool(job_store.create_job, user["user_id"], options, items)
+        job_pool.wake()
+        return job_from_row(await run_in_threadpool(job_store.get_job, job_id))
+        
+    except Exception as e:
+        logger.error(f"Create job error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/jobs")
+async def list_jobs(limit: int = 50, user=Depends(get_current_user)):
+    """User's batch jobs, newest first"""
+    jobs = await run_in_threadpool(job_store.list_jobs, user["user_id"], max(1, min(limit, 200)))
+    return [job_from_row(job) for job in jobs]
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, user=Depends(get_current_user)):
+    """Job status with per-status item counts"""
+    return job_from_row(await get_owned_job(job_id, user))
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str, user=Depends(get_current_user)):
+    """Stream job progress as Server-Sent Events.
+
+    Emits a `progress` event whenever the item counts change and a `done` event once
+    the job is completed or cancelled.
+    """
+    job = await get_owned_job(job_id, user)
+    
+    async def event_stream():
+        current = job
+        last = None
+        while True:
+            snapshot = job_from_row(current)
+            if snapshot != last:
+                yield sse_event("progress", snapshot)
+                last = snapshot
+            if current["status"] in TERMINAL_JOB_STATUSES:
+                yield sse_event("done", snapshot)
+                return
+            await job_pool.wait_for_change(job_pool.poll_seconds)
+            current = await run_in_threadpool(job_store.get_job, job_id)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/jobs/{job_id}/results")
+async def job_results(job_id: str, after: int = -1, limit: int = 100, user=Depends(get_current_user)):
+    """Item results in order; pass the last index seen as `after` to page"""
+    await get_owned_job(job_id, user)
+    items = await run_in_threadpool(job_store.results, job_id, after, max(1, min(limit, 500)))
+    return {
+        "jobId": job_id,
+        "results": [{
+            "index": item["index"],
+            "kind": item["kind"],
+            "fileUrl": item["input"],
+            "status": item["status"],
+            "attempts": item["attempts"],
+            "reply": item["result"]["reply"] if item["result"] else None,
+            "report": item["result"]["report"] if item["result"] else None,
+            "reportId": item["report_id"],
+            "error": item["error"]
+        } for item in items],
+        "nextAfter": items[-1]["index"] if items else None
+    }
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, user=Depends(get_current_user)):
+    """Stop a job; finished items keep their results"""
+    await get_owned_job(job_id, user)
+    await job_pool.cancel_job(job_id)
+    return job_from_row(await run_in_threadpool(job_store.get_job, job_id))
+
+@app.post("/api/jobs/{job_id}/resume")
+async def resume_job(job_id: str, retryFailed: bool = False, user=Depends(get_current_user)):
+    """Re-queue a cancelled job's unfinished items, and optionally its failed ones"""
+    await get_owned_job(job_id, user)
+    await run_in_threadpool(job_store.resume, job_id, retryFailed)
+    job_pool.wake()
+    return job_from_row(await run_in_threadpool(job_store.get_job, job_id))
+
 # Upload endpoint
+def utc_timestamp(epoch_seconds: float) -> str:
+    return datetime.utcfromtimestamp(epoch_seconds).isoformat() + "+00:00"
+
+async def register_upload(object_path: str, user_id: str, size: int):
+    """Record an upload (or a re-upload of the same content) for the upload garbage collector"""
+    with stage("db_register_upload"):
+        await clients.db.table("upload_objects").upsert({
+            "path": object_path,
+            "user_id": user_id,
+            "size": size,
+            "uploaded_at": utc_timestamp(time.time())
+        }, on_conflict="path", returning=ReturnMethod.minimal).execute()
+
+async def record_dataset_version(user_id: str, file_name: str, file_hash: str,
+                                 lineage_id: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Add an upload to its dataset lineage: the one given, else the latest one of the same file name.
+
+    Returns the lineage id, the upload's version number and the previous version's hash,
+    or None if lineage_id isn't one of the user's lineages.
+    """
+    with stage("db_dataset_version"):
+        response = await clients.db.rpc("record_dataset_version", {
+            "p_user_id": user_id,
+            "p_file_name": file_name,
+            "p_file_hash": file_hash,
+            "p_lineage_id": lineage_id
+        }).execute()
+    return response.data[0] if response.data else None
+
+async def find_orphaned_uploads(before: float, after: Optional[tuple], limit: int) -> List[Dict[str, Any]]:
+    await clients.wait_ready()
+    params = {"p_before": utc_timestamp(before), "p_limit": limit}
+    if after:
+        params.update(p_after_uploaded_at=after[0], p_after_path=after[1])
+    with stage("db_orphaned_uploads"):
+        return (await clients.db.rpc("orphaned_uploads", params).execute()).data
+
+async def claim_orphaned_uploads(paths: List[str], before: float) -> List[Dict[str, Any]]:
+    with stage("db_claim_uploads"):
+        response = await clients.db.rpc(
+            "claim_orphaned_uploads", {"p_paths": paths, "p_before": utc_timestamp(before)}
+        ).execute()
+    return response.data
+
+async def release_orphaned_uploads(rows: List[Dict[str, Any]]):
+    """Re-register claimed uploads whose objects could not be removed"""
+    await clients.db.table("upload_objects").upsert(
+        rows, on_conflict="path", ignore_duplicates=True, returning=ReturnMethod.minimal
+    ).execute()
+
+async def uploads_in_use() -> set:
+    """Object paths of files that batch jobs may still analyse"""
+    paths = set()
+    for file_url in await run_in_threadpool(job_store.unfinished_inputs, "file"):
+        try:
+            paths.add(storage_path_from_url(file_url))
+        except IndexError:
+            pass
+    return paths
+
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...), user=Depends(get_current_user)):
-    """Upload file to Supabase storage"""
+async def upload_file(file: UploadFile = File(...), lineageId: Optional[str] = Form(None),
+                      user=Depends(get_current_user)):
+    """Upload file to Supabase storage.
+
+    The file is hashed and streamed in chunks, never held in memory whole. Objects are
+    named by content hash, so re-uploading an identical file reuses the stored object.
+    Uploads are versions of a dataset lineage: the one named by lineageId, or else the
+    latest lineage of a file with the same name. If the version can't be recorded, the
+    response leaves out lineageId, version and previousSha256.
+    """
+    if lineageId is not None:
+        try:
+            lineageId = str(uuid.UUID(lineageId))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="lineageId must be a UUID")
     try:
-        # Generate unique filename
         file_extension = file.filename.split(".")[-1] if "." in file.filename else ""
-        unique_filename = f"{user['user_id']}/{uuid.uuid4()}.{file_extension}"
+        suffix = f".{file_extension}" if file_extension else ""
         
-        # Read file content
-        file_content = await file.read()
+        # Hash the file, enforcing the size limit as soon as it is exceeded; the local
+        # copy feeds artifact extraction while the original streams to storage
+        async with aiofiles.tempfile.NamedTemporaryFile("wb", suffix=suffix, delete=False) as copy:
+            copy_path = copy.name
+            try:
+                with stage("upload_hash"):
+                    file_hash, file_size = await hash_upload(file, MAX_UPLOAD_BYTES, UPLOAD_CHUNK_SIZE, copy)
+            except BaseException:
+                await aiofiles.os.remove(copy_path)
+                raise
+        FILE_BYTES.observe(file_size, "upload")
         
-        # Upload to Supabase storage
-        response = supabase.storage.from_("uploads").upload(
-            unique_filename,
-            file_content,
-            file_options={"content-type": file.content_type}
-        )
+        try:
+            # Content-addressed filename, so identical files from the same user share one object
+            object_path = f"{user['user_id']}/{file_hash}{suffix}"
+            
+            async def store():
+                # Upload to Supabase storage unless this user already stored the same content
+                session = clients.storage.session
+                with stage("storage_upload"):
+                    if await object_exists(session, "uploads", object_path):
+                        return True
+                    # A concurrent upload of the same content may store it between the check and ours
+                    if file_size > RESUMABLE_UPLOAD_THRESHOLD:
+                        stored = await resumable_upload(
+                            session, "uploads", object_path, file, file_size, file.content_type
+                        )
+                    else:
+                        stored = await stream_upload(
+                            session, "uploads", object_path, file, file.content_type, UPLOAD_CHUNK_SIZE
+                        )
+                    return not stored
+            
+            async def extract():
+                try:
+                    await ensure_file_artifact(file_hash, copy_path, file.filename)
+                except Exception as e:
+                    # Chat falls back to extracting on first use
+                    logger.error(f"Artifact extraction error: {str(e)}")
+            
+            async def add_version():
+                try:
+                    return await record_dataset_version(user["user_id"], file.filename, file_hash, lineageId)
+                except Exception as e:
+                    # Lineage is metadata; the upload is returned without it rather than failed
+                    logger.error(f"Dataset version error: {str(e)}")
+                    return {}
+            
+            deduplicated, _, _, lineage = await asyncio.gather(
+                store(),
+                extract(),
+                register_upload(object_path, user["user_id"], file_size),
+                add_version()
+            )
+        finally:
+            await aiofiles.os.remove(copy_path)
+        if lineage is None:
+            raise HTTPException(status_code=404, detail="Lineage not found")
         
         # Get public URL
-        file_url = supabase.storage.from_("uploads").get_public_url(unique_filename)
+        file_url = await clients.storage.from_("uploads").get_public_url(object_path)
         
-        return {
+        result = {
             "fileUrl": file_url,
             "fileName": file.filename,
-            "fileSize": len(file_content)
+            "fileSize": file_size,
+            "sha256": file_hash,
+            "deduplicated": deduplicated
         }
+        if lineage:
+            result.update(
+                lineageId=lineage["lineage_id"],
+                version=lineage["version"],
+                previousSha256=lineage["parent_hash"]
+            )
+        return result
         
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Upload error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/datasets/{lineage_id}")
+async def get_dataset_versions(lineage_id: str, user=Depends(get_current_user)):
+    """Versions of a dataset lineage, newest first"""
+    try:
+        lineage_id = str(uuid.UUID(lineage_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Lineage not found")
+    try:
+        with stage("db_select_dataset_versions"):
+            response = await clients.db.table("dataset_versions").select(
+                "version, file_name, file_hash, created_at"
+            ).eq("lineage_id", lineage_id).eq("user_id", user["user_id"]).order("version", desc=True).execute()
+    except Exception as e:
+        logger.error(f"Dataset versions error: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Lineage not found")
+    return {
+        "lineageId": lineage_id,
+        "versions": [
+            {
+                "version": row["version"],
+                "fileName": row["file_name"],
+                "sha256": row["file_hash"],
+                "createdAt": row["created_at"]
+            }
+            for row in response.data
+        ]
+    }
+
+@app.get("/api/llm/stats")
+async def llm_stats(user=Depends(get_admin_user)):
+    """Model call scheduler queue depth, wait times and retry counters"""
+    return {**llm_scheduler.stats(), "batchWorkers": job_pool.stats()}
+
+@app.get("/api/cache/stats")
+async def cache_stats(user=Depends(get_admin_user)):
+    """Analysis, file chunk, file artifact, rendered PDF and conversation summary cache counters, upload
+    collection and the chat write-behind outbox"""
+    return {
+        **analysis_cache.stats(),
+        "chunkAnalyses": chunk_store.stats(),
+        "artifacts": artifact_cache.stats(),
+        "reportPdfs": report_renderer.stats(),
+        "conversationSummaries": summary_refresher.stats(),
+        "uploadGarbageCollector": upload_collector.stats(),
+        "chatWriteBehind": chat_flusher.stats() if CHAT_WRITE_BEHIND else None
+    }
+
+registry.gauge("biasbuster_llm_queue_depth", "Model calls waiting for a scheduler slot",
+               lambda: llm_scheduler.stats()["queueDepth"])
+registry.gauge("biasbuster_llm_in_flight", "Model calls in progress", lambda: llm_scheduler.stats()["inFlight"])
+registry.gauge("biasbuster_batch_items_running", "Batch job items being analysed by this worker",
+               lambda: job_pool.stats()["running"])
+if CHAT_WRITE_BEHIND:
+    registry.gauge("biasbuster_chat_outbox_pending", "Chat turns queued in the outbox, not yet written",
+                   lambda: chat_outbox.counts()["pending"])
+    registry.gauge("biasbuster_chat_outbox_failed", "Chat turns given up on after the maximum attempts",
+                   lambda: chat_outbox.counts()["failed"])
+    registry.gauge("biasbuster_chat_outbox_flush_retries", "Failed chat turn writes retried by this worker",
+                   lambda: chat_flusher.retries)
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics for this worker process"""
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Health check
 @app.get("/")
 async def root():
     return {"message": "BiasBuster API is running"}
 
+@app.get("/ready")
+async def ready():
+    """Readiness: 200 once the upstream clients are open and their pools pre-connected, 503 until then"""
+    body = {
+        "ready": clients.ready,
+        "warm": clients.warm,
+        "startupSeconds": round(clients.ready_seconds, 3) if clients.ready_seconds is not None else None,
+        "error": clients.error
+    }
+    return JSONResponse(status_code=200 if clients.ready else 503, content=body)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
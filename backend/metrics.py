@@ -0,0 +1,204 @@
+"""In-process metrics exposed in Prometheus text format.
+
+Counters and histograms are plain dicts keyed by label values, updated from the
+event loop thread, so recording a sample is a dict lookup and a bisect. Each
+worker process keeps its own series; scrape every worker, or aggregate with
+the usual `sum by` queries.
+
+stage() times one step of a request (storage download, model call, database
+write...) into biasbuster_stage_seconds, counts its failures by exception type,
+and, while a request is being timed, adds the step to that request's
+Server-Timing entries.
+"""
+import bisect
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds, from a cache hit up to a long chunked analysis
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Bytes, 1 KB to 256 MB in powers of four
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(10))
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# (stage, seconds) entries for the request being handled, when it is timed
+_request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for values, total in self._values.items():
+            yield f"{self.name}{_format_labels(self.labels, values)} {_format_number(total)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._bucket_labels = [f'le="{float(bound)!r}"' for bound in self.buckets] + ['le="+Inf"']
+        # label values -> [per-bucket counts (last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for values, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for le, bucket_count in zip(self._bucket_labels, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_format_labels(self.labels, values, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, values)} {_format_number(float(total))}"
+            yield f"{self.name}_count{_format_labels(self.labels, values)} {count}"
+
+
+class Gauge:
+    """Value read from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {_format_number(float(self.read()))}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> Gauge:
+        return self.register(Gauge(name, help_text, read))
+
+    def render(self) -> str:
+        """Prometheus text exposition format 0.0.4"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "biasbuster_request_seconds", "Time to produce a response, by route and status",
+    ("method", "route", "status"),
+)
+STAGE_SECONDS = registry.histogram(
+    "biasbuster_stage_seconds", "Time spent in each step of request handling", ("stage",),
+)
+ERRORS = registry.counter(
+    "biasbuster_errors_total", "Failures by stage and exception type", ("stage", "type"),
+)
+LLM_TOKENS = registry.counter(
+    "biasbuster_llm_tokens_total",
+    "Model tokens by kind; source is usage when reported by the API and estimate otherwise",
+    ("model", "kind", "source"),
+)
+LLM_REQUEST_TOKENS = registry.histogram(
+    "biasbuster_llm_request_tokens", "Total tokens per model call", ("model",), buckets=TOKEN_BUCKETS,
+)
+FILE_BYTES = registry.histogram(
+    "biasbuster_file_bytes", "Sizes of uploaded and downloaded files", ("source",), buckets=SIZE_BUCKETS,
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a step, count its failures, and add it to the request's Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        ERRORS.inc(name, type(e).__name__)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, name)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, elapsed))
+
+
+def record_llm_usage(model: str, prompt_tokens: int, completion_tokens: int, source: str = "usage",
+                     cached_prompt_tokens: int = 0):
+    """cached_prompt_tokens are the part of prompt_tokens served from the API's prompt cache"""
+    LLM_TOKENS.inc(model, "prompt", source, amount=prompt_tokens)
+    LLM_TOKENS.inc(model, "completion", source, amount=completion_tokens)
+    if cached_prompt_tokens:
+        LLM_TOKENS.inc(model, "cached_prompt", source, amount=cached_prompt_tokens)
+    LLM_REQUEST_TOKENS.observe(prompt_tokens + completion_tokens, model)
+
+
+def start_request_timing() -> List[Tuple[str, float]]:
+    """Collect stage timings for the current request; the list is filled in as stages finish"""
+    timings: List[Tuple[str, float]] = []
+    _request_timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings: List[Tuple[str, float]], total_seconds: float) -> str:
+    """Server-Timing value; repeated stages (e.g. one per chunk) are summed"""
+    totals: Dict[str, float] = {}
+    for name, seconds in timings:
+        totals[name] = totals.get(name, 0.0) + seconds
+    entries = [f"{_token(name)};dur={seconds * 1000:.1f}" for name, seconds in totals.items()]
+    entries.append(f"total;dur={total_seconds * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def _token(name: str) -> str:
+    # Server-Timing metric names must be HTTP tokens
+    return re.sub(r"[^A-Za-z0-9!#$%&'*+.^_`|~-]", "_", name)
@@ -0,0 +1,233 @@
+"""PDF rendering and bulk export of bias reports.
+
+Rendering a PDF with reportlab is CPU-bound, so it runs in a process pool (or
+the default thread pool when REPORT_RENDER_PROCESSES is 0) instead of on the
+event loop. Stored reports never change, so rendered bytes are kept in a
+size-bounded LRU keyed by (report id, template version); bump
+TEMPLATE_VERSION whenever the layout changes.
+
+reportlab is imported on first render, so the API process doesn't load it at
+startup. Bulk exports are produced entry by entry: NDJSON lines or a ZIP written to a
+non-seekable sink that is drained after every file, so memory stays bounded by
+one page of reports however many a user has.
+"""
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_VERSION = "1"
+
+
+def report_document(report: Dict[str, Any]) -> Dict[str, Any]:
+    """The JSON form of a report, as returned by downloads and exports"""
+    return {
+        "report_id": report["id"],
+        "created_at": report["created_at"],
+        "bias_detected": report["bias_detected"],
+        "reasons": report["reasons"],
+        "fixes": report["fixes"],
+    }
+
+
+def render_report_pdf(report: Dict[str, Any]) -> bytes:
+    """Render one report as a PDF (runs in a worker, so it must stay a module-level function)"""
+    # reportlab is only needed here, and mostly in render workers rather than the API process
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+    story = []
+
+    # Title
+    story.append(Paragraph("Bias Detection Report", styles['Title']))
+    story.append(Spacer(1, 12))
+
+    # Report ID and Date
+    story.append(Paragraph(f"Report ID: {report['id']}", styles['Normal']))
+    story.append(Paragraph(f"Date: {report['created_at']}", styles['Normal']))
+    story.append(Spacer(1, 12))
+
+    # Bias Detection Result
+    status = "Bias Detected" if report["bias_detected"] else "No Bias Detected"
+    story.append(Paragraph(f"Status: {status}", styles['Heading2']))
+    story.append(Spacer(1, 12))
+
+    # Reasons
+    if report["reasons"]:
+        story.append(Paragraph("Reasons:", styles['Heading3']))
+        for reason in report["reasons"]:
+            story.append(Paragraph(f"• {reason}", styles['Normal']))
+        story.append(Spacer(1, 12))
+
+    # Fixes
+    if report["fixes"]:
+        story.append(Paragraph("Recommended Fixes:", styles['Heading3']))
+        for fix in report["fixes"]:
+            story.append(Paragraph(f"• {fix}", styles['Normal']))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def report_document_for_render(report: Dict[str, Any]) -> Dict[str, Any]:
+    """Only the fields the template uses, to keep what is pickled to workers small"""
+    return {field: report[field] for field in ("id", "created_at", "bias_detected", "reasons", "fixes")}
+
+
+class ReportRenderer:
+    """Off-loop PDF renderer with an LRU cache of rendered bytes"""
+
+    def __init__(self, processes: int = 2, cache_max_bytes: int = 64 * 1024 * 1024):
+        self.processes = processes
+        self.cache_max_bytes = cache_max_bytes
+        self._executor: Optional[Executor] = None
+        self._cache: "OrderedDict[tuple[str, str], bytes]" = OrderedDict()
+        self._cache_bytes = 0
+        self._inflight: Dict[tuple[str, str], asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.render_seconds = 0.0
+
+    def _get_executor(self) -> Optional[Executor]:
+        # Started on first use so processes aren't spawned for instances that never render
+        if self._executor is None and self.processes > 0:
+            # spawn rather than fork: the parent has a running event loop and open sockets
+            self._executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _remember(self, key: tuple[str, str], pdf: bytes):
+        if len(pdf) > self.cache_max_bytes:
+            return
+        self._cache[key] = pdf
+        self._cache_bytes += len(pdf)
+        while self._cache_bytes > self.cache_max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_bytes -= len(evicted)
+
+    async def render(self, report: Dict[str, Any]) -> bytes:
+        """PDF bytes for a report, rendered at most once per template version.
+
+        The render runs in its own task, so one client aborting its download doesn't
+        cancel it for the other requests waiting on the same report.
+        """
+        key = (str(report["id"]), TEMPLATE_VERSION)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return self._cache[key]
+        task = self._inflight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._render(key, report))
+            # Waiters re-raise a failure; don't warn about it being unretrieved if they all left
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return await asyncio.shield(task)
+
+    async def _render(self, key: tuple[str, str], report: Dict[str, Any]) -> bytes:
+        started = time.perf_counter()
+        try:
+            pdf = await asyncio.get_running_loop().run_in_executor(
+                self._get_executor(), render_report_pdf, report_document_for_render(report)
+            )
+        finally:
+            del self._inflight[key]
+        self.render_seconds += time.perf_counter() - started
+        self._remember(key, pdf)
+        return pdf
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._cache),
+            "bytes": self._cache_bytes,
+            "maxBytes": self.cache_max_bytes,
+            "renderSeconds": round(self.render_seconds, 3),
+            "processes": self.processes,
+        }
+
+
+async def iter_ndjson(reports: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[bytes]:
+    """One JSON document per line per report"""
+    async for report in reports:
+        line = json.dumps({**report_document(report), "chat_id": report.get("chat_id")}, separators=(",", ":"))
+        yield (line + "\n").encode()
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, non-seekable buffer that zipfile streams into and we drain"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _ordered_prefetch(items: AsyncIterator[Any], fn: Callable[[Any], Awaitable[Any]],
+                            window: int) -> AsyncIterator[tuple[Any, Any]]:
+    """Yield (item, await fn(item)) in input order, keeping up to window calls running ahead"""
+    pending: "list[tuple[Any, asyncio.Task]]" = []
+    try:
+        async for item in items:
+            pending.append((item, asyncio.ensure_future(fn(item))))
+            if len(pending) >= window:
+                item, task = pending.pop(0)
+                yield item, await task
+        for item, task in pending:
+            yield item, await task
+        pending = []
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+async def iter_pdf_zip(reports: AsyncIterator[Dict[str, Any]], renderer: ReportRenderer,
+                       window: int = 8) -> AsyncIterator[bytes]:
+    """A ZIP of one PDF per report, yielded as each file is added"""
+    sink = _ZipSink()
+    # PDFs are already compressed, so entries are stored as-is
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        async for report, pdf in _ordered_prefetch(reports, renderer.render, window):
+            archive.writestr(f"bias_report_{report['id']}.pdf", pdf)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def export_filename(user_id: str, file_format: str) -> str:
+    """Attachment name for a bulk export"""
+    extension = "zip" if file_format == "zip" else "ndjson"
+    return f"bias_reports_{user_id}_{time.strftime('%Y%m%d')}.{extension}"
@@ -79,4 +79,505 @@ CREATE POLICY "Users can view their own files"
 
 CREATE POLICY "Users can delete their own files"
     ON storage.objects FOR DELETE
-    USING (bucket_id = 'uploads' AND auth.uid()::text = (storage.foldername(name))[1]);
\ No newline at end of file
+    USING (bucket_id = 'uploads' AND auth.uid()::text = (storage.foldername(name))[1]);
+
+-- Append-only chat messages: one row per message instead of rewriting chats.messages
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS message_count INTEGER NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS chat_messages (
+    chat_id UUID REFERENCES chats(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (chat_id, seq)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_messages_user_id ON chat_messages(user_id);
+
+-- Uploaded file a message attached (its path in the uploads bucket); added here because
+-- append_chat_messages below writes it
+ALTER TABLE chat_messages ADD COLUMN IF NOT EXISTS file_path TEXT;
+
+ALTER TABLE chat_messages ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own messages"
+    ON chat_messages FOR SELECT
+    USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can insert their own messages"
+    ON chat_messages FOR INSERT
+    WITH CHECK (auth.uid() = user_id);
+
+-- Appends messages to a chat (creating the chat if needed) in one call.
+-- The chats row lock serialises concurrent turns, so sequence numbers never collide.
+CREATE OR REPLACE FUNCTION append_chat_messages(
+    p_chat_id UUID,
+    p_user_id UUID,
+    p_messages JSONB,
+    p_last_message TEXT
+) RETURNS SETOF chat_messages
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_start INTEGER;
+BEGIN
+    INSERT INTO chats (id, user_id, last_message)
+    VALUES (p_chat_id, p_user_id, p_last_message)
+    ON CONFLICT (id) DO NOTHING;
+
+    UPDATE chats
+    SET message_count = message_count + jsonb_array_length(p_messages),
+        last_message = p_last_message,
+        updated_at = NOW()
+    WHERE id = p_chat_id AND user_id = p_user_id
+    RETURNING message_count - jsonb_array_length(p_messages) INTO v_start;
+
+    IF v_start IS NULL THEN
+        RAISE EXCEPTION 'Chat % not found', p_chat_id USING ERRCODE = 'P0002';
+    END IF;
+
+    RETURN QUERY
+    INSERT INTO chat_messages (chat_id, seq, user_id, role, content, file_path, created_at)
+    SELECT p_chat_id,
+           v_start + m.ordinality::INTEGER,
+           p_user_id,
+           m.value->>'role',
+           m.value->>'content',
+           m.value->>'file_path',
+           COALESCE((m.value->>'timestamp')::TIMESTAMPTZ, NOW())
+    FROM jsonb_array_elements(p_messages) WITH ORDINALITY AS m
+    RETURNING *;
+END;
+$$;
+
+-- Move messages stored in the legacy chats.messages array into chat_messages
+INSERT INTO chat_messages (chat_id, seq, user_id, role, content, created_at)
+SELECT c.id,
+       m.ordinality::INTEGER,
+       c.user_id,
+       m.value->>'role',
+       m.value->>'content',
+       COALESCE((m.value->>'timestamp')::TIMESTAMPTZ, c.created_at)
+FROM chats c, jsonb_array_elements(c.messages) WITH ORDINALITY AS m
+ON CONFLICT (chat_id, seq) DO NOTHING;
+
+UPDATE chats
+SET message_count = jsonb_array_length(messages),
+    messages = '[]'::jsonb
+WHERE jsonb_array_length(messages) > 0;
+
+-- Keyset pagination of a user's history on (updated_at, id)
+CREATE INDEX IF NOT EXISTS idx_chats_user_updated_at_id ON chats(user_id, updated_at DESC, id DESC);
+
+-- Keyset paging for bulk report export
+CREATE INDEX IF NOT EXISTS idx_reports_user_created_at_id ON reports(user_id, created_at, id);
+
+-- Reports produced by batch jobs (which run in the API's local job queue) have no chat
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS job_id UUID;
+CREATE INDEX IF NOT EXISTS idx_reports_job_id ON reports(job_id);
+
+-- Rolling conversation summary (and the last message seq it covers) and the chat's latest
+-- uploaded file, used to keep chat prompts within a token budget
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS context_summary TEXT;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS context_summary_seq INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS context_file_hash TEXT;
+
+-- Turns written by save_chat_turn, so a retried write returns the stored messages
+-- instead of appending them again
+CREATE TABLE IF NOT EXISTS chat_turn_writes (
+    turn_id UUID PRIMARY KEY,
+    chat_id UUID REFERENCES chats(id) ON DELETE CASCADE,
+    user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE,
+    first_seq INTEGER NOT NULL,
+    message_count INTEGER NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE chat_turn_writes ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own turn writes"
+    ON chat_turn_writes FOR SELECT
+    USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can insert their own turn writes"
+    ON chat_turn_writes FOR INSERT
+    WITH CHECK (auth.uid() = user_id);
+
+-- Saves a chat turn in one transaction: creates the chat if needed, appends the messages
+-- and, when p_report is given ({id, bias_detected, reasons, fixes, categories, created_at}), inserts
+-- the report. Calling it again with the same p_turn_id returns the messages stored the
+-- first time and changes nothing.
+CREATE OR REPLACE FUNCTION save_chat_turn(
+    p_turn_id UUID,
+    p_chat_id UUID,
+    p_user_id UUID,
+    p_messages JSONB,
+    p_last_message TEXT,
+    p_report JSONB DEFAULT NULL
+) RETURNS SETOF chat_messages
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_first INTEGER;
+    v_count INTEGER;
+    v_row chat_messages%ROWTYPE;
+BEGIN
+    SELECT first_seq, message_count INTO v_first, v_count
+    FROM chat_turn_writes
+    WHERE turn_id = p_turn_id AND user_id = p_user_id;
+
+    IF FOUND THEN
+        RETURN QUERY
+        SELECT * FROM chat_messages
+        WHERE chat_id = p_chat_id AND seq >= v_first AND seq < v_first + v_count
+        ORDER BY seq;
+        RETURN;
+    END IF;
+
+    FOR v_row IN SELECT * FROM append_chat_messages(p_chat_id, p_user_id, p_messages, p_last_message) LOOP
+        v_first := LEAST(COALESCE(v_first, v_row.seq), v_row.seq);
+        RETURN NEXT v_row;
+    END LOOP;
+
+    -- A concurrent duplicate of this turn fails here on the primary key and rolls back
+    INSERT INTO chat_turn_writes (turn_id, chat_id, user_id, first_seq, message_count)
+    VALUES (p_turn_id, p_chat_id, p_user_id, v_first, jsonb_array_length(p_messages));
+
+    IF p_report IS NOT NULL THEN
+        INSERT INTO reports (id, user_id, chat_id, bias_detected, reasons, fixes, categories, created_at)
+        VALUES (
+            (p_report->>'id')::UUID,
+            p_user_id,
+            p_chat_id,
+            (p_report->>'bias_detected')::BOOLEAN,
+            ARRAY(SELECT jsonb_array_elements_text(p_report->'reasons')),
+            ARRAY(SELECT jsonb_array_elements_text(p_report->'fixes')),
+            ARRAY(SELECT jsonb_array_elements_text(COALESCE(p_report->'categories', '[]'::jsonb))),
+            COALESCE((p_report->>'created_at')::TIMESTAMPTZ, NOW())
+        );
+    END IF;
+END;
+$$;
+
+-- Bias categories of each report (see bias_categories.py), set by the API when the report is written
+ALTER TABLE reports ADD COLUMN IF NOT EXISTS categories TEXT[] NOT NULL DEFAULT ARRAY[]::TEXT[];
+CREATE INDEX IF NOT EXISTS idx_reports_categories ON reports USING GIN (categories);
+
+-- Categories mentioned by a list of reasons; mirrors CATEGORY_PATTERNS in bias_categories.py
+-- and is only used to backfill reports written before the categories column existed
+CREATE OR REPLACE FUNCTION bias_categories(p_reasons TEXT[])
+RETURNS TEXT[]
+LANGUAGE sql IMMUTABLE
+AS $$
+    SELECT COALESCE(NULLIF(ARRAY(
+        SELECT p.category
+        FROM (VALUES
+            (1, 'gender', '\y(gender\w*|sex|sexis\w*|women|woman|men|man|male|female|masculine|feminine)\y'),
+            (2, 'racial', '\y(racial\w*|race|races|racis\w*|ethnic\w*|skin colou?r)\y'),
+            (3, 'age', '\y(age|ageis\w*|aged|older|younger|elderly|youth)\y'),
+            (4, 'socioeconomic', '\y(socio-?economic\w*|income|wealth\w*|poverty|poor|social class|zip ?codes?|postcodes?)\y'),
+            (5, 'cultural', '\y(cultur\w*|religio\w*|nationalit\w*)\y'),
+            (6, 'selection', '\y(selection|self-selected|survivorship)\y'),
+            (7, 'confirmation', '\yconfirmation\y'),
+            (8, 'sampling', '\y(sampl\w*|under-?represent\w*|over-?represent\w*|unrepresentative)\y'),
+            (9, 'algorithmic', '\y(algorithm\w*|proxy|proxies|feedback loops?)\y')
+        ) AS p(position, category, pattern)
+        WHERE array_to_string(p_reasons, E'\n') ~* p.pattern
+        ORDER BY p.position
+    ), ARRAY[]::TEXT[]), ARRAY['other']);
+$$;
+
+UPDATE reports
+SET categories = bias_categories(reasons)
+WHERE bias_detected AND categories = ARRAY[]::TEXT[];
+
+-- Per-user, per-day counts of reports with bias detected, by category; category 'all'
+-- counts every such report once. Maintained by the trigger below, so analytics read a
+-- few rows per day instead of scanning reports.
+CREATE TABLE IF NOT EXISTS report_rollups (
+    user_id UUID REFERENCES auth.users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    category TEXT NOT NULL,
+    report_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, day, category)
+);
+
+ALTER TABLE report_rollups ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own rollups"
+    ON report_rollups FOR SELECT
+    USING (auth.uid() = user_id);
+
+-- Runs as the owner, since users can't write rollups directly
+CREATE OR REPLACE FUNCTION update_report_rollups()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    v_row reports%ROWTYPE;
+    v_delta INTEGER;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        v_row := NEW;
+        v_delta := 1;
+    ELSE
+        v_row := OLD;
+        v_delta := -1;
+    END IF;
+
+    IF v_row.bias_detected AND v_row.user_id IS NOT NULL THEN
+        INSERT INTO report_rollups (user_id, day, category, report_count)
+        SELECT v_row.user_id, (v_row.created_at AT TIME ZONE 'UTC')::DATE, c.category, v_delta
+        FROM unnest(array_append(v_row.categories, 'all')) AS c(category)
+        ON CONFLICT (user_id, day, category)
+        DO UPDATE SET report_count = report_rollups.report_count + EXCLUDED.report_count;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS reports_update_rollups ON reports;
+CREATE TRIGGER reports_update_rollups
+    AFTER INSERT OR DELETE ON reports
+    FOR EACH ROW EXECUTE FUNCTION update_report_rollups();
+
+-- Rollups for reports written before the trigger existed
+INSERT INTO report_rollups (user_id, day, category, report_count)
+SELECT r.user_id, (r.created_at AT TIME ZONE 'UTC')::DATE, c.category, COUNT(*)
+FROM reports r, unnest(array_append(r.categories, 'all')) AS c(category)
+WHERE r.bias_detected AND r.user_id IS NOT NULL
+GROUP BY 1, 2, 3
+ON CONFLICT (user_id, day, category) DO NOTHING;
+
+-- A user's rollups between two days, summed per day, ISO week or month: one row per
+-- non-empty bucket with a {category: count} object
+CREATE OR REPLACE FUNCTION bias_analytics(
+    p_user_id UUID,
+    p_start DATE,
+    p_end DATE,
+    p_bucket TEXT
+) RETURNS TABLE (bucket_start DATE, counts JSONB)
+LANGUAGE sql STABLE
+AS $$
+    SELECT b.bucket_start, jsonb_object_agg(b.category, b.report_count)
+    FROM (
+        SELECT date_trunc(p_bucket, r.day)::DATE AS bucket_start, r.category, SUM(r.report_count)::INTEGER AS report_count
+        FROM report_rollups r
+        WHERE r.user_id = p_user_id AND r.day BETWEEN p_start AND p_end
+        GROUP BY 1, 2
+        HAVING SUM(r.report_count) > 0
+    ) b
+    GROUP BY b.bucket_start
+    ORDER BY b.bucket_start;
+$$;
+
+-- Files attached to messages, so the upload garbage collector can tell which objects
+-- are still referenced
+CREATE INDEX IF NOT EXISTS idx_chat_messages_file_path ON chat_messages(file_path) WHERE file_path IS NOT NULL;
+
+-- Registry of objects in the uploads bucket, upserted on every upload (including ones
+-- deduplicated against an existing object). Not tied to auth.users, so objects of deleted
+-- users are still collected. Objects uploaded before messages recorded their file_path
+-- are deliberately not backfilled: nothing says which chats still use them.
+CREATE TABLE IF NOT EXISTS upload_objects (
+    path TEXT PRIMARY KEY,
+    user_id UUID NOT NULL,
+    size BIGINT,
+    uploaded_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_objects_uploaded_at ON upload_objects(uploaded_at, path);
+
+ALTER TABLE upload_objects ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own uploads"
+    ON upload_objects FOR SELECT
+    USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can register their own uploads"
+    ON upload_objects FOR INSERT
+    WITH CHECK (auth.uid() = user_id);
+
+CREATE POLICY "Users can update their own uploads"
+    ON upload_objects FOR UPDATE
+    USING (auth.uid() = user_id);
+
+-- Deletes many of a user's chats in one statement. Messages, reports (and their rollups)
+-- and turn writes go with them through ON DELETE CASCADE; RLS still applies.
+CREATE OR REPLACE FUNCTION delete_chats(
+    p_user_id UUID,
+    p_chat_ids UUID[]
+) RETURNS TABLE (id UUID)
+LANGUAGE sql
+AS $$
+    DELETE FROM chats c
+    WHERE c.user_id = p_user_id AND c.id = ANY(p_chat_ids)
+    RETURNING c.id;
+$$;
+
+-- Tombstones of deleted chats, so /api/history's delta mode can tell clients which chats
+-- to drop. Kept for 30 days (CHAT_TOMBSTONE_DAYS in main.py); older delta syncs must
+-- start over.
+CREATE TABLE IF NOT EXISTS chat_deletions (
+    chat_id UUID NOT NULL,
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    deleted_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (chat_id, deleted_at)
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_deletions_user_deleted_at ON chat_deletions(user_id, deleted_at, chat_id);
+
+ALTER TABLE chat_deletions ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own chat deletions"
+    ON chat_deletions FOR SELECT
+    USING (auth.uid() = user_id);
+
+-- Runs as the owner since users can't insert tombstones themselves
+CREATE OR REPLACE FUNCTION record_chat_deletions()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO chat_deletions (chat_id, user_id)
+    SELECT d.id, d.user_id FROM deleted_chats d WHERE d.user_id IS NOT NULL;
+    DELETE FROM chat_deletions
+    WHERE user_id IN (SELECT d.user_id FROM deleted_chats d)
+      AND deleted_at < NOW() - INTERVAL '30 days';
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS chats_record_deletions ON chats;
+CREATE TRIGGER chats_record_deletions
+    AFTER DELETE ON chats
+    REFERENCING OLD TABLE AS deleted_chats
+    FOR EACH STATEMENT EXECUTE FUNCTION record_chat_deletions();
+
+-- Registered uploads older than p_before that no message refers to, oldest first, after
+-- the keyset position (p_after_uploaded_at, p_after_path). Runs as the owner: the sweeper
+-- isn't signed in as any user, so RLS would hide every upload_objects row from it.
+CREATE OR REPLACE FUNCTION orphaned_uploads(
+    p_before TIMESTAMPTZ,
+    p_limit INTEGER,
+    p_after_uploaded_at TIMESTAMPTZ DEFAULT NULL,
+    p_after_path TEXT DEFAULT NULL
+) RETURNS SETOF upload_objects
+LANGUAGE sql STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT u.*
+    FROM upload_objects u
+    WHERE u.uploaded_at < p_before
+      AND (p_after_uploaded_at IS NULL OR (u.uploaded_at, u.path) > (p_after_uploaded_at, p_after_path))
+      AND NOT EXISTS (SELECT 1 FROM chat_messages m WHERE m.file_path = u.path)
+    ORDER BY u.uploaded_at, u.path
+    LIMIT p_limit;
+$$;
+
+-- Removes registry rows of uploads that are still unreferenced and weren't uploaded again
+-- since p_before, returning them; the caller then deletes the objects from storage. Runs
+-- as the owner like orphaned_uploads, since upload_objects has no DELETE policy.
+CREATE OR REPLACE FUNCTION claim_orphaned_uploads(
+    p_paths TEXT[],
+    p_before TIMESTAMPTZ
+) RETURNS SETOF upload_objects
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    DELETE FROM upload_objects u
+    WHERE u.path = ANY(p_paths)
+      AND u.uploaded_at < p_before
+      AND NOT EXISTS (SELECT 1 FROM chat_messages m WHERE m.file_path = u.path)
+    RETURNING u.*;
+$$;
+
+-- Dataset lineages: uploads of the same file name by a user (or uploads naming a lineage)
+-- are numbered versions of one dataset. Re-uploading the latest version's content doesn't
+-- add a version.
+CREATE TABLE IF NOT EXISTS dataset_versions (
+    lineage_id UUID NOT NULL,
+    version INTEGER NOT NULL,
+    user_id UUID NOT NULL REFERENCES auth.users(id) ON DELETE CASCADE,
+    file_name TEXT NOT NULL,
+    file_hash TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    PRIMARY KEY (lineage_id, version)
+);
+
+CREATE INDEX IF NOT EXISTS idx_dataset_versions_user_file ON dataset_versions(user_id, file_name, created_at DESC);
+
+ALTER TABLE dataset_versions ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Users can view their own dataset versions"
+    ON dataset_versions FOR SELECT
+    USING (auth.uid() = user_id);
+
+CREATE POLICY "Users can insert their own dataset versions"
+    ON dataset_versions FOR INSERT
+    WITH CHECK (auth.uid() = user_id);
+
+-- Adds an upload to p_lineage_id, or to the lineage of the user's latest upload with the same
+-- file name (a new lineage if there is none). Returns the lineage, the upload's version and
+-- the previous version's hash; no row if p_lineage_id isn't one of the user's lineages.
+CREATE OR REPLACE FUNCTION record_dataset_version(
+    p_user_id UUID,
+    p_file_name TEXT,
+    p_file_hash TEXT,
+    p_lineage_id UUID DEFAULT NULL
+) RETURNS TABLE (lineage_id UUID, version INTEGER, parent_hash TEXT)
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    v_lineage UUID := p_lineage_id;
+    v_latest dataset_versions%ROWTYPE;
+BEGIN
+    -- Numbers a user's versions one upload at a time
+    PERFORM pg_advisory_xact_lock(hashtext('dataset_versions:' || p_user_id::TEXT));
+
+    IF v_lineage IS NULL THEN
+        SELECT d.lineage_id INTO v_lineage
+        FROM dataset_versions d
+        WHERE d.user_id = p_user_id AND d.file_name = p_file_name
+        ORDER BY d.created_at DESC
+        LIMIT 1;
+    END IF;
+
+    IF v_lineage IS NULL THEN
+        INSERT INTO dataset_versions (lineage_id, version, user_id, file_name, file_hash)
+        VALUES (uuid_generate_v4(), 1, p_user_id, p_file_name, p_file_hash)
+        RETURNING dataset_versions.lineage_id INTO v_lineage;
+        RETURN QUERY SELECT v_lineage, 1, NULL::TEXT;
+        RETURN;
+    END IF;
+
+    SELECT * INTO v_latest
+    FROM dataset_versions d
+    WHERE d.lineage_id = v_lineage AND d.user_id = p_user_id
+    ORDER BY d.version DESC
+    LIMIT 1;
+    IF NOT FOUND THEN
+        RETURN;
+    END IF;
+
+    IF v_latest.file_hash = p_file_hash THEN
+        RETURN QUERY
+        SELECT v_lineage, v_latest.version, (
+            SELECT d.file_hash FROM dataset_versions d
+            WHERE d.lineage_id = v_lineage AND d.version = v_latest.version - 1
+        );
+        RETURN;
+    END IF;
+
+    INSERT INTO dataset_versions (lineage_id, version, user_id, file_name, file_hash)
+    VALUES (v_lineage, v_latest.version + 1, p_user_id, p_file_name, p_file_hash);
+    RETURN QUERY SELECT v_lineage, v_latest.version + 1, v_latest.file_hash;
+END;
+$$;
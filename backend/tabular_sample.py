@@ -0,0 +1,272 @@
+"""Representative samples of tabular files for prompt construction.
+
+A file too large to send whole used to be represented by its first few thousand
+characters, i.e. by whatever rows the file happened to be sorted to start with.
+TabularSampler instead sees every row batch of the single pass that computes
+the fairness metrics and keeps:
+- a reservoir sample (Algorithm R) per stratum, where strata are the value
+  combinations of up to two categorical columns (the outcome column and a
+  protected attribute when there are ones, otherwise the lowest-cardinality
+  categorical columns), so small groups are represented however rare they are
+- per-column statistics: missing rate, numeric min/max/mean/std, and the most
+  common values with their shares
+
+Memory is bounded by MAX_STRATA reservoirs and the value counters, whatever the
+file size. render_sample() turns the result into prompt text of at most a given
+number of characters: column statistics first, then sample rows allocated to
+strata in proportion to their size with at least one row each. The sample is
+seeded, so the same file always renders the same prompt (and hits the analysis
+cache).
+"""
+import csv
+import heapq
+import io
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from fairness_metrics import MAX_GROUPS, detect_label_column, detect_protected_columns, to_float
+
+SAMPLE_MAX_ROWS = 100  # Per stratum
+MAX_STRATA = 32  # Further value combinations share one "(other)" stratum
+MAX_STRATA_COLUMNS = 2
+MAX_TRACKED_VALUES = 1000  # Distinct values counted per column before it is treated as free text
+TOP_VALUES = 5
+MAX_LISTED_NUMBERS = 10  # Numeric columns with at most this many distinct values also list them, e.g. 0/1 outcomes
+OTHER_STRATUM = "(other)"
+KEY_SEPARATOR = "\x1f"
+
+
+class _Reservoir:
+    """Uniform sample of up to k rows from the rows routed to it"""
+
+    def __init__(self, k: int, rng: np.random.Generator):
+        self.k = k
+        self.seen = 0
+        self.rows: List[List[str]] = []
+        self._rng = rng
+
+    def add(self, columns: Sequence[np.ndarray], indices: np.ndarray):
+        start = 0
+        # Fill the reservoir first
+        while len(self.rows) < self.k and start < len(indices):
+            self.rows.append([str(column[indices[start]]) for column in columns])
+            start += 1
+        if start < len(indices):
+            # Algorithm R, vectorised: the i-th row seen replaces a random slot with probability k / (i + 1)
+            positions = np.arange(self.seen + start, self.seen + len(indices))
+            slots = self._rng.integers(0, positions + 1)
+            for offset in np.nonzero(slots < self.k)[0]:
+                row = indices[start + offset]
+                self.rows[slots[offset]] = [str(column[row]) for column in columns]
+        self.seen += len(indices)
+
+
+class _ColumnStats:
+    """Running statistics of one column"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.missing = 0
+        self.numeric = True
+        self.count = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.values: Optional[Dict[str, int]] = {}  # None once there are too many distinct values
+
+    def add(self, column: np.ndarray, missing: np.ndarray):
+        self.missing += int(missing.sum())
+        present = column[~missing]
+        if self.numeric:
+            try:
+                numbers = present.astype(float)
+            except ValueError:
+                self.numeric = False
+            else:
+                self.count += len(numbers)
+                self.total += float(numbers.sum())
+                self.total_squares += float(np.square(numbers).sum())
+                if len(numbers):
+                    self.minimum = min(self.minimum, float(numbers.min()))
+                    self.maximum = max(self.maximum, float(numbers.max()))
+        if self.values is not None:
+            values, counts = np.unique(present, return_counts=True)
+            for value, count in zip(values.tolist(), counts.tolist()):
+                self.values[value] = self.values.get(value, 0) + count
+            if len(self.values) > MAX_TRACKED_VALUES:
+                self.values = None
+
+    def result(self, rows: int) -> Dict[str, Any]:
+        stats: Dict[str, Any] = {
+            "name": self.name,
+            "missingRate": round(self.missing / rows, 4) if rows else 0.0,
+        }
+        if self.numeric and self.count:
+            mean = self.total / self.count
+            variance = max(self.total_squares / self.count - mean * mean, 0.0)
+            stats.update({
+                "type": "numeric",
+                "min": self.minimum,
+                "max": self.maximum,
+                "mean": round(mean, 4),
+                "std": round(math.sqrt(variance), 4),
+            })
+        else:
+            stats["type"] = "categorical" if self.values is not None and len(self.values) <= MAX_GROUPS else "text"
+        if self.values is not None:
+            present = rows - self.missing
+            top = sorted(self.values.items(), key=lambda item: -item[1])[:TOP_VALUES]
+            stats["distinct"] = len(self.values)
+            stats["top"] = [[value, round(count / present, 4) if present else 0.0] for value, count in top]
+        else:
+            stats["distinct"] = f">{MAX_TRACKED_VALUES}"
+        return stats
+
+
+def choose_strata_columns(header: Sequence[str], columns: Sequence[np.ndarray]) -> List[int]:
+    """Columns to stratify on, judged from the first batch"""
+    def categorical(index: int) -> bool:
+        column = columns[index]
+        distinct = len(np.unique(column))
+        return 1 < distinct <= MAX_GROUPS and (to_float(column) is None or distinct <= MAX_LISTED_NUMBERS)
+
+    chosen: List[int] = []
+    label = detect_label_column(header, columns)
+    if label is not None:
+        chosen.append(label[0])
+    for index in detect_protected_columns(header, columns):
+        if len(chosen) < MAX_STRATA_COLUMNS and index not in chosen and categorical(index):
+            chosen.append(index)
+    if not chosen:
+        candidates = sorted((len(np.unique(columns[index])), index) for index in range(len(header)) if categorical(index))
+        chosen = [index for _, index in candidates[:MAX_STRATA_COLUMNS]]
+    return chosen[:MAX_STRATA_COLUMNS]
+
+
+class TabularSampler:
+    """Stratified reservoir sample and column statistics, built from a stream of column batches"""
+
+    def __init__(self, max_rows: int = SAMPLE_MAX_ROWS, seed: int = 0):
+        self.max_rows = max_rows
+        self.rows = 0
+        self.header: List[str] = []
+        self.strata_columns: List[int] = []
+        self._strata: Dict[str, _Reservoir] = {}
+        self._columns: List[_ColumnStats] = []
+        self._rng = np.random.default_rng(seed)
+
+    def add_batch(self, header: List[str], columns: List[np.ndarray], missing: np.ndarray):
+        """compute_fairness_metrics on_batch hook"""
+        if not columns:
+            return
+        if not self.header:
+            self.header = list(header)
+            self.strata_columns = choose_strata_columns(header, columns)
+            self._columns = [_ColumnStats(name) for name in header]
+        count = len(columns[0])
+        self.rows += count
+        for stats, column, column_missing in zip(self._columns, columns, missing):
+            stats.add(column, column_missing)
+
+        if self.strata_columns:
+            keys = np.char.strip(columns[self.strata_columns[0]])
+            for index in self.strata_columns[1:]:
+                keys = np.char.add(np.char.add(keys, KEY_SEPARATOR), np.char.strip(columns[index]))
+            values, inverse = np.unique(keys, return_inverse=True)
+        else:
+            values, inverse = np.array([""]), np.zeros(count, dtype=int)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(values) + 1))
+        for position, key in enumerate(values.tolist()):
+            if key not in self._strata and len(self._strata) >= MAX_STRATA:
+                key = OTHER_STRATUM
+            reservoir = self._strata.get(key)
+            if reservoir is None:
+                reservoir = self._strata[key] = _Reservoir(self.max_rows, self._rng)
+            reservoir.add(columns, order[bounds[position]:bounds[position + 1]])
+
+    def result(self) -> Dict[str, Any]:
+        """JSON-serialisable sample, stored with the file's artifacts"""
+        strata = sorted(self._strata.items(), key=lambda item: -item[1].seen)
+        return {
+            "rows": self.rows,
+            "columns": self.header,
+            "strataColumns": [self.header[index] for index in self.strata_columns],
+            "strata": [
+                {"key": key.split(KEY_SEPARATOR) if key != OTHER_STRATUM else [OTHER_STRATUM],
+                 "count": reservoir.seen, "rows": reservoir.rows}
+                for key, reservoir in strata
+            ],
+            "columnStats": [stats.result(self.rows) for stats in self._columns],
+        }
+
+
+def _format_number(value: float) -> str:
+    return f"{value:.4g}"
+
+
+def describe_column(stats: Dict[str, Any]) -> str:
+    line = f"- {stats['name']}: {stats['type']}, missing {stats['missingRate']:.1%}"
+    if stats["type"] == "numeric":
+        line += (f", min {_format_number(stats['min'])}, max {_format_number(stats['max'])}, "
+                 f"mean {_format_number(stats['mean'])}, std {_format_number(stats['std'])}")
+    line += f", {stats['distinct']} distinct"
+    if stats.get("top") and (stats["type"] != "numeric" or stats["distinct"] <= MAX_LISTED_NUMBERS):
+        line += ": " + ", ".join(f"{value} {share:.1%}" for value, share in stats["top"])
+    return line
+
+
+def allocate_rows(strata: List[Dict[str, Any]]) -> List[tuple[int, int]]:
+    """(stratum, row) pairs in the order rows should be added to a prompt.
+
+    One row from every stratum first, then the rest so that any prefix is as close to
+    proportional to the strata sizes as possible (Sainte-Laguë divisors).
+    """
+    order = [(index, 0) for index, stratum in enumerate(strata) if stratum["rows"]]
+    heap = [(1.5 / stratum["count"], index) for index, stratum in enumerate(strata) if len(stratum["rows"]) > 1]
+    heapq.heapify(heap)
+    taken = {index: 1 for index, _ in order}
+    while heap:
+        _, index = heapq.heappop(heap)
+        order.append((index, taken[index]))
+        taken[index] += 1
+        if taken[index] < len(strata[index]["rows"]):
+            heapq.heappush(heap, ((2 * taken[index] + 1) / strata[index]["count"], index))
+    return order
+
+
+def render_sample(sample: Dict[str, Any], max_chars: int) -> str:
+    """Prompt text for a sample: column statistics, strata shares and CSV rows, within max_chars"""
+    rows = sample["rows"]
+    lines = [f"Rows: {rows}; columns: {len(sample['columns'])}", "Column statistics:"]
+    lines.extend(describe_column(stats) for stats in sample["columnStats"])
+    if sample["strataColumns"] and rows:
+        shares = ", ".join(
+            f"{'/'.join(stratum['key'])} {stratum['count'] / rows:.1%}" for stratum in sample["strata"][:MAX_STRATA]
+        )
+        lines.append(f"Row shares by {' / '.join(sample['strataColumns'])}: {shares}")
+    # Statistics get at most half the budget, so there is always room for some rows
+    text = "\n".join(lines)[:max_chars // 2]
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(sample["columns"])
+    stratified = f" stratified by {' / '.join(sample['strataColumns'])}" if sample["strataColumns"] else ""
+    intro = f"\n\nRandom sample of rows{stratified} (CSV):\n"
+    used = len(text) + len(intro) + buffer.tell()
+    added = 0
+    for stratum, row in allocate_rows(sample["strata"]):
+        start = buffer.tell()
+        writer.writerow(sample["strata"][stratum]["rows"][row])
+        if used + buffer.tell() - start > max_chars:
+            buffer.seek(start)
+            buffer.truncate()
+            break
+        used += buffer.tell() - start
+        added += 1
+    if not added:
+        return text
+    return text + intro + buffer.getvalue()
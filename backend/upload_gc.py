@@ -0,0 +1,119 @@
+"""Background garbage collection of orphaned upload objects.
+
+Uploads are content-addressed and shared by every message that attaches the
+same file, so an object can only be removed once no chat message refers to it
+any more, which happens when chats are deleted (or never, for a file that was
+uploaded and not used). The collector sweeps the uploads registry in pages,
+oldest first: each page of candidates is claimed (their registry rows deleted,
+as long as they haven't been re-uploaded since the sweep started) and then the
+objects are removed from storage in one batch call; if that fails, the claimed
+paths are put back in the registry for the next sweep. Candidates still needed
+elsewhere, such as by unfinished batch jobs, are skipped. Objects younger than
+a grace period are never touched, so a file that has just been uploaded but
+not sent in a chat yet is safe.
+
+Sweeps run every interval_seconds and straight away when wake() is called,
+e.g. after chats are deleted.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# (uploaded before, after (uploaded_at, path) or None, limit) -> registry rows {path, uploaded_at, ...}
+FindOrphans = Callable[[float, Optional[tuple], int], Awaitable[List[Dict[str, Any]]]]
+# (paths, uploaded before) -> the registry rows deleted
+Claim = Callable[[List[str], float], Awaitable[List[Dict[str, Any]]]]
+
+
+class UploadCollector:
+    """Periodic sweep removing upload objects that nothing references"""
+
+    def __init__(self, find_orphans: FindOrphans, claim: Claim, remove: Callable[[List[str]], Awaitable[Any]],
+                 release: Callable[[List[Dict[str, Any]]], Awaitable[Any]], in_use: Callable[[], Awaitable[Set[str]]],
+                 interval_seconds: float = 3600.0, grace_seconds: float = 86400.0, batch_size: int = 100):
+        self.find_orphans = find_orphans
+        self.claim = claim
+        self.remove = remove
+        self.release = release
+        self.in_use = in_use
+        self.interval_seconds = interval_seconds
+        self.grace_seconds = grace_seconds
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self.sweeps = 0
+        self.removed = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_sweep_at: Optional[float] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def wake(self):
+        """Sweep now rather than at the next interval"""
+        self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.sweep()
+            except Exception as e:
+                self.failures += 1
+                logger.error(f"Upload garbage collection error: {str(e)}")
+
+    async def sweep(self) -> int:
+        """Remove every orphaned object older than the grace period; returns how many were removed"""
+        cutoff = time.time() - self.grace_seconds
+        in_use = await self.in_use()
+        removed = 0
+        after = None
+        while True:
+            rows = await self.find_orphans(cutoff, after, self.batch_size)
+            if not rows:
+                break
+            after = (rows[-1]["uploaded_at"], rows[-1]["path"])
+            candidates = [row["path"] for row in rows if row["path"] not in in_use]
+            self.skipped += len(rows) - len(candidates)
+            if candidates:
+                # Claim first: a path re-uploaded since the cutoff drops out here and keeps its object
+                claimed = await self.claim(candidates, cutoff)
+                if claimed:
+                    try:
+                        await self.remove([row["path"] for row in claimed])
+                    except Exception:
+                        # Put them back in the registry so a later sweep retries them
+                        await self.release(claimed)
+                        raise
+                    removed += len(claimed)
+            if len(rows) < self.batch_size:
+                break
+        self.sweeps += 1
+        self.removed += removed
+        self.last_sweep_at = time.time()
+        if removed:
+            logger.info(f"Removed {removed} orphaned uploads")
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sweeps": self.sweeps,
+            "removed": self.removed,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "lastSweepAt": self.last_sweep_at,
+        }
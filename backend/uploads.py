@@ -0,0 +1,157 @@
+"""Streaming uploads to Supabase storage.
+
+Uploads are read in fixed-size chunks so memory per upload stays constant: one
+pass hashes and sizes the file, then the bytes are streamed to storage, either
+as a single request body or, for large files, through the TUS resumable
+protocol so a dropped connection resumes from the last acknowledged offset.
+"""
+import base64
+import hashlib
+import logging
+from typing import AsyncIterator, Optional
+
+import httpx
+from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+# Supabase's resumable endpoint expects 6 MB chunks
+RESUMABLE_CHUNK_SIZE = 6 * 1024 * 1024
+RESUMABLE_MAX_RETRIES = 3
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured maximum size"""
+
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File exceeds the maximum upload size of {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+
+async def hash_upload(file: UploadFile, max_bytes: int, chunk_size: int, copy_to=None) -> tuple[str, int]:
+    """Return (sha256 hex, size) of an upload, stopping as soon as it exceeds max_bytes.
+
+    copy_to, an async file object, receives a copy of the bytes as they are read.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    await file.seek(0)
+    while chunk := await file.read(chunk_size):
+        size += len(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        digest.update(chunk)
+        if copy_to is not None:
+            await copy_to.write(chunk)
+    await file.seek(0)
+    return digest.hexdigest(), size
+
+
+async def iter_upload(file: UploadFile, chunk_size: int, offset: int = 0) -> AsyncIterator[bytes]:
+    """Yield an upload's bytes from offset in chunks"""
+    await file.seek(offset)
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+async def object_exists(session: httpx.AsyncClient, bucket: str, path: str) -> bool:
+    """Whether an object is already stored at path"""
+    response = await session.head(f"object/{bucket}/{path}")
+    return response.status_code == 200
+
+
+def is_duplicate(response: httpx.Response) -> bool:
+    """Whether storage refused an upload because the object already exists.
+
+    Storage answers 409, or (in older versions) 400 with the 409 in the error body.
+    """
+    if response.status_code == 409:
+        return True
+    return response.status_code == 400 and str(_error_body(response).get("statusCode")) == "409"
+
+
+def _error_body(response: httpx.Response) -> dict:
+    """The JSON error body of a storage response, or {} if there isn't one"""
+    try:
+        body = response.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+async def stream_upload(session: httpx.AsyncClient, bucket: str, path: str, file: UploadFile,
+                        content_type: Optional[str], chunk_size: int) -> bool:
+    """Upload a file as one streamed request body; False if a concurrent upload stored it first"""
+    response = await session.post(
+        f"object/{bucket}/{path}",
+        content=iter_upload(file, chunk_size),
+        headers={"content-type": content_type or "application/octet-stream", "x-upsert": "false"},
+    )
+    if is_duplicate(response):
+        return False
+    response.raise_for_status()
+    return True
+
+
+def _tus_metadata(**values: str) -> str:
+    return ",".join(f"{key} {base64.b64encode(value.encode()).decode()}" for key, value in values.items())
+
+
+async def resumable_upload(session: httpx.AsyncClient, bucket: str, path: str, file: UploadFile,
+                           size: int, content_type: Optional[str]) -> bool:
+    """Upload a file in RESUMABLE_CHUNK_SIZE pieces over TUS, resuming after failed chunks.
+
+    Returns False if a concurrent upload stored the object first, either before ours was
+    created or before its last chunk landed.
+    """
+    tus_headers = {"Tus-Resumable": "1.0.0"}
+    created = await session.post(
+        "upload/resumable",
+        headers={
+            **tus_headers,
+            "Upload-Length": str(size),
+            "Upload-Metadata": _tus_metadata(
+                bucketName=bucket,
+                objectName=path,
+                contentType=content_type or "application/octet-stream",
+            ),
+            "x-upsert": "false",
+        },
+    )
+    if is_duplicate(created):
+        return False
+    created.raise_for_status()
+    location = created.headers["Location"]
+
+    offset = 0
+    retries = 0
+    while offset < size:
+        await file.seek(offset)
+        chunk = await file.read(RESUMABLE_CHUNK_SIZE)
+        try:
+            response = await session.patch(
+                location,
+                content=chunk,
+                headers={
+                    **tus_headers,
+                    "Upload-Offset": str(offset),
+                    "Content-Type": "application/offset+octet-stream",
+                },
+            )
+            # TUS also uses 409 for offset mismatches, so only an explicit Duplicate means
+            # a concurrent upload finished the object first
+            if response.status_code == 409 and _error_body(response).get("error") == "Duplicate":
+                return False
+            response.raise_for_status()
+            offset = int(response.headers["Upload-Offset"])
+            retries = 0
+        except httpx.HTTPError as e:
+            retries += 1
+            if retries > RESUMABLE_MAX_RETRIES:
+                raise
+            logger.warning(f"Resumable upload chunk at {offset} failed, resuming: {str(e)}")
+            # Ask the server how much it actually received before retrying
+            status = await session.head(location, headers=tus_headers)
+            status.raise_for_status()
+            offset = int(status.headers["Upload-Offset"])
+    return True
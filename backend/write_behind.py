@@ -0,0 +1,238 @@
+"""Write-behind persistence through a local SQLite outbox.
+
+A write is acknowledged as soon as it is recorded in the outbox; a background
+flusher then applies it and retries failures with exponential backoff until it
+succeeds (or gives up after max_attempts and keeps it as failed for
+inspection). Entries are leased like batch job items, so:
+- an outbox shared by several workers on one host is drained once
+- entries left by a process that died are flushed after a restart
+Writes with the same key (a chat id) are applied one at a time in the order
+they were queued; writes for different keys are flushed concurrently.
+"""
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Outbox:
+    """SQLite table of pending writes"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        """Connect and create the table (called at startup)"""
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " key TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " status TEXT NOT NULL DEFAULT 'pending',"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt_at REAL NOT NULL,"
+            " lease_until REAL,"
+            " error TEXT,"
+            " created_at REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS idx_outbox_key ON outbox(key, status, id);"
+        )
+
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self._conn)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, key: str, payload: Dict[str, Any]) -> int:
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO outbox (key, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(payload), now, now),
+            )
+            return cursor.lastrowid
+
+    def claim(self, lease_seconds: float, limit: int) -> List[Dict[str, Any]]:
+        """Lease up to limit due entries, only ever the oldest unfinished entry of each key"""
+        now = time.time()
+
+        def claim_due(conn: sqlite3.Connection):
+            rows = conn.execute(
+                "UPDATE outbox SET status = 'running', attempts = attempts + 1, lease_until = :lease_until"
+                " WHERE id IN (SELECT o.id FROM outbox o"
+                "  WHERE o.id = (SELECT MIN(id) FROM outbox WHERE key = o.key AND status IN ('pending', 'running'))"
+                "  AND ((o.status = 'pending' AND o.next_attempt_at <= :now)"
+                "   OR (o.status = 'running' AND o.lease_until < :now))"
+                "  ORDER BY o.id LIMIT :limit)"
+                " RETURNING id, key, payload, attempts",
+                {"now": now, "lease_until": now + lease_seconds, "limit": limit},
+            ).fetchall()
+            return [{"id": row["id"], "key": row["key"], "payload": json.loads(row["payload"]),
+                     "attempts": row["attempts"]} for row in rows]
+
+        return self._transaction(claim_due)
+
+    def complete(self, entry_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE id = ?", (entry_id,))
+
+    def retry(self, entry_id: int, delay: float, error: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'pending', lease_until = NULL, next_attempt_at = ?, error = ?"
+                " WHERE id = ? AND status = 'running'",
+                (time.time() + delay, error, entry_id),
+            )
+
+    def fail(self, entry_id: int, error: str):
+        """Stop retrying an entry; later entries for its key are no longer held back by it"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'failed', lease_until = NULL, error = ? WHERE id = ?", (error, entry_id)
+            )
+
+    def release(self, entry_id: int):
+        """Put a running entry back without counting the attempt (on shutdown)"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = 'pending', lease_until = NULL, attempts = attempts - 1"
+                " WHERE id = ? AND status = 'running'",
+                (entry_id,),
+            )
+
+    def pending(self, key: str) -> List[Dict[str, Any]]:
+        """Payloads not yet applied for a key, oldest first"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT payload FROM outbox WHERE key = ? AND status IN ('pending', 'running') ORDER BY id", (key,)
+            ).fetchall()
+        return [json.loads(row["payload"]) for row in rows]
+
+    def discard(self, keys: Iterable[str]) -> int:
+        """Drop the queued entries of some keys (e.g. their chats were deleted); ones being applied are left to finish"""
+        with self._lock:
+            return self._conn.executemany(
+                "DELETE FROM outbox WHERE key = ? AND status = 'pending'", [(key,) for key in keys]
+            ).rowcount
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in ("pending", "running", "failed")}
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class OutboxFlusher:
+    """Background task applying outbox entries with bounded concurrency and retries"""
+
+    def __init__(self, outbox: Outbox, write: Callable[[Dict[str, Any]], Awaitable[Any]], concurrency: int = 8,
+                 lease_seconds: float = 120.0, max_attempts: int = 20, base_delay: float = 0.5,
+                 max_delay: float = 300.0, poll_seconds: float = 1.0):
+        self.outbox = outbox
+        self.write = write
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_seconds = poll_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._running: Dict[int, asyncio.Task] = {}
+        self._wakeup = asyncio.Event()
+        self.flushed = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self, drain_seconds: float = 5.0):
+        """Stop claiming, give running writes drain_seconds to finish, and release the rest"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._running:
+            await asyncio.wait(list(self._running.values()), timeout=drain_seconds)
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    def wake(self):
+        """Tell the flusher new entries are queued"""
+        self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            entries = []
+            free = self.concurrency - len(self._running)
+            if free > 0:
+                try:
+                    entries = await asyncio.to_thread(self.outbox.claim, self.lease_seconds, free)
+                except Exception as e:
+                    logger.error(f"Outbox claim error: {str(e)}")
+            for entry in entries:
+                self._running[entry["id"]] = asyncio.create_task(self._apply(entry))
+            if entries and len(self._running) < self.concurrency:
+                # Finishing an entry may have unblocked the next one for the same key
+                continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _apply(self, entry: Dict[str, Any]):
+        try:
+            await self.write(entry["payload"])
+        except asyncio.CancelledError:
+            await asyncio.to_thread(self.outbox.release, entry["id"])
+            raise
+        except Exception as e:
+            if entry["attempts"] >= self.max_attempts:
+                self.failed += 1
+                logger.error(f"Write {entry['id']} for {entry['key']} failed after {entry['attempts']} attempts: {str(e)}")
+                await asyncio.to_thread(self.outbox.fail, entry["id"], str(e))
+            else:
+                self.retries += 1
+                # Full jitter, as in the model call scheduler
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** entry["attempts"]))
+                logger.warning(f"Write {entry['id']} for {entry['key']} failed, retry in {delay:.2f}s: {str(e)}")
+                await asyncio.to_thread(self.outbox.retry, entry["id"], delay, str(e))
+        else:
+            self.flushed += 1
+            await asyncio.to_thread(self.outbox.complete, entry["id"])
+        finally:
+            del self._running[entry["id"]]
+            self.wake()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": len(self._running),
+            "flushed": self.flushed,
+            "retries": self.retries,
+            "failed": self.failed,
+            "outbox": self.outbox.counts(),
+        }